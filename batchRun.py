@@ -0,0 +1,294 @@
+# batchRun.py
+#
+# Pass predictions over weeks for several sites, a chunk at a time with checkpoints
+#
+# Harry Krantz
+# Steward Observatory
+# University of Arizona
+# Copyright May 2020
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import datetime as dt
+import hashlib
+import json
+import os
+
+from starlinkPassPredictor import *
+from constellationPropagator import ConstellationPropagator
+from nightContext import NightContext
+from passTable import _aware
+
+
+#Bump whenever a change would make earlier checkpoints unusable
+BATCH_VERSION = 5
+
+
+
+
+# A long prediction split into chunks of time, every finished chunk is saved to its own file in
+# a directory along with a manifest of the chunks done, so a run that is stopped picks up where
+# it left off. Only one chunk of passes is held in memory at a time, the satellites are parsed
+# once for the whole run, and every site is searched from the same propagation.
+# The TLEs are saved with the first chunk so a resumed run uses the same element sets, and
+# resuming with different settings raises an error instead of mixing results.
+# Every pass belongs to the chunk its peak falls in, the search is padded by more than the
+# longest pass so passes crossing a chunk edge are still found complete
+# Args: directory = path, start = datetime, stop = datetime, locs = dict of name : skyfield Topos,
+#       params = [sunUp, moonUp, eclipsed, minAlt], context = EphemerisContext, chunk = timedelta,
+#       partial = bool, pad = timedelta, nights = bool use a NightContext per chunk and site
+class BatchRun:
+
+	def __init__(self, directory, start, stop, locs, params=[False, None, False, 0], context=None, chunk=dt.timedelta(days=1), partial=False, pad=dt.timedelta(minutes=30), nights=True):
+		self.directory = directory
+		self.start = _aware(start)
+		self.stop = _aware(stop)
+		self.locs = locs
+		self.params = list(params)
+		self.context = EphemerisContext() if context == None else context
+		self.chunk = chunk
+		self.partial = partial
+		self.pad = pad
+		self.nights = nights
+
+		if not os.path.isdir(directory):
+			os.makedirs(directory)
+
+
+	# Work through every chunk not already done
+	# The TLEs come from an earlier start of the run if there was one, otherwise from tleList or a download
+	# Args: tleList = array of tle, cache = TLECache
+	# Returns: int number of chunks computed
+	def run(self, tleList=None, cache=None):
+		instruments = self.context.instruments
+		tleList = self.loadTLEs(tleList, cache)
+		manifest = self.loadManifest(tleList)
+		chunks = self.chunks()
+
+		todo = [i for i in range(len(chunks)) if not self.isDone(manifest, i)]
+		instruments.log("Batch run of " + str(len(chunks)) + " chunks, " + str(len(chunks) - len(todo)) + " already done")
+		if len(todo) == 0:
+			return 0
+
+		#Parse the satellites once for every chunk and site
+		with instruments.stage("buildPropagator"):
+			propagator = ConstellationPropagator(tleList, self.context)
+
+		sunUp, moonUp, eclipsed, minAlt = self.params
+		for i in todo:
+			chunkStart, chunkStop = chunks[i]
+			instruments.log("Chunk " + str(i + 1) + " of " + str(len(chunks)) + ": " + chunkStart.strftime('%Y-%m-%d %H:%M:%S') + " to " + chunkStop.strftime('%Y-%m-%d %H:%M:%S'))
+
+			#Search a little wider than the chunk but never outside of the full range
+			searchStart = max(chunkStart - self.pad, self.start)
+			searchStop = min(chunkStop + self.pad, self.stop)
+
+			nights = None
+			if self.nights:
+				nights = {name : NightContext(self.context, loc, searchStart, searchStop) for name, loc in self.locs.items()}
+
+			with instruments.stage("findPasses"):
+				sitePasses = findPassesMulti(tleList, self.locs, searchStart, searchStop, self.context, propagator, nights=nights)
+
+			for name, passes in sitePasses.items():
+				passes = filterPasses(passes, sunUp, moonUp, eclipsed, minAlt, self.partial, instruments)
+
+				#Keep the passes peaking in this chunk, the last chunk also keeps its end
+				peak = passes["maxTime"]
+				keep = peak >= datetime64(chunkStart)
+				if i < len(chunks) - 1:
+					keep &= peak < datetime64(chunkStop)
+				else:
+					keep &= peak <= datetime64(chunkStop)
+				passes = passes[keep].sortBy("maxTime")
+
+				_replace(lambda f: passes.save(f), self.chunkFile(i, name))
+				instruments.count("batchPasses", len(passes))
+
+			#Only marked done once every site's file is in place
+			manifest["done"].append(i)
+			self.saveManifest(manifest)
+			instruments.count("batchChunks")
+
+		return len(todo)
+
+
+	# Start and stop of every chunk
+	# Args: none
+	# Returns: array of [datetime, datetime]
+	def chunks(self):
+		output = []
+		chunkStart = self.start
+		while chunkStart < self.stop:
+			chunkStop = min(chunkStart + self.chunk, self.stop)
+			output.append([chunkStart, chunkStop])
+			chunkStart = chunkStop
+		return output
+
+
+	# Whether the run has no chunks left to do
+	# Args: none
+	# Returns: bool
+	def finished(self):
+		manifest = self.readManifest()
+		if manifest == None:
+			return False
+		return all(self.isDone(manifest, i) for i in range(len(self.chunks())))
+
+
+	# The passes of one site a chunk at a time, only finished chunks are read
+	# Args: site = string
+	# Returns: generator of PassTable
+	def iterPasses(self, site):
+		manifest = self.readManifest()
+		done = set() if manifest == None else set(manifest["done"])
+		for i in range(len(self.chunks())):
+			if i in done:
+				yield loadPassTable(self.chunkFile(i, site))
+
+
+	# Every finished pass of one site in one table
+	# Args: site = string
+	# Returns: PassTable
+	def passes(self, site):
+		return concatenatePasses(list(self.iterPasses(site)))
+
+
+	# Write the passes of one site to a single csv, appending a chunk at a time
+	# Args: site = string, filename = string
+	# Returns: int number of passes
+	def toCSV(self, site, filename):
+		count = 0
+		open(filename, "w").close()
+		for passes in self.iterPasses(site):
+			if len(passes) > 0:
+				passes.toCSV(filename, append=True)
+			count += len(passes)
+		return count
+
+
+	# Write the passes of one site as a directory of Parquet part files, one per chunk, needs pyarrow
+	# Args: site = string, directory = path
+	# Returns: int number of passes
+	def toParquet(self, site, directory):
+		#Start over instead of adding to the parts of an earlier call
+		if os.path.isdir(directory):
+			for f in os.listdir(directory):
+				if f.startswith("part") and f.endswith(".parquet"):
+					os.remove(os.path.join(directory, f))
+
+		count = 0
+		for passes in self.iterPasses(site):
+			if len(passes) > 0:
+				passes.toParquet(directory, append=True)
+			count += len(passes)
+		return count
+
+
+	# The TLEs of the run, saved the first time so they are the same when it is resumed
+	# Args: tleList = array of tle, cache = TLECache
+	# Returns: array of tle
+	def loadTLEs(self, tleList=None, cache=None):
+		filename = os.path.join(self.directory, "tles.txt")
+		if os.path.isfile(filename):
+			return loadFile(filename)
+
+		if tleList == None:
+			tleList = loadStarlinkTLEs(cache, self.context.instruments)
+		tleList = [list(tle) for tle in tleList]
+
+		_replace(lambda f: f.write("\n".join("\n".join(tle) for tle in tleList).encode() + b"\n"), filename)
+		return tleList
+
+
+	# The manifest of the run, a new one if it hasn't started
+	# Args: tleList = array of tle
+	# Returns: dict
+	def loadManifest(self, tleList):
+		settings = self.settings(tleList)
+		manifest = self.readManifest()
+
+		if manifest == None:
+			manifest = {"settings" : settings, "done" : []}
+			self.saveManifest(manifest)
+		elif manifest["settings"] != settings:
+			raise ValueError("The checkpoint in " + self.directory + " was made with different settings, use a new directory")
+
+		return manifest
+
+
+	# Args: none
+	# Returns: dict or None
+	def readManifest(self):
+		filename = os.path.join(self.directory, "manifest.json")
+		if not os.path.isfile(filename):
+			return None
+		with open(filename) as f:
+			return json.load(f)
+
+
+	# Args: manifest = dict
+	# Returns: nothing
+	def saveManifest(self, manifest):
+		text = json.dumps(manifest, indent=1)
+		_replace(lambda f: f.write(text.encode()), os.path.join(self.directory, "manifest.json"))
+
+
+	# Everything that changes the results, a resumed run has to match
+	# Args: tleList = array of tle
+	# Returns: dict
+	def settings(self, tleList):
+		tleHash = hashlib.sha1()
+		for tle in tleList:
+			tleHash.update((tle[1] + tle[2]).encode())
+
+		return {
+			"version" : BATCH_VERSION,
+			"start" : self.start.isoformat(),
+			"stop" : self.stop.isoformat(),
+			"chunk" : self.chunk.total_seconds(),
+			"pad" : self.pad.total_seconds(),
+			"sites" : {name : [loc.latitude.degrees, loc.longitude.degrees, loc.elevation.m] for name, loc in self.locs.items()},
+			"params" : self.params,
+			"partial" : self.partial,
+			"nights" : self.nights,
+			"ephemeris" : self.context.ephemerisName,
+			"tles" : tleHash.hexdigest()
+		}
+
+
+	# Whether a chunk is in the manifest and all of its files are there
+	# Args: manifest = dict, i = int
+	# Returns: bool
+	def isDone(self, manifest, i):
+		return i in manifest["done"] and all(os.path.isfile(self.chunkFile(i, name)) for name in self.locs)
+
+
+	# Args: i = int, site = string
+	# Returns: path
+	def chunkFile(self, i, site):
+		return os.path.join(self.directory, "chunk%05d_%s.npz" % (i, site))
+
+
+
+
+# Write a file through a temporary file so an interrupted write never leaves half a file
+# Args: write = function taking a binary file, filename = path
+# Returns: nothing
+def _replace(write, filename):
+	temp = filename + ".tmp"
+	with open(temp, "wb") as f:
+		write(f)
+	os.replace(temp, filename)
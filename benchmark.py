@@ -0,0 +1,281 @@
+# benchmark.py
+#
+# Time the pass prediction pipeline on synthetic Starlink-like constellations
+#
+# Harry Krantz
+# Steward Observatory
+# University of Arizona
+# Copyright May 2020
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import argparse
+import contextlib
+import datetime as dt
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import skyfield
+
+from starlinkPassPredictor import *
+from locations import locations
+from writeAcpPlan import *
+from tleParser import parseTLEBytes
+from mountModel import MountModel
+from passIndex import PassIndex
+from trackingEphemeris import trackPasses
+
+
+
+
+# Make a synthetic shell of satellites evenly spread over a number of orbital planes
+# The lines are formatted like real TLEs and have valid checksums
+# Args: n = num of satellites, epoch = datetime, planes = num, inclination = num deg, meanMotion = num revs/day,
+#       firstID = num, name = string
+# Returns: array of tle
+def syntheticShell(n, epoch, planes=72, inclination=53.0, meanMotion=15.06, firstID=44000, name="STARLINK"):
+	planes = max(min(planes, n), 1)
+	perPlane = -(-n // planes)
+
+	#Epoch as two digit year and fractional day of year
+	dayOfYear = (epoch - dt.datetime(epoch.year, 1, 1, tzinfo=epoch.tzinfo)).total_seconds() / 86400 + 1
+	epochString = "%02d%012.8f" % (epoch.year % 100, dayOfYear)
+
+	output = []
+	for i in range(n):
+		plane, slot = divmod(i, perPlane)
+		raan = plane * 360.0 / planes
+		#Offset neighbouring planes so satellites don't line up in latitude
+		anomaly = (slot * 360.0 / perPlane + plane * 360.0 / n) % 360.0
+		satnum = firstID + i
+
+		line1 = "1 %05dU 19029A   %s  .00001000  00000-0  10000-3 0  999" % (satnum, epochString) + "0"
+		line2 = "2 %05d %8.4f %8.4f 0001000  90.0000 %8.4f %11.8f%5d" % (satnum, inclination, raan, anomaly, meanMotion, 1) + "0"
+
+		output.append(["%s-%d" % (name, i), fixChecksum(line1), fixChecksum(line2)])
+
+	return output
+
+
+
+
+# Run a function once and record its wall time and the peak memory it allocated
+# Output printed by the function is thrown away
+# Args: function = function, memory = bool
+# Returns: result, dict
+def measure(function, memory=True):
+	if memory:
+		tracemalloc.start()
+
+	with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+		t = time.perf_counter()
+		result = function()
+		seconds = time.perf_counter() - t
+
+	stats = {"seconds" : seconds}
+	if memory:
+		stats["peakMemoryMB"] = tracemalloc.get_traced_memory()[1] / 2**20
+		tracemalloc.stop()
+
+	return result, stats
+
+
+
+
+# Time every stage of the pipeline for one constellation size
+# Args: n = num of satellites, start = datetime, stop = datetime, loc = skyfield Topos, context = EphemerisContext,
+#       outDir = path, samples = num of satellites for the per satellite stages, memory = bool
+# Returns: dict
+def benchmarkSize(n, start, stop, loc, context, outDir, samples=50, memory=True):
+	tleList = syntheticShell(n, start)
+	text = "\n".join("\n".join(tle) for tle in tleList).splitlines()
+	sample = tleList[:min(samples, n)]
+	output = {}
+
+	print("Benchmarking " + str(n) + " satellites...")
+
+
+	#Parsing the downloaded text
+	parsed, stats = measure(lambda: parseTLEFile(text), memory)
+	stats["satellitesPerSecond"] = n / stats["seconds"]
+	output["parseTLEFile"] = stats
+
+	result, stats = measure(lambda: parseTLEBytes("\n".join(text).encode()), memory)
+	stats["satellitesPerSecond"] = n / stats["seconds"]
+	output["parseTLEBytes"] = stats
+
+
+	#Single satellite ephemeris at the middle of the window
+	middle = start + (stop - start) / 2
+	result, stats = measure(lambda: [computeEphemeris(tle, loc, middle, context) for tle in sample], memory)
+	stats["callsPerSecond"] = len(sample) / stats["seconds"]
+	output["computeEphemeris"] = stats
+
+
+	#Passes one satellite at a time and the whole constellation at once
+	passes, stats = measure(lambda: concatenatePasses([findPass(tle, loc, start, stop, context) for tle in sample]), memory)
+	stats["satellitesPerSecond"] = len(sample) / stats["seconds"]
+	stats["passesPerSecond"] = len(passes) / stats["seconds"]
+	output["findPass"] = stats
+
+	passes, stats = measure(lambda: findPasses(tleList, loc, start, stop, context), memory)
+	stats["satellitesPerSecond"] = n / stats["seconds"]
+	stats["passesPerSecond"] = len(passes) / stats["seconds"]
+	stats["passes"] = len(passes)
+	output["findPasses"] = stats
+
+
+	#Filtering, selecting, and planning the passes found
+	filtered, stats = measure(lambda: filterPasses(passes, False, None, False, 20, False), memory)
+	stats["passesPerSecond"] = len(passes) / stats["seconds"]
+	stats["passes"] = len(filtered)
+	output["filterPasses"] = stats
+
+	selected, stats = measure(lambda: selectStarlinkPasses(filtered, dt.timedelta(seconds=90)), memory)
+	stats["passesPerSecond"] = len(filtered) / stats["seconds"]
+	stats["passes"] = len(selected)
+	output["selectStarlinkPasses"] = stats
+
+	selected, stats = measure(lambda: selectStarlinkPasses(filtered, dt.timedelta(seconds=90), mode="greedy"), memory)
+	stats["passesPerSecond"] = len(filtered) / stats["seconds"]
+	stats["passes"] = len(selected)
+	output["selectGreedy"] = stats
+
+	selected, stats = measure(lambda: selectStarlinkPasses(filtered, None, mount=MountModel()), memory)
+	stats["passesPerSecond"] = len(filtered) / stats["seconds"]
+	stats["passes"] = len(selected)
+	output["selectMount"] = stats
+
+	#Building the index over the passes and ten minute lookups across the window with it
+	index, stats = measure(lambda: PassIndex(passes.sortBy("maxTime")), memory)
+	stats["passesPerSecond"] = len(passes) / stats["seconds"]
+	output["passIndex"] = stats
+
+	times = [start + (stop - start) * k / 1000 for k in range(1000)]
+	result, stats = measure(lambda: [index.peaking(t, t + dt.timedelta(minutes=10), 60) for t in times], memory)
+	stats["queriesPerSecond"] = len(times) / stats["seconds"]
+	output["passIndexQuery"] = stats
+
+	#Dense one second ephemeris of every selected pass
+	tracks, stats = measure(lambda: trackPasses(selected, tleList, loc, context, 1.0), memory)
+	stats["samplesPerSecond"] = tracks.samples() / stats["seconds"]
+	stats["samples"] = tracks.samples()
+	output["trackPasses"] = stats
+
+	obs = [[p["name"], p["targetTime"], 9, p["targetRA"], p["targetDec"], p["targetAlt"], p["targetAz"]] for p in selected]
+	result, stats = measure(lambda: writeAcpPlan(obs, filename=os.path.join(outDir, "plan.txt")) if len(obs) > 0 else None, memory)
+	stats["passesPerSecond"] = len(obs) / stats["seconds"]
+	output["writeAcpPlan"] = stats
+
+
+	#Full pipeline with the csv output
+	allPasses, stats = measure(lambda: starlinkPassPredictor(start, stop, loc, [False, None, False, 20], outDir, "allPasses", context, tleList=tleList), memory)
+	stats["satellitesPerSecond"] = n / stats["seconds"]
+	stats["passesPerSecond"] = len(allPasses) / stats["seconds"]
+	stats["passes"] = len(allPasses)
+	output["starlinkPassPredictor"] = stats
+
+	return output
+
+
+
+
+# Print how much each stage changed against an earlier benchmark
+# Args: results = dict, baseline = dict
+# Returns: nothing
+def compareResults(results, baseline):
+	print("{: <8} {: <24} {: <12} {: <12} {: <8}".format("Size", "Stage", "Baseline s", "Now s", "Ratio"))
+	for n, stages in results["sizes"].items():
+		for stage, stats in stages.items():
+			old = baseline["sizes"].get(n, {}).get(stage)
+			if old == None:
+				continue
+			ratio = stats["seconds"] / old["seconds"] if old["seconds"] > 0 else float("nan")
+			print("{: <8} {: <24} {: <12.4f} {: <12.4f} {: <8.2f}".format(n, stage, old["seconds"], stats["seconds"], ratio))
+
+
+
+
+# Commit of the working tree if it is a git checkout
+# Args: none
+# Returns: string
+def gitCommit():
+	try:
+		return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+	except OSError:
+		return None
+
+
+
+
+if __name__ == "__main__":
+
+	parser = argparse.ArgumentParser(description="Time the pass prediction pipeline on synthetic constellations")
+	parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 5000], help="constellation sizes, 100 to 30000")
+	parser.add_argument("--start", default="2020-05-28T03:00:00", help="start of the window, UTC")
+	parser.add_argument("--hours", type=float, default=2, help="length of the window")
+	parser.add_argument("--site", default="Lemmon", help="observatory from locations.py")
+	parser.add_argument("--ephemeris", default="de421.bsp", help="planetary ephemeris file")
+	parser.add_argument("--samples", type=int, default=50, help="satellites used for the one at a time stages")
+	parser.add_argument("--no-memory", action="store_true", help="skip tracemalloc, it slows everything down")
+	parser.add_argument("--output", default=None, help="json file for the results")
+	parser.add_argument("--compare", default=None, help="earlier json results to compare against")
+	args = parser.parse_args()
+
+	start = dt.datetime.fromisoformat(args.start).replace(tzinfo=utc)
+	stop = start + dt.timedelta(hours=args.hours)
+	loc = locations[args.site]
+
+	#Loading the ephemeris is timed on its own and shared by every size after that
+	context, stats = measure(lambda: EphemerisContext(args.ephemeris), not args.no_memory)
+
+	results = {
+		"commit" : gitCommit(),
+		"date" : dt.datetime.now(utc).isoformat(),
+		"python" : platform.python_version(),
+		"numpy" : np.__version__,
+		"skyfield" : skyfield.__version__,
+		"start" : start.isoformat(),
+		"hours" : args.hours,
+		"site" : args.site,
+		"ephemerisContext" : stats,
+		"sizes" : {}
+	}
+
+	with tempfile.TemporaryDirectory() as outDir:
+		for n in args.sizes:
+			results["sizes"][str(n)] = benchmarkSize(n, start, stop, loc, context, outDir, args.samples, not args.no_memory)
+
+			for stage, stats in results["sizes"][str(n)].items():
+				print("  {: <24} {: >10.4f} s".format(stage, stats["seconds"]))
+
+
+	filename = args.output
+	if filename == None:
+		filename = "benchmark_" + dt.datetime.now().strftime("%Y-%m-%d_%H%M%S") + ".json"
+
+	with open(filename, "w") as f:
+		json.dump(results, f, indent=1)
+	print("Saved results to " + filename)
+
+	if args.compare != None:
+		with open(args.compare) as f:
+			compareResults(results, json.load(f))
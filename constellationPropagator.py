@@ -0,0 +1,325 @@
+# constellationPropagator.py
+#
+# Propagate a whole constellation of TLEs at once with the batched SGP4 routines
+#
+# Harry Krantz
+# Steward Observatory
+# University of Arizona
+# Copyright May 2020
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import numpy as np
+
+from skyfield.constants import ANGVEL
+from skyfield.framelib import itrs
+from skyfield.sgp4lib import theta_GMST1982
+from sgp4.api import Satrec, SatrecArray, jday
+
+from ephemerisContext import EphemerisContext
+
+
+DAY_S = 86400.0
+
+
+
+
+# Holds every TLE of a constellation in a single SatrecArray so that all the
+# satellites can be propagated over an array of times with one call
+# Positions come out in the Earth fixed frame (ITRF, km) which makes the
+# topocentric math for any number of observers a couple of array operations
+# Args: tleList = array of tle or TLEStore, context = EphemerisContext, chunkSize = num of times per SGP4 call
+class ConstellationPropagator:
+
+	def __init__(self, tleList, context=None, chunkSize=256):
+		if context == None:
+			context = EphemerisContext()
+
+		self.ts = context.ts
+		self.tleList = tleList
+		self.chunkSize = chunkSize
+
+		#A TLEStore already holds parsed elements, plain TLEs need their text parsed
+		if hasattr(tleList, "satrecs"):
+			self.satrecs = tleList.satrecs()
+		else:
+			self.satrecs = [Satrec.twoline2rv(tle[1], tle[2]) for tle in tleList]
+		self.satArray = SatrecArray(self.satrecs)
+
+
+	def __len__(self):
+		return len(self.satrecs)
+
+
+	# Propagate every satellite over an array of times
+	# Args: times = Skyfield Time array
+	# Returns: position = array (sats x times x 3) km, velocity = array (sats x times x 3) km/s, error = array (sats x times)
+	def propagate(self, times):
+		n = len(self.satrecs)
+		m = len(times.tt)
+
+		position = np.empty((n, m, 3))
+		velocity = np.empty((n, m, 3))
+		error = np.empty((n, m), dtype=np.uint8)
+
+		for chunk, r, v, e in self.propagateChunks(times):
+			position[:, chunk] = r
+			velocity[:, chunk] = v
+			error[:, chunk] = e
+
+		return position, velocity, error
+
+
+	# Propagate every satellite over an array of times a chunk of times at a time
+	# Only one chunk is held in memory so long time ranges stay bounded
+	# Args: times = Skyfield Time array
+	# Returns: generator of (slice, position, velocity, error)
+	def propagateChunks(self, times):
+		m = len(times.tt)
+
+		for first in range(0, m, self.chunkSize):
+			chunk = slice(first, min(first + self.chunkSize, m))
+			t = times[chunk]
+
+			jd, fr = sgp4Times(t)
+			e, r, v = self.satArray.sgp4(jd, fr)
+			r, v = temeToITRF(t, r, v)
+
+			yield chunk, r, v, e
+
+
+	# Propagate individual (satellite, time) pairs
+	# Pairs are grouped by satellite so each satellite only makes one SGP4 call
+	# Args: satIndex = array of int, times = Skyfield Time array
+	# Returns: position = array (pairs x 3) km, velocity = array (pairs x 3) km/s, error = array (pairs)
+	def propagatePairs(self, satIndex, times):
+		satIndex = np.asarray(satIndex, dtype=int)
+		n = len(satIndex)
+
+		jd, fr = sgp4Times(times)
+		jd = np.broadcast_to(jd, n)
+		fr = np.broadcast_to(fr, n)
+
+		position = np.empty((n, 3))
+		velocity = np.empty((n, 3))
+		error = np.empty(n, dtype=np.uint8)
+
+		order = np.argsort(satIndex, kind="stable")
+		groups, firsts = np.unique(satIndex[order], return_index=True)
+		bounds = list(firsts[1:]) + [n]
+
+		for k, first, last in zip(groups, firsts, bounds):
+			idx = order[first:last]
+			e, r, v = self.satrecs[k].sgp4_array(jd[idx], fr[idx])
+			position[idx] = r
+			velocity[idx] = v
+			error[idx] = e
+
+		r, v = temeToITRF(times, position, velocity)
+
+		return r, v, error
+
+
+	# Altitude and azimuth of every satellite over an array of times from one location
+	# Args: loc = skyfield topos, times = Skyfield Time array
+	# Returns: alt = array (sats x times) deg, az = array (sats x times) deg
+	def altAz(self, loc, times):
+		n = len(self.satrecs)
+		m = len(times.tt)
+
+		observer = Observer(loc)
+		alt = np.empty((n, m))
+		az = np.empty((n, m))
+
+		for chunk, r, v, e in self.propagateChunks(times):
+			alt[:, chunk], az[:, chunk], distance = observer.altAz(r)
+			#Satellites that fail to propagate are never above the horizon
+			alt[:, chunk][e != 0] = -90.0
+
+		return alt, az
+
+
+
+
+# A fixed observer on the ground with its position and local horizon axes in ITRF
+# Args: loc = skyfield topos
+class Observer:
+
+	def __init__(self, loc):
+		self.loc = loc
+		self.position = loc.itrs_xyz.km
+
+		lat = loc.latitude.radians
+		lon = loc.longitude.radians
+
+		#Local east, north, and up unit vectors
+		self.east = np.array([-np.sin(lon), np.cos(lon), 0.0])
+		self.north = np.array([-np.sin(lat)*np.cos(lon), -np.sin(lat)*np.sin(lon), np.cos(lat)])
+		self.up = np.array([np.cos(lat)*np.cos(lon), np.cos(lat)*np.sin(lon), np.sin(lat)])
+
+
+	# Topocentric altitude, azimuth, and range for ITRF positions of any shape (... x 3)
+	# Args: position = array km
+	# Returns: alt = array deg, az = array deg, distance = array km
+	def altAz(self, position):
+		d = position - self.position
+
+		e = d @ self.east
+		n = d @ self.north
+		u = d @ self.up
+
+		distance = np.sqrt(e*e + n*n + u*u)
+		alt = np.degrees(np.arcsin(u / distance))
+		az = np.degrees(np.arctan2(e, n)) % 360.0
+
+		return alt, az, distance
+
+
+	# Rate of change of topocentric altitude for ITRF positions and velocities of any shape (... x 3)
+	# Args: position = array km, velocity = array km/s
+	# Returns: array deg/s
+	def altitudeRate(self, position, velocity):
+		d = position - self.position
+
+		distance = np.sqrt(np.sum(d*d, axis=-1))
+		sinAlt = (d @ self.up) / distance
+		cosAlt = np.sqrt(np.maximum(1.0 - sinAlt*sinAlt, 1e-12))
+
+		rangeRate = np.sum(d*velocity, axis=-1) / distance
+		rate = ((velocity @ self.up) - sinAlt*rangeRate) / (distance*cosAlt)
+
+		return np.degrees(rate)
+
+
+	# Rates of change of topocentric altitude and azimuth for ITRF positions and velocities of any shape (... x 3)
+	# Args: position = array km, velocity = array km/s
+	# Returns: altRate = array deg/s, azRate = array deg/s
+	def altAzRates(self, position, velocity):
+		d = position - self.position
+
+		e = d @ self.east
+		n = d @ self.north
+		eRate = velocity @ self.east
+		nRate = velocity @ self.north
+
+		#Azimuth is atan2(east, north)
+		azRate = (n*eRate - e*nRate) / np.maximum(e*e + n*n, 1e-12)
+
+		return self.altitudeRate(position, velocity), np.degrees(azRate)
+
+
+
+
+# Right ascension, declination, and how fast they change for topocentric positions and velocities
+# in a celestial frame (... x 3), the total rate is how fast the direction moves across the sky
+# The RA rate is of the coordinate itself, multiply by cos(dec) for the rate on the sky
+# Args: position = array km, velocity = array km/s
+# Returns: ra = array hours, dec = array deg, raRate = array deg/s, decRate = array deg/s, rate = array deg/s
+def raDecRates(position, velocity):
+	x, y, z = position[..., 0], position[..., 1], position[..., 2]
+	vx, vy, vz = velocity[..., 0], velocity[..., 1], velocity[..., 2]
+
+	xy = np.maximum(x*x + y*y, 1e-12)
+	distance = np.sqrt(xy + z*z)
+	rangeRate = (x*vx + y*vy + z*vz) / distance
+
+	ra = np.degrees(np.arctan2(y, x)) % 360.0 / 15.0
+	dec = np.degrees(np.arcsin(z / distance))
+
+	raRate = (x*vy - y*vx) / xy
+	decRate = (vz - z*rangeRate/distance) / np.sqrt(xy)
+
+	#Velocity across the line of sight over the distance
+	rate = np.linalg.norm(np.cross(position, velocity), axis=-1) / (distance*distance)
+
+	return ra, dec, np.degrees(raRate), np.degrees(decRate), np.degrees(rate)
+
+
+
+
+# Rotate Earth fixed vectors and their rates into the GCRS, the frame Skyfield's RA and Dec are in
+# The velocity gains the Earth's rotation so it is the rate of change seen from space
+# The full rotation with precession and nutation is only worked out at nodes nodeStep seconds apart,
+# between them only the Earth's rotation angle changes enough to matter and it comes from GMST
+# Args: times = Skyfield Time array, position = array (times x 3) km, velocity = array (times x 3) km/s, nodeStep = num seconds
+# Returns: position = array km, velocity = array km/s
+def itrfToGCRS(times, position, velocity, nodeStep=60.0):
+	shape = np.shape(position)
+	position = np.reshape(position, (-1, 3))
+	velocity = np.reshape(velocity, (-1, 3))
+	inertial = velocity + np.cross([0.0, 0.0, ANGVEL], position)
+
+	#Nearest node of every time
+	tt = np.atleast_1d(times.tt)
+	nodeIndex = np.round((tt - tt.min()) * DAY_S / nodeStep).astype(int)
+	used, inverse = np.unique(nodeIndex, return_inverse=True)
+	nodes = times.ts.tt_jd(tt.min() + used * nodeStep / DAY_S)
+
+	#Turn each vector back by the rotation since its node, then by the node's GCRS to ITRS rotation
+	angle = theta_GMST1982(np.atleast_1d(times.whole), np.atleast_1d(times.ut1_fraction))[0] - theta_GMST1982(nodes.whole, nodes.ut1_fraction)[0][inverse]
+	c = np.cos(angle)
+	s = np.sin(angle)
+	R = itrs.rotation_at(nodes)[:, :, inverse]
+
+	output = []
+	for vector in [position, inertial]:
+		x = c*vector[:, 0] - s*vector[:, 1]
+		y = s*vector[:, 0] + c*vector[:, 1]
+		output.append(np.einsum("jin,nj->ni", R, np.stack((x, y, vector[:, 2]), axis=-1)).reshape(shape))
+
+	return output[0], output[1]
+
+
+
+
+# Evenly spaced Skyfield times from t0 to t1 including both ends
+# Args: ts = Skyfield timescale, t0 = Skyfield Time, t1 = Skyfield Time, step = num seconds
+# Returns: Skyfield Time array
+def timeGrid(ts, t0, t1, step):
+	n = max(int(np.ceil((t1.tt - t0.tt) * DAY_S / step)), 1)
+	return ts.tt_jd(np.linspace(t0.tt, t1.tt, n + 1))
+
+
+
+
+# Split Skyfield times into the UTC Julian date and fraction that SGP4 expects
+# Args: times = Skyfield Time
+# Returns: jd = array, fr = array
+def sgp4Times(times):
+	jd, fr = jday(*times.utc)
+	return np.atleast_1d(jd), np.atleast_1d(fr)
+
+
+
+
+# Rotate SGP4 TEME vectors into the Earth fixed frame, polar motion is ignored
+# Args: times = Skyfield Time array, position = array (... x times x 3) km, velocity = array (... x times x 3) km/s
+# Returns: position = array km, velocity = array km/s
+def temeToITRF(times, position, velocity):
+	theta, thetaDot = theta_GMST1982(times.whole, times.ut1_fraction)
+	thetaDot = thetaDot / DAY_S
+
+	c = np.cos(theta)
+	s = np.sin(theta)
+
+	x = c*position[..., 0] + s*position[..., 1]
+	y = -s*position[..., 0] + c*position[..., 1]
+	rITRF = np.stack((x, y, position[..., 2]), axis=-1)
+
+	vx = c*velocity[..., 0] + s*velocity[..., 1] + thetaDot*y
+	vy = -s*velocity[..., 0] + c*velocity[..., 1] - thetaDot*x
+	vITRF = np.stack((vx, vy, velocity[..., 2]), axis=-1)
+
+	return rITRF, vITRF
@@ -0,0 +1,229 @@
+# earthShadow.py
+#
+# Earth shadow (umbra and penumbra) of satellites and the sunlit parts of their passes
+#
+# Harry Krantz
+# Steward Observatory
+# University of Arizona
+# Copyright May 2020
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import numpy as np
+
+from skyfield.framelib import itrs
+
+from ephemerisContext import EphemerisContext
+from constellationPropagator import DAY_S
+from findEvents import bisect
+
+
+EARTH_RADIUS = 6378.137 #km
+SUN_RADIUS = 696000.0 #km
+
+#The Sun goes once around the Earth fixed frame every solar day
+SUN_ITRF_RATE = 2*np.pi / DAY_S #rad/s
+
+#TT Julian date the SunTrack grid is counted from, J2000
+SUN_TRACK_ORIGIN = 2451545.0
+
+
+
+
+# Angle of the Sun's center above the Earth's limb as seen from the satellite
+# Negative when the center of the Sun is hidden, so the satellite is eclipsed when this is below zero
+# Positions can be any shape (... x 3) as long as both are geocentric and in the same frame
+# Args: position = array km, sunPosition = array km
+# Returns: array deg
+def sunLimbAngle(position, sunPosition):
+	sunAngle, earthAngle, separation = _apparentDisks(position, sunPosition)
+	return np.degrees(separation - earthAngle)
+
+
+
+
+# Fraction of the Sun's disk visible from the satellite, 0 in the umbra, 1 in full sunlight
+# and in between in the penumbra, the disks are treated as flat circles on the sky
+# Args: position = array km, sunPosition = array km
+# Returns: array
+def sunlitFraction(position, sunPosition):
+	a, b, c = _apparentDisks(position, sunPosition)
+
+	#Overlap area of the two disks
+	c = np.maximum(c, 1e-12)
+	x = (c*c + a*a - b*b) / (2*c)
+	y = np.sqrt(np.maximum(a*a - x*x, 0))
+	overlap = a*a*np.arccos(np.clip(x/a, -1, 1)) + b*b*np.arccos(np.clip((c - x)/b, -1, 1)) - c*y
+
+	fraction = 1 - overlap / (np.pi*a*a)
+	fraction = np.where(c >= a + b, 1.0, fraction)
+	fraction = np.where(c <= b - a, 0.0, fraction)
+
+	return np.clip(fraction, 0, 1)
+
+
+
+
+# Which part of the shadow the satellite is in, 0 = sunlit, 1 = penumbra, 2 = umbra
+# Args: position = array km, sunPosition = array km
+# Returns: array of int
+def shadowState(position, sunPosition):
+	a, b, c = _apparentDisks(position, sunPosition)
+	return np.where(c >= a + b, 0, np.where(c <= b - a, 2, 1))
+
+
+
+
+# Apparent radius of the Sun and Earth and the angle between their centers seen from the satellite
+# Args: position = array km, sunPosition = array km
+# Returns: sunAngle = array rad, earthAngle = array rad, separation = array rad
+def _apparentDisks(position, sunPosition):
+	toSun = sunPosition - position
+	sunDistance = np.sqrt(np.sum(toSun*toSun, axis=-1))
+	earthDistance = np.sqrt(np.sum(position*position, axis=-1))
+
+	sunAngle = np.arcsin(np.minimum(SUN_RADIUS / sunDistance, 1))
+	earthAngle = np.arcsin(np.minimum(EARTH_RADIUS / earthDistance, 1))
+
+	cosSeparation = -np.sum(position*toSun, axis=-1) / (earthDistance*sunDistance)
+	separation = np.arccos(np.clip(cosSeparation, -1, 1))
+
+	return sunAngle, earthAngle, separation
+
+
+
+
+# Position of the Sun in the Earth fixed frame for any times inside a window
+# The Sun is computed with Skyfield on a coarse grid and in between it is rotated about
+# the Earth's axis at one turn per solar day, which is good to a few thousandths of a degree
+# The grid is every step seconds from a fixed origin so a time gets the same Sun whatever the window
+# Args: context = EphemerisContext, t0 = Skyfield Time, t1 = Skyfield Time, step = num seconds
+class SunTrack:
+
+	def __init__(self, context, t0, t1, step=600):
+		first = int(np.floor((t0.tt - SUN_TRACK_ORIGIN) * DAY_S / step))
+		last = max(int(np.ceil((t1.tt - SUN_TRACK_ORIGIN) * DAY_S / step)), first + 1)
+		self.tt = SUN_TRACK_ORIGIN + np.arange(first, last + 1) * step / DAY_S
+
+		times = context.ts.tt_jd(self.tt)
+		sun = context.earth.at(times).observe(context.sun)
+		self.position = sun.frame_xyz(itrs).km.T
+
+
+	# Args: tt = array of TT Julian dates
+	# Returns: array (... x 3) km
+	def at(self, tt):
+		tt = np.asarray(tt)
+		nearest = np.clip(np.searchsorted(self.tt, tt), 1, len(self.tt) - 1)
+		nearest = np.where(np.abs(tt - self.tt[nearest - 1]) < np.abs(tt - self.tt[nearest]), nearest - 1, nearest)
+
+		p = self.position[nearest]
+		angle = -SUN_ITRF_RATE * (tt - self.tt[nearest]) * DAY_S
+		c = np.cos(angle)
+		s = np.sin(angle)
+
+		return np.stack((c*p[..., 0] - s*p[..., 1], s*p[..., 0] + c*p[..., 1], p[..., 2]), axis=-1)
+
+
+
+
+# Find the sunlit parts of many passes at once
+# Each pass is sampled evenly from rise to set no more than step seconds apart, every change
+# between sunlight and shadow is bracketed and then all of them are refined together by bisection
+# The samples and the number of bisections only depend on the pass, so a pass gets the same
+# times whichever other passes it is found with
+# Sunlight is when the center of the Sun is above the Earth's limb, the middle of the penumbra
+# Args: propagator = ConstellationPropagator, satIndex = array of int, riseTime = array TT, setTime = array TT,
+#       context = EphemerisContext, step = num seconds, precision = num seconds
+# Returns: dict of arrays (passIndex, start, end) with one entry per sunlit interval, times are TT Julian dates
+def findSunlit(propagator, satIndex, riseTime, setTime, context=None, step=30, precision=0.1):
+	if context == None:
+		context = EphemerisContext()
+
+	ts = propagator.ts
+	satIndex = np.asarray(satIndex, dtype=int)
+	riseTime = np.asarray(riseTime, dtype=float)
+	setTime = np.asarray(setTime, dtype=float)
+	n = len(satIndex)
+
+	if n == 0:
+		return {"passIndex" : np.zeros(0, dtype=int), "start" : np.zeros(0), "end" : np.zeros(0)}
+
+	sunTrack = SunTrack(context, ts.tt_jd(riseTime.min()), ts.tt_jd(setTime.max()))
+
+	#Sun limb angle of a satellite at a time, the sign says if it is sunlit
+	def evaluate(sats, tt):
+		r, v, e = propagator.propagatePairs(sats, ts.tt_jd(tt))
+		return sunLimbAngle(r, sunTrack.at(tt))
+
+
+	#Sample every pass evenly with its own number of points, the samples of pass i are offsets[i] to offsets[i + 1]
+	duration = (setTime - riseTime) * DAY_S
+	counts = np.maximum(np.ceil(duration / step).astype(int), 1) + 1
+	offsets = np.zeros(n + 1, dtype=int)
+	np.cumsum(counts, out=offsets[1:])
+	sampleRow = np.repeat(np.arange(n), counts)
+	k = np.arange(offsets[-1]) - offsets[sampleRow]
+	grid = riseTime[sampleRow] + (setTime - riseTime)[sampleRow] * k / (counts[sampleRow] - 1)
+	lit = evaluate(satIndex[sampleRow], grid) >= 0
+
+
+	#Bracket and refine every change between sunlight and shadow, no bracket is longer than step
+	change = np.nonzero((lit[:-1] != lit[1:]) & (sampleRow[:-1] == sampleRow[1:]))[0]
+	row = sampleRow[change]
+	iterations = max(int(np.ceil(np.log2(max(step, precision) / precision))), 1)
+	crossing = bisect(lambda tt: evaluate(satIndex[row], tt), grid[change], grid[change + 1], iterations)
+
+
+	#Every pass is split at its crossings, the pieces alternate starting from the state at rise
+	pieceRow = np.concatenate((np.arange(n), row))
+	pieceStart = np.concatenate((riseTime, crossing))
+	order = np.lexsort((pieceStart, pieceRow))
+	pieceRow, pieceStart = pieceRow[order], pieceStart[order]
+
+	pieceEnd = np.empty(len(pieceRow))
+	pieceEnd[:-1] = pieceStart[1:]
+	last = np.ones(len(pieceRow), dtype=bool)
+	last[:-1] = pieceRow[1:] != pieceRow[:-1]
+	pieceEnd[last] = setTime[pieceRow[last]]
+
+	first = np.searchsorted(pieceRow, pieceRow, side="left")
+	pieceLit = lit[offsets[pieceRow]] ^ ((np.arange(len(pieceRow)) - first) % 2 == 1)
+
+	return {"passIndex" : pieceRow[pieceLit], "start" : pieceStart[pieceLit], "end" : pieceEnd[pieceLit]}
+
+
+
+
+# Combine the sunlit intervals of each pass into its first sunlit time, last sunlit time,
+# and the fraction of the pass spent in sunlight, passes never sunlit get NaN times
+# Args: sunlit = dict from findSunlit, riseTime = array TT, setTime = array TT
+# Returns: start = array TT, end = array TT, fraction = array
+def summarizeSunlit(sunlit, riseTime, setTime):
+	n = len(riseTime)
+	start = np.full(n, np.nan)
+	end = np.full(n, np.nan)
+	total = np.zeros(n)
+
+	passIndex = sunlit["passIndex"]
+	np.fmin.at(start, passIndex, sunlit["start"])
+	np.fmax.at(end, passIndex, sunlit["end"])
+	np.add.at(total, passIndex, sunlit["end"] - sunlit["start"])
+
+	duration = np.asarray(setTime) - np.asarray(riseTime)
+	fraction = np.where(duration > 0, total / np.where(duration > 0, duration, 1), 1.0)
+	fraction = np.where(np.isnan(start), 0.0, fraction)
+
+	return start, end, np.clip(fraction, 0, 1)
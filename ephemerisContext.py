@@ -0,0 +1,96 @@
+# ephemerisContext.py
+#
+# Shared Skyfield state (timescale, planetary ephemeris, compiled satellites)
+# that can be reused across many ephemeris and pass calculations
+#
+# Harry Krantz
+# Steward Observatory
+# University of Arizona
+# Copyright May 2020
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+from collections import OrderedDict
+
+import skyfield.api
+import skyfield.sgp4lib
+
+from instrumentation import nullInstrumentation
+
+
+
+
+# Holds everything that is expensive to set up but the same for every pass:
+# the timescale, the Earth/Sun/Moon segments of the planetary ephemeris, and
+# a bounded cache of compiled EarthSatellite objects keyed by NORAD ID
+# It also carries the Instrumentation that every function given the context records into
+# Args: ephemeris = filename or loaded Skyfield ephemeris, maxSatellites = num, instruments = Instrumentation
+class EphemerisContext:
+
+	def __init__(self, ephemeris="de421.bsp", maxSatellites=10000, instruments=None):
+		self.instruments = nullInstrumentation if instruments == None else instruments
+
+		with self.instruments.stage("loadEphemeris"):
+			self.ts = skyfield.api.load.timescale()
+
+			#Load the planetary kernel only once, its path is kept so worker processes can load it again
+			if isinstance(ephemeris, str):
+				self.ephemerisName = ephemeris
+				self.planets = skyfield.api.load(ephemeris)
+			else:
+				self.ephemerisName = getattr(ephemeris, "path", getattr(ephemeris, "filename", None))
+				if self.ephemerisName == None:
+					raise ValueError("The ephemeris has no file to load it from")
+				self.planets = ephemeris
+
+		self.earth = self.planets['earth']
+		self.sun = self.planets['sun']
+		self.moon = self.planets['moon']
+
+		#Least recently used cache of compiled satellites
+		self.maxSatellites = maxSatellites
+		self.satellites = OrderedDict()
+
+
+	# Get the compiled satellite for a TLE, building it only if it is not cached
+	# or the cached copy came from a different element set
+	# Args: tle = array of string
+	# Returns: skyfield EarthSatellite
+	def getSatellite(self, tle):
+		name, line1, line2 = tle
+		noradID = line1[2:8]
+
+		cached = self.satellites.get(noradID)
+		if cached != None and cached[0] == line1 and cached[1] == line2:
+			self.satellites.move_to_end(noradID)
+			return cached[2]
+
+		self.instruments.count("satellitesCompiled")
+		sat = skyfield.sgp4lib.EarthSatellite(line1, line2, name, self.ts)
+		self.satellites[noradID] = (line1, line2, sat)
+		self.satellites.move_to_end(noradID)
+
+		#Drop the least recently used satellites once over the limit
+		while len(self.satellites) > self.maxSatellites:
+			self.satellites.popitem(last=False)
+
+		return sat
+
+
+	# Empty the satellite cache
+	# Args: none
+	# Returns: nothing
+	def clearSatellites(self):
+		self.satellites.clear()
@@ -0,0 +1,265 @@
+# findEvents.py
+#
+# Find the rise, culmination, and set times of every satellite in a constellation at once
+#
+# Harry Krantz
+# Steward Observatory
+# University of Arizona
+# Copyright May 2020
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import numpy as np
+
+from constellationPropagator import Observer, timeGrid, DAY_S
+
+
+
+
+# Find every pass of every satellite in the propagator between t0 and t1
+# Altitude and altitude rate are sampled for all satellites on a shared coarse grid,
+# horizon crossings and maxima are bracketed with array operations, and then all the
+# brackets are refined together by bisection to the requested precision
+# Passes that are already up at t0 or still up at t1 are returned and flagged as partial
+# Args: propagator = ConstellationPropagator, loc = skyfield topos, t0 = Skyfield Time, t1 = Skyfield Time,
+#       step = num seconds, horizon = num deg, precision = num seconds
+# Returns: dict of arrays (satIndex, riseTime, maxTime, setTime, maxAlt, risePartial, setPartial), times are TT Julian dates
+def findEvents(propagator, loc, t0, t1, step=30, horizon=0.0, precision=0.1):
+	return findEventsMulti(propagator, [loc], t0, t1, step, horizon, precision)[0]
+
+
+
+
+# Same as findEvents for several locations at once
+# The constellation is propagated once per grid time and per refinement step, only the
+# cheap topocentric math is repeated for each location
+# Args: propagator = ConstellationPropagator, locs = array of skyfield topos, t0 = Skyfield Time, t1 = Skyfield Time,
+#       step = num seconds, horizon = num deg, precision = num seconds
+# Returns: array of dict of arrays, one per location
+def findEventsMulti(propagator, locs, t0, t1, step=30, horizon=0.0, precision=0.1):
+
+	ts = propagator.ts
+	observers = [Observer(loc) for loc in locs]
+	times = timeGrid(ts, t0, t1, step)
+	tt = times.tt
+	step = (tt[1] - tt[0]) * DAY_S
+
+
+	#Every (location, satellite) pair is treated as its own row, row = location * n + satellite
+	n = len(propagator)
+	m = len(tt)
+	rows = len(observers) * n
+
+	#Sample altitude and altitude rate of every satellite on the coarse grid
+	alt = np.empty((rows, m), dtype=np.float32)
+	rate = np.empty((rows, m), dtype=np.float32)
+
+	for chunk, r, v, e in propagator.propagateChunks(times):
+		for s, observer in enumerate(observers):
+			a = observer.altAz(r)[0]
+			d = observer.altitudeRate(r, v)
+			#Satellites that fail to propagate are never up and never culminate
+			a[e != 0] = -90.0
+			d[e != 0] = np.nan
+			alt[s*n:(s+1)*n, chunk] = a
+			rate[s*n:(s+1)*n, chunk] = d
+
+	above = alt >= horizon
+
+
+	#Bracket the horizon crossings
+	upRow, upIdx = np.nonzero(~above[:, :-1] & above[:, 1:])
+	downRow, downIdx = np.nonzero(above[:, :-1] & ~above[:, 1:])
+
+	#Bracket the maxima, altitude is concave near a culmination so extrapolating the
+	#rate from either end of the bracket bounds how high it could have gotten
+	peakRow, peakIdx = np.nonzero((rate[:, :-1] > 0) & (rate[:, 1:] <= 0))
+	bound = np.maximum(alt[peakRow, peakIdx] + rate[peakRow, peakIdx] * step, alt[peakRow, peakIdx + 1] - rate[peakRow, peakIdx + 1] * step)
+	keep = bound >= horizon
+	peakRow, peakIdx = peakRow[keep], peakIdx[keep]
+
+
+	#Refine all the brackets together
+	iterations = max(int(np.ceil(np.log2(step / precision))), 1)
+	bracketRow = np.concatenate((upRow, downRow, peakRow))
+	lo = tt[np.concatenate((upIdx, downIdx, peakIdx))]
+	hi = tt[np.concatenate((upIdx, downIdx, peakIdx)) + 1]
+	isPeak = np.concatenate((np.zeros(len(upRow) + len(downRow), dtype=bool), np.ones(len(peakRow), dtype=bool)))
+
+	refined = _refine(propagator, observers, bracketRow, lo, hi, isPeak, horizon, iterations)
+
+	upTime = refined[:len(upRow)]
+	downTime = refined[len(upRow):len(upRow) + len(downRow)]
+	peakTime = refined[len(upRow) + len(downRow):]
+	peakAlt = _evaluate(propagator, observers, peakRow, peakTime, np.zeros(len(peakRow), dtype=bool), 0.0)
+
+
+	#Only culminations above the horizon make a pass
+	keep = peakAlt >= horizon
+	peakRow, peakIdx, peakTime, peakAlt = peakRow[keep], peakIdx[keep], peakTime[keep], peakAlt[keep]
+
+
+	#Very short passes can rise and set between two grid points so neither crossing was bracketed
+	short = ~above[peakRow, peakIdx] & ~above[peakRow, peakIdx + 1]
+	if short.any():
+		k = np.count_nonzero(short)
+		shortRow = np.concatenate((peakRow[short], peakRow[short]))
+		lo = np.concatenate((tt[peakIdx[short]], peakTime[short]))
+		hi = np.concatenate((peakTime[short], tt[peakIdx[short] + 1]))
+		shortTime = _refine(propagator, observers, shortRow, lo, hi, np.zeros(2*k, dtype=bool), horizon, iterations)
+
+		upRow = np.concatenate((upRow, peakRow[short]))
+		upTime = np.concatenate((upTime, shortTime[:k]))
+		downRow = np.concatenate((downRow, peakRow[short]))
+		downTime = np.concatenate((downTime, shortTime[k:]))
+
+
+	#Satellites already up and descending at t0 or up and ascending at t1 culminate at the window edge
+	first = np.nonzero(above[:, 0] & ~(rate[:, 0] > 0))[0]
+	last = np.nonzero(above[:, -1] & (rate[:, -1] > 0))[0]
+	peakRow = np.concatenate((peakRow, first, last))
+	peakTime = np.concatenate((peakTime, np.full(len(first), tt[0]), np.full(len(last), tt[-1])))
+	peakAlt = np.concatenate((peakAlt, alt[first, 0], alt[last, -1]))
+
+
+	#Sort the crossings by row then time so each culmination can look up its neighbours
+	#A sentinel crossing belonging to no row is put at each end to avoid bounds checks
+	crossRow = np.concatenate(([-1], upRow, downRow, [rows]))
+	crossTime = np.concatenate(([tt[0]], upTime, downTime, [tt[-1]]))
+	crossUp = np.concatenate(([False], np.ones(len(upRow), dtype=bool), np.zeros(len(downRow), dtype=bool), [True]))
+
+	span = tt[-1] - tt[0] + 1.0
+	crossKey = crossRow * span + (crossTime - tt[0])
+	order = np.argsort(crossKey, kind="stable")
+	crossRow, crossTime, crossUp, crossKey = crossRow[order], crossTime[order], crossUp[order], crossKey[order]
+
+	peakKey = peakRow * span + (peakTime - tt[0])
+	nxt = np.searchsorted(crossKey, peakKey, side="right")
+	prv = nxt - 1
+
+	hasPrev = crossRow[prv] == peakRow
+	hasNext = crossRow[nxt] == peakRow
+
+	#A culmination has to sit between a rise and a set to be consistent
+	valid = (hasPrev & crossUp[prv]) | (~hasPrev & above[peakRow, 0])
+	valid &= (hasNext & ~crossUp[nxt]) | (~hasNext & above[peakRow, -1])
+
+	peakRow, peakTime, peakAlt = peakRow[valid], peakTime[valid], peakAlt[valid]
+	prv, nxt, hasPrev, hasNext = prv[valid], nxt[valid], hasPrev[valid], hasNext[valid]
+
+
+	#Several culminations in one pass are possible, keep only the highest
+	passID = np.where(hasNext, nxt, len(crossRow) + peakRow)
+	order = np.lexsort((-peakAlt, passID))
+	passID = passID[order]
+	firstOfPass = np.ones(len(passID), dtype=bool)
+	firstOfPass[1:] = passID[1:] != passID[:-1]
+	order = order[firstOfPass]
+
+	peakRow, peakTime, peakAlt = peakRow[order], peakTime[order], peakAlt[order]
+	prv, nxt, hasPrev, hasNext = prv[order], nxt[order], hasPrev[order], hasNext[order]
+
+	riseTime = np.where(hasPrev, crossTime[prv], tt[0])
+	setTime = np.where(hasNext, crossTime[nxt], tt[-1])
+
+
+	#Split back into locations, ordered by satellite then time like a per satellite search would
+	output = []
+	for s in range(len(observers)):
+		inSite = np.nonzero((peakRow >= s*n) & (peakRow < (s+1)*n))[0]
+		order = inSite[np.lexsort((riseTime[inSite], peakRow[inSite]))]
+
+		output.append({
+			"satIndex" : peakRow[order] - s*n,
+			"riseTime" : riseTime[order],
+			"maxTime" : peakTime[order],
+			"setTime" : setTime[order],
+			"maxAlt" : peakAlt[order],
+			"risePartial" : ~hasPrev[order],
+			"setPartial" : ~hasNext[order]
+		})
+
+	return output
+
+
+
+
+# Bisect many brackets at once, each bracket is either a horizon crossing (altitude - horizon)
+# or a culmination (altitude rate) and has a sign change between lo and hi
+# Args: propagator = ConstellationPropagator, observers = array of Observer, rows = array of int, lo = array TT, hi = array TT,
+#       isPeak = array of bool, horizon = num deg, iterations = num
+# Returns: array of TT
+def _refine(propagator, observers, rows, lo, hi, isPeak, horizon, iterations):
+	if len(rows) == 0:
+		return np.zeros(0)
+
+	return bisect(lambda tt: _evaluate(propagator, observers, rows, tt, isPeak, horizon), lo, hi, iterations)
+
+
+
+
+# Bisect many brackets at once, function(tt) gives one value per bracket and has a sign change between lo and hi
+# Finishes with a linear interpolation across the last bracket
+# Args: function = function, lo = array TT, hi = array TT, iterations = num
+# Returns: array of TT
+def bisect(function, lo, hi, iterations):
+	if len(lo) == 0:
+		return np.zeros(0)
+
+	lo = lo.copy()
+	hi = hi.copy()
+	gLo = function(lo)
+	gHi = function(hi)
+
+	for i in range(iterations):
+		mid = (lo + hi) / 2
+		gMid = function(mid)
+
+		#Keep the half that still contains the sign change
+		left = (gMid >= 0) != (gLo >= 0)
+		hi = np.where(left, mid, hi)
+		gHi = np.where(left, gMid, gHi)
+		lo = np.where(left, lo, mid)
+		gLo = np.where(left, gLo, gMid)
+
+	denominator = gLo - gHi
+	fraction = np.where(denominator != 0, gLo / np.where(denominator != 0, denominator, 1), 0.5)
+	return lo + (hi - lo) * np.clip(fraction, 0, 1)
+
+
+
+
+# The function whose sign change is being searched for in _refine,
+# altitude - horizon for crossings and altitude rate for culminations
+# Args: propagator = ConstellationPropagator, observers = array of Observer, rows = array of int, tt = array TT,
+#       isPeak = array of bool, horizon = num deg
+# Returns: array
+def _evaluate(propagator, observers, rows, tt, isPeak, horizon):
+	if len(rows) == 0:
+		return np.zeros(0)
+
+	site, sats = np.divmod(rows, len(propagator))
+	r, v, e = propagator.propagatePairs(sats, propagator.ts.tt_jd(tt))
+
+	output = np.empty(len(rows))
+	for s, observer in enumerate(observers):
+		idx = np.nonzero(site == s)[0]
+		if len(idx) == 0:
+			continue
+		alt = observer.altAz(r[idx])[0]
+		rate = observer.altitudeRate(r[idx], v[idx])
+		output[idx] = np.where(isPeak[idx], rate, alt - horizon)
+
+	return output
@@ -21,131 +21,205 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 
-import datetime as dt
+import numpy as np
 
 from satFunctions import *
-from skyfield.api import utc
+from constellationPropagator import ConstellationPropagator, DAY_S
+from findEvents import findEventsMulti
+from earthShadow import findSunlit, summarizeSunlit
+from passTable import *
+
+
+#Seconds a target off the peak is kept inside the sunlit part of its pass
+TARGET_MARGIN = 1.0
 
 
 
 
 # Find all the valid flyover passes within the time frame for the provided TLE, location, and date range
-# Args: tle = string, loc = skyfield topos, start = datetime, stop = datetime
-# Returns: array of dict
-def findPass(tle, loc, start, stop):
+# Passes that are cut off by the start or end of the time frame are skipped
+# Args: tle = string, loc = skyfield topos, start = datetime, stop = datetime, context = EphemerisContext
+# Returns: PassTable
+def findPass(tle, loc, start, stop, context=None):
+	return findPasses([tle], loc, start, stop, context, partial=False)
 
-	#Split the tle
-	name, line1, line2 = tle
-	noradID = parseTLEID(tle)
-	
 
-	#Initialization
-	sat = skyfield.sgp4lib.EarthSatellite(line1, line2, name)
-	ts = skyfield.api.load.timescale()
-	
 
-	#Convert datetimes to Skyfield time objects
-	try: 
-		t0 = ts.utc(start)
-		t1 = ts.utc(stop)
-	except: #date lacks valid timezone, assuming utc
-		t0 = ts.utc(start.replace(tzinfo=utc))
-		t1 = ts.utc(stop.replace(tzinfo=utc))
-
-
-	#Find flyover passes within time frame
-	time, events = sat.find_events(loc, t0, t1, altitude_degrees = 0.0)
-
-	
-	#Construct passes from each set of three event types
-	#Can definitley be done in a better more pythonic way
-	passes = [] #list of type [ [rise,climax,set]... ]
-	temp=[]
-	for t, e in zip(time,events):
-		temp.append(t)
-		if e == 2:
-			#Event type set, save the sublist and clear temp
-			passes.append(temp)
-			temp = []
-
-
-	#Iterate through passes and compute ephemerides for each
-	output = []
-	for p in passes:
-		try:
-			rise = computeEphemeris(tle,loc,p[0])
-			peak = computeEphemeris(tle,loc,p[1])
-			sett = computeEphemeris(tle,loc,p[2])
-		except IndexError as e:
-			print("... incomplete pass, skipping!")
-			continue
-
-		#Determine pass duration
-		try:
-			duration = sett["time"] - rise["time"]
-		except Exception as e: 
-			print(e)
-			duration = "error"
-
-
-		#Organize parameters into dictionary for easy retrieval later
-		passs = {
-			"name" : rise["name"],
-			"id" : rise["id"],
-			"riseTime" : rise["time"],
-			"riseAz" : rise["azimuth"],
-			"maxTime" : peak["time"],
-			"maxAlt" : peak["altitude"],
-			"maxAz" : peak["azimuth"],
-			"maxRA" : peak["ra"],
-			"maxDec" : peak["dec"],
-			"maxVel" : peak["velocity"],
-			"range" : peak["range"],
-			"height" : peak["height"],
-			"sunElong" : peak["sunElong"],
-			"moonElong" : peak["moonElong"],
-			"setTime" : sett["time"],
-			"setAz" : sett["azimuth"],
-			"duration" : duration,
-			"eclipsed" : peak["eclipsed"],
-			"sunUp" : peak["sunUp"],
-			"moonUp" : peak["moonUp"]
-		}
-
-		#Save the parameters
-		output.append(passs)
 
-	return output
+# Find all the flyover passes of every TLE in a list within the time frame for a location
+# All satellites are searched at once with the constellation wide event finder
+# Passes already up at start or still up at stop are kept and flagged with risePartial/setPartial
+# unless partial is False
+# Every pass also gets a target to image, the sunlit time closest to its peak with the altitude,
+# azimuth, RA and Dec there, for a pass that is sunlit at its peak or never sunlit it is the peak
+# Args: tleList = array of tle, loc = skyfield topos, start = datetime, stop = datetime, context = EphemerisContext,
+#       propagator = ConstellationPropagator of tleList, partial = bool, step = num seconds, night = NightContext of loc
+# Returns: PassTable
+def findPasses(tleList, loc, start, stop, context=None, propagator=None, partial=True, step=30, night=None):
+	passes = findPassesMulti(tleList, {None : loc}, start, stop, context, propagator, partial, step, {None : night})
+	return passes[None]
 
 
 
 
-# Filter a list of passes for certain conditions
-# None is a wildcard
-# Args: passes = array of dict, sun = bool, moon = bool, eclipsed = bool, alt=num
-# Returns: array of dict
-def filterPasses(passes, sun=None, moon=None, eclipsed=None, alt=None):
-	output = []
+# Same as findPasses for several locations at once, each satellite is only propagated once
+# and the topocentric positions for every location come from the shared positions
+# Passes get a "site" column with the name of their location unless the name is None
+# The Sun and Moon of a location come from its NightContext when one is given
+# Args: tleList = array of tle, locs = dict of name : skyfield topos, start = datetime, stop = datetime, context = EphemerisContext,
+#       propagator = ConstellationPropagator of tleList, partial = bool, step = num seconds, nights = dict of name : NightContext
+# Returns: dict of name : PassTable
+def findPassesMulti(tleList, locs, start, stop, context=None, propagator=None, partial=True, step=30, nights=None):
 
-	for p in passes:
-		#Check for invalidations
-		if  (sun != None and p["sunUp"] != sun):
-			continue
-		if (moon != None and p["moonUp"] != moon):
-			continue
-		if (eclipsed != None and p["eclipsed"] != eclipsed):
-			continue
-		if (alt != None and p["maxAlt"] < alt):
-			continue
-
-		#If valid, append pass to output list
-		output.append(p)
+	#Initialization, the ephemeris and satellites are shared through the context
+	if context == None:
+		context = EphemerisContext()
+	instruments = context.instruments
+
+	if propagator == None:
+		with instruments.stage("buildPropagator"):
+			propagator = ConstellationPropagator(tleList, context)
+	instruments.count("satellitesPropagated", len(propagator))
+
+	ts = context.ts
+	names = list(locs.keys())
+	sites = [locs[name] for name in names]
+	siteNights = [None if nights == None else nights.get(name) for name in names]
+
+
+	#Convert datetimes to Skyfield time objects
+	t0 = convertTime(ts, start)
+	t1 = convertTime(ts, stop)
+	if t1.tt <= t0.tt:
+		raise ValueError("The stop time has to be after the start time")
+
+
+	#Find rise, peak, and set of every pass of every satellite for every location
+	with instruments.stage("findEvents"):
+		siteEvents = findEventsMulti(propagator, sites, t0, t1, step)
+	instruments.count("eventsFound", sum(len(events["satIndex"]) for events in siteEvents))
+
+	if not partial:
+		for i, events in enumerate(siteEvents):
+			complete = ~(events["risePartial"] | events["setPartial"])
+			instruments.count("incompletePassesSkipped", np.count_nonzero(~complete))
+			siteEvents[i] = {k : v[complete] for k, v in events.items()}
+
+	counts = [len(events["satIndex"]) for events in siteEvents]
+	if sum(counts) == 0:
+		return {name : emptyPassTable(name != None) for name in names}
+
+
+	riseTime = np.concatenate([events["riseTime"] for events in siteEvents])
+	maxTime = np.concatenate([events["maxTime"] for events in siteEvents])
+	setTime = np.concatenate([events["setTime"] for events in siteEvents])
+	passSat = np.concatenate([events["satIndex"] for events in siteEvents])
+	passSite = np.concatenate([np.full(c, i) for i, c in enumerate(counts)])
+	total = sum(counts)
+
+
+	#Find the sunlit part of every pass, a pass only counts as eclipsed if it never leaves the shadow
+	with instruments.stage("findSunlit"):
+		sunlit = findSunlit(propagator, passSat, riseTime, setTime, context)
+		sunlitStart, sunlitEnd, sunlitFraction = summarizeSunlit(sunlit, riseTime, setTime)
+	isSunlit = ~np.isnan(sunlitStart)
+
+	#Passes are imaged at the sunlit time closest to the peak, the peak itself if it is sunlit or the pass never is
+	#A target at the edge of the shadow is kept a second inside the sunlit part, past the precision of the edge
+	margin = np.minimum(TARGET_MARGIN / DAY_S, (sunlitEnd[isSunlit] - sunlitStart[isSunlit]) / 2)
+	targetTime = maxTime.copy()
+	targetTime[isSunlit] = np.clip(maxTime[isSunlit], sunlitStart[isSunlit] + margin, sunlitEnd[isSunlit] - margin)
+	moved = np.nonzero(targetTime != maxTime)[0]
+	instruments.count("targetsMoved", len(moved))
+
+
+	#Compute ephemerides for every rise, peak, and set of every location and the targets off the peak in one batch
+	times = ts.tt_jd(np.concatenate((riseTime, maxTime, setTime, targetTime[moved])))
+	timeSat = np.concatenate((np.tile(passSat, 3), passSat[moved]))
+	timeSite = np.concatenate((np.tile(passSite, 3), passSite[moved]))
+	with instruments.stage("computeEphemeris"):
+		ephem = computeEphemerisBatch(tleList, sites, times, timeSat, context, timeSite, siteNights)
+
+	rise = slice(0, total)
+	peak = slice(total, 2*total)
+	sett = slice(2*total, 3*total)
+	target = np.arange(total, 2*total)
+	target[moved] = 3*total + np.arange(len(moved))
+
+	sunlitStartTime = np.full(total, np.datetime64("NaT", "us"))
+	sunlitEndTime = np.full(total, np.datetime64("NaT", "us"))
+	if isSunlit.any():
+		sunlitStartTime[isSunlit] = timesToDatetime64(ts.tt_jd(sunlitStart[isSunlit]))
+		sunlitEndTime[isSunlit] = timesToDatetime64(ts.tt_jd(sunlitEnd[isSunlit]))
+
+
+	#Organize the parameters into columns, one row per pass
+	passTimes = timesToDatetime64(times)
+	columns = {
+		"name" : ephem["name"][rise].astype(str),
+		"id" : ephem["id"][rise].astype(str),
+		"riseTime" : passTimes[rise],
+		"riseAz" : ephem["azimuth"][rise],
+		"maxTime" : passTimes[peak],
+		"maxAlt" : ephem["altitude"][peak],
+		"maxAz" : ephem["azimuth"][peak],
+		"maxRA" : ephem["ra"][peak],
+		"maxDec" : ephem["dec"][peak],
+		"maxVel" : ephem["velocity"][peak],
+		"range" : ephem["range"][peak],
+		"height" : ephem["height"][peak],
+		"sunElong" : ephem["sunElong"][peak],
+		"moonElong" : ephem["moonElong"][peak],
+		"setTime" : passTimes[sett],
+		"setAz" : ephem["azimuth"][sett],
+		"duration" : passTimes[sett] - passTimes[rise],
+		"eclipsed" : ~isSunlit,
+		"sunlitStart" : sunlitStartTime,
+		"sunlitEnd" : sunlitEndTime,
+		"sunlitFraction" : sunlitFraction,
+		"targetTime" : passTimes[target],
+		"targetAlt" : ephem["altitude"][target],
+		"targetAz" : ephem["azimuth"][target],
+		"targetRA" : ephem["ra"][target],
+		"targetDec" : ephem["dec"][target],
+		"sunUp" : ephem["sunUp"][peak],
+		"moonUp" : ephem["moonUp"][peak],
+		"risePartial" : np.concatenate([events["risePartial"] for events in siteEvents]),
+		"setPartial" : np.concatenate([events["setPartial"] for events in siteEvents])
+	}
+	allPasses = PassTable(columns)
+
+
+	#Split the table back up by location
+	output = {}
+	offset = 0
+	for name, n in zip(names, counts):
+		passes = allPasses[offset:offset + n]
+		if name != None:
+			passes.columns["site"] = np.full(n, name)
+
+		output[name] = passes
+		offset += n
 
 	return output
 
 
 
 
+# Filter a list of passes for certain conditions
+# None is a wildcard, partial = False drops passes cut off by the ends of the time frame
+# eclipsed = False keeps every pass that is sunlit for at least part of the time it is up
+# alt is the altitude at the target, maxSunAlt keeps passes whose target is while the Sun is at or below
+# that altitude, looked up in the night's tables
+# Args: passes = PassTable or array of dict, sun = bool, moon = bool, eclipsed = bool, alt=num, partial = bool,
+#       instruments = Instrumentation to count the passes dropped by each condition, maxSunAlt = num deg, night = NightContext
+# Returns: PassTable
+def filterPasses(passes, sun=None, moon=None, eclipsed=None, alt=None, partial=None, instruments=None, maxSunAlt=None, night=None):
+	return toPassTable(passes).filter(sun, moon, eclipsed, alt, partial, instruments, maxSunAlt, night)
+
+
+
+
 # Prints the info from a single pass event in the format: [name, id, riseTime, riseAz, maxAltTime, maxAlt, maxAz, setTime, setAz, duration, eclipsed, sunUp, moonUp]
 # Args: passs = dict
 # Returns: nothing
@@ -156,7 +230,7 @@ def printPass(passs):
 
 
 # Prints a full list of pass events with informative header
-# Args: passes = array of dict
+# Args: passes = PassTable or array of dict
 # Returns: nothing
 def printPassList(passes):
 	#Print the header and list of passes
@@ -170,7 +244,7 @@ def printPassList(passes):
 
 
 # Reformat array of dicts into singular array with the requested values in headerNames
-# Args: passes = array of dict, headerNames = array of string
+# Args: passes = PassTable or array of dict, headerNames = array of string
 # Returns: array
 def makePassArray(passes, headerNames=None):
 	if headerNames == None:
@@ -0,0 +1,205 @@
+# instrumentation.py
+#
+# Stage timings and counters of a pass prediction run
+#
+# Harry Krantz
+# Steward Observatory
+# University of Arizona
+# Copyright May 2020
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import json
+import re
+import time
+from collections import OrderedDict
+
+
+
+
+# Records the wall time spent in each named stage and any number of named counters
+# Stages can be nested, the time of an inner stage is also counted in the outer one
+# Progress messages go through log() and are only printed when verbose
+# Args: prefix = string used for the Prometheus metric names, verbose = bool
+class Instrumentation:
+
+	enabled = True
+
+	def __init__(self, prefix="starlink", verbose=False):
+		self.prefix = prefix
+		self.verbose = verbose
+		self.reset()
+
+
+	# Time a block of code, use as: with instruments.stage("name"):
+	# Args: name = string
+	# Returns: context manager
+	def stage(self, name):
+		return _Stage(self, name)
+
+
+	# Add to a counter
+	# Args: name = string, n = num
+	# Returns: nothing
+	def count(self, name, n=1):
+		self.counters[name] = self.counters.get(name, 0) + int(n)
+
+
+	# Print a progress message if verbose
+	# Args: message = string
+	# Returns: nothing
+	def log(self, message=""):
+		if self.verbose:
+			print(message)
+
+
+	# Forget everything recorded so far
+	# Args: none
+	# Returns: nothing
+	def reset(self):
+		self.stages = OrderedDict()
+		self.counters = OrderedDict()
+
+
+	# Everything recorded as a dict
+	# Args: none
+	# Returns: dict
+	def report(self):
+		return {
+			"stages" : {name : {"seconds" : s[0], "calls" : s[1]} for name, s in self.stages.items()},
+			"counters" : dict(self.counters)
+		}
+
+
+	# Args: filename = string or None
+	# Returns: string
+	def toJSON(self, filename=None):
+		text = json.dumps(self.report(), indent=1)
+		if filename != None:
+			with open(filename, "w") as f:
+				f.write(text)
+		return text
+
+
+	# Everything recorded in the Prometheus text exposition format
+	# Args: filename = string or None
+	# Returns: string
+	def toPrometheus(self, filename=None):
+		lines = []
+
+		lines.append("# HELP %s_stage_seconds_total Wall time spent in each stage" % self.prefix)
+		lines.append("# TYPE %s_stage_seconds_total counter" % self.prefix)
+		for name, s in self.stages.items():
+			lines.append('%s_stage_seconds_total{stage="%s"} %.6f' % (self.prefix, name, s[0]))
+
+		lines.append("# HELP %s_stage_calls_total Number of times each stage ran" % self.prefix)
+		lines.append("# TYPE %s_stage_calls_total counter" % self.prefix)
+		for name, s in self.stages.items():
+			lines.append('%s_stage_calls_total{stage="%s"} %d' % (self.prefix, name, s[1]))
+
+		for name, value in self.counters.items():
+			metric = "%s_%s_total" % (self.prefix, _snakeCase(name))
+			lines.append("# TYPE %s counter" % metric)
+			lines.append("%s %d" % (metric, value))
+
+		text = "\n".join(lines) + "\n"
+		if filename != None:
+			with open(filename, "w") as f:
+				f.write(text)
+		return text
+
+
+
+
+# Stand in used when instrumentation is off, every method does nothing
+# Progress messages are still printed if verbose
+# Args: verbose = bool
+class NullInstrumentation:
+
+	enabled = False
+
+	def __init__(self, verbose=False):
+		self.verbose = verbose
+
+	def stage(self, name):
+		return _nullStage
+
+	def count(self, name, n=1):
+		pass
+
+	def log(self, message=""):
+		if self.verbose:
+			print(message)
+
+	def reset(self):
+		pass
+
+	def report(self):
+		return {"stages" : {}, "counters" : {}}
+
+	def toJSON(self, filename=None):
+		return json.dumps(self.report())
+
+	def toPrometheus(self, filename=None):
+		return ""
+
+
+
+
+# Context manager adding its wall time to a stage of an Instrumentation
+class _Stage:
+
+	def __init__(self, instruments, name):
+		self.instruments = instruments
+		self.name = name
+
+	def __enter__(self):
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, *args):
+		stages = self.instruments.stages
+		seconds, calls = stages.get(self.name, (0.0, 0))
+		stages[self.name] = (seconds + time.perf_counter() - self.start, calls + 1)
+		return False
+
+
+
+
+# Context manager that does nothing
+class _NullStage:
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		return False
+
+
+
+
+_nullStage = _NullStage()
+
+#Shared instance used when no instrumentation is given
+nullInstrumentation = NullInstrumentation()
+
+
+
+
+# Convert a camelCase counter name to snake_case for Prometheus
+# Args: name = string
+# Returns: string
+def _snakeCase(name):
+	return re.sub(r"[^a-z0-9_]", "_", re.sub(r"([a-z0-9])([A-Z])", r"\1_\2", name).lower())
@@ -21,6 +21,8 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 
+import itertools
+
 import requests
 import pandas as pd
 
@@ -66,26 +68,54 @@ def loadFileURL(url, satName="SATNAME"):
 # Args: array of string, satname = string
 # Returns: array
 def parseTLEFile(stringList, satName="SATNAME"):
+	return list(iterTLEs(stringList, satName))
+
+
 
-	output = []
+
+# Parse TLE data one TLE at a time from any iterable of lines, nothing is read ahead of the TLE being parsed
+# Args: lines = iterable of string, satname = string
+# Returns: generator of array
+def iterTLEs(lines, satName="SATNAME"):
+	#Blank lines would throw off the alignment of the sets
+	lines = (line for line in lines if line.strip() != "")
 
 	#Separate each TLE set
-	lineNum = 0
-	while lineNum < len(stringList):
+	for line in lines:
 		#If first line
-		if stringList[lineNum][0:2] == "1 ":
-			output.append([satName] + stringList[lineNum:lineNum+2])
-			lineNum += 2
+		if line[0:2] == "1 ":
+			yield [satName, line] + list(itertools.islice(lines, 1))
 		#If second line
-		elif stringList[lineNum][0:2] == "2 ":
-			lineNum += 1
+		elif line[0:2] == "2 ":
+			continue
 		#Else assum title line
 		else:
-			output.append(stringList[lineNum:lineNum+3])
-			lineNum += 3
+			yield [line] + list(itertools.islice(lines, 2))
 
 
-	return output
+
+
+# Stream TLEs from a local file without loading the whole file
+# Args: filename = path, satname = string
+# Returns: generator of array
+def streamFile(filename, satName="SATNAME"):
+	with open(filename) as f:
+		for tle in iterTLEs((line.rstrip("\r\n") for line in f), satName):
+			yield tle
+
+
+
+
+# Stream TLEs from a web hosted file as it downloads
+# Args: url = string, satname = string, timeout = num seconds
+# Returns: generator of array
+def streamFileURL(url, satName="SATNAME", timeout=30):
+	with requests.get(url, stream=True, timeout=timeout) as f:
+		f.raise_for_status()
+		if f.encoding == None:
+			f.encoding = "utf-8"
+		for tle in iterTLEs(f.iter_lines(decode_unicode=True), satName):
+			yield tle
 
 
 
@@ -29,9 +29,12 @@ import os
 from starlinkPassPredictor import *
 from locations import locations
 from writeAcpPlan import *
+from tleCache import TLECache
+from instrumentation import Instrumentation
+from mountModel import MountModel
+from nightContext import NightContext, ASTRONOMICAL
+from trackingEphemeris import trackPasses
 
-from skyfield import api
-from skyfield import almanac
 
 
 
@@ -45,8 +48,15 @@ exposureRepeat = 1
 filterLetter = "v"
 binning = 1
 
-offset = 9 #offset the requested time to allow for slewing etc. 6 sec for starting at center of FOV. increase to trigger sooner
-timePer = dt.timedelta(seconds=90) #minimum number of sec to wait before next target
+#Slew rates, settle, and readout of the telescope, the time between targets depends on how far it has to move
+mount = MountModel(azRate=4.0, altRate=4.0, azAccel=2.0, altAccel=2.0, settle=3.0, exposure=exposureTime, repeat=exposureRepeat, readout=2.0)
+
+offset = mount.offset() #offset the requested time so the peak is in the middle of the first exposure, increase latency to trigger sooner
+timePer = None #fixed minimum time between targets, only used without a mount model
+selectionMode = "optimal" #"optimal" for the best weighted set of passes or "greedy" for the first ones that fit
+outputFormat = "csv" #"parquet" to save the passes as typed columnar files, needs pyarrow
+trackingStep = None #seconds between samples of a dense ephemeris of every selected pass for tracking, None for none
+verbose = True #print progress and the pass lists as it goes
 
 minAlt = 20
 sunUp = False
@@ -72,78 +82,95 @@ staticPath = imagePath
 ###########################
 
 
+#Record how long each stage takes for the run report, progress is printed if verbose
+instruments = Instrumentation(verbose=verbose)
+
+
 #Make a new directory for todays data
 #path = start.strftime('%Y-%m-%d')
 path = imagePath
 
 if os.path.isdir(path):
-	print("%s already exists, opening it..." % path)
+	instruments.log("%s already exists, opening it..." % path)
 else:
 	try:
 	    os.mkdir(path)
 	except OSError:
-	    print ("Creation of the directory %s failed" % path)
+	    instruments.log("Creation of the directory %s failed" % path)
 	else:
-	    print ("Successfully created the directory %s " % path)
+	    instruments.log("Successfully created the directory %s " % path)
 
 
 ###########################
 
+#Load the timescale and ephemeris once for both evening and morning
+context = EphemerisContext(instruments=instruments)
 
-ts = api.load.timescale()
-e = api.load('de421.bsp')
+#Evening and morning share one TLE download through the cache
+tleCache = TLECache("tleCache", instruments=instruments)
 
-
-### Evening ###
-print("\n\n ### EVENING ### \n\n")
+#Twilight and the Sun and Moon for the whole night, shared by the evening and the morning
+night = NightContext(context, loc, start, start.replace(hour=15))
 
 
-#Determine when is sunset and twilight
-t, y = almanac.find_discrete(ts.utc(start.replace(tzinfo=api.utc)), ts.utc(stop.replace(tzinfo=api.utc)), almanac.dark_twilight_day(e, loc))
+### Evening ###
+instruments.log("\n\n ### EVENING ### \n\n")
 
-for ti, yi in zip(t,y):
-	if yi == 3:
-		sunset = ti
-	if yi == 1:
-		twilight = ti
 
-twilight = twilight.utc_datetime()
+#Determine when is twilight from the night's tables
+twilight = night.twilight(ASTRONOMICAL, start, stop)[-1]
 
-print("Astronomical Twilght is " + twilight.strftime('%Y-%m-%d %H:%M:%S') )
+instruments.log("Astronomical Twilght is " + twilight.strftime('%Y-%m-%d %H:%M:%S'))
 
 
 ###########################
 
 
+#Satellites seen in the evening count for less in the morning
+observed = set()
+
 #Find all passes
-passes = starlinkPassPredictor(twilight, stop, loc, params, path, "allPassesEvening_" + start.strftime('%Y-%m-%d'))
+passes = starlinkPassPredictor(twilight, stop, loc, params, path, "allPassesEvening_" + start.strftime('%Y-%m-%d'), context, cache=tleCache, night=night, outputFormat=outputFormat)
 
 
-#Select some to observe
-passes = selectStarlinkPasses(passes, timePer, path, "selectedPassesEvening_" + start.strftime('%Y-%m-%d'))
+#Nothing to select or plan if no passes were found
+if len(passes) == 0:
+	instruments.log("No observable passes in the evening, no plan written")
+else:
+	#Select some to observe
+	passes = selectStarlinkPasses(passes, timePer, path, "selectedPassesEvening_" + start.strftime('%Y-%m-%d'), selectionMode, mount=mount, outputFormat=outputFormat, instruments=instruments)
 
+	observed = set(passes["id"])
+
+
+	###########################
 
-###########################
 
+	#Make an ACP plan
+	filename = "starlinkPlanEvening.txt"
+	instruments.log("Writing ACP Plan as " + filename)
 
-#Make an ACP plan
-filename = "starlinkPlanEvening.txt"
-print("Writing ACP Plan as " + filename)
+	#Reorganize for ACP plan
+	obs = []
+	for p in passes:
+		obs.append([p["name"],p["targetTime"],offset,p["targetRA"],p["targetDec"],p["targetAlt"],p["targetAz"]])
 
-#Reorganize for ACP plan
-obs = []
-for p in passes:
-	obs.append([p["name"],p["maxTime"],offset,p["maxRA"],p["maxDec"],p["maxAlt"],p["maxAz"]])
+	#Write ACP plan for Pomenis once and copy it to the static path
+	writeAcpPlan(obs, exposureTime, exposureRepeat, filterLetter, binning, imagePath, os.path.join(path, filename), False, [os.path.join(staticPath, filename)])
 
-#Write ACP plan for Pomenis
-writeAcpPlan(obs, exposureTime, exposureRepeat, filterLetter, binning, imagePath, os.path.join(path, filename), False)
-writeAcpPlan(obs, exposureTime, exposureRepeat, filterLetter, binning, imagePath, os.path.join(staticPath, filename), False)
+
+	#Dense ephemeris of every selected pass from the TLEs the passes were found with
+	if trackingStep != None:
+		instruments.log("Writing tracking ephemerides")
+		tracks = trackPasses(passes, loadFile(os.path.join(path, "starlinkTLE.txt")), loc, context, trackingStep)
+		tracks.save(os.path.join(path, "trackingEvening_" + start.strftime('%Y-%m-%d') + ".npz"))
+		tracks.toTrackingFiles(os.path.join(path, "trackingEvening"))
 
 
 
 ### Morning ###
 
-print("\n\n ### MORNING ### \n\n")
+instruments.log("\n\n ### MORNING ### \n\n")
 
 start = dt.datetime.utcnow().replace(hour=9, minute=00, second=00)
 stop = dt.datetime.utcnow().replace(hour=15, minute=00, second=00)
@@ -152,51 +179,60 @@ stop = dt.datetime.utcnow().replace(hour=15, minute=00, second=00)
 #stop = dt.datetime(2020,5,28,15,00,00)
 
 
-#Determine when is sunset and twilight
-t, y = almanac.find_discrete(ts.utc(start.replace(tzinfo=api.utc)), ts.utc(stop.replace(tzinfo=api.utc)), almanac.dark_twilight_day(e, loc))
-
-for ti, yi in zip(t,y):
-	if yi == 3:
-		sunset = ti
-	if yi == 1:
-		twilight = ti
-
-twilight = twilight.utc_datetime()
+#Determine when is twilight from the night's tables
+twilight = night.twilight(ASTRONOMICAL, start, stop)[-1]
 
-print("Astronomical Twilght is " + twilight.strftime('%Y-%m-%d %H:%M:%S') )
+instruments.log("Astronomical Twilght is " + twilight.strftime('%Y-%m-%d %H:%M:%S'))
 
 
 ###########################
 
 
 #Find all passes
-passes = starlinkPassPredictor(start, twilight, loc, params, path, "allPassesMorning_" + start.strftime('%Y-%m-%d'))
+passes = starlinkPassPredictor(start, twilight, loc, params, path, "allPassesMorning_" + start.strftime('%Y-%m-%d'), context, cache=tleCache, night=night, outputFormat=outputFormat)
 
-#Select some to observe
-passes = selectStarlinkPasses(passes, timePer, path, "selectedPassesMorning_" + start.strftime('%Y-%m-%d'))
+#Nothing to select or plan if no passes were found
+if len(passes) == 0:
+	instruments.log("No observable passes in the morning, no plan written")
+else:
+	#Select some to observe
+	passes = selectStarlinkPasses(passes, timePer, path, "selectedPassesMorning_" + start.strftime('%Y-%m-%d'), selectionMode, observed=observed, mount=mount, outputFormat=outputFormat, instruments=instruments)
 
 
-###########################
+	###########################
 
 
-#Make an ACP plan
-filename = "starlinkPlanMorning.txt"
-print("Writing ACP Plan as " + filename)
+	#Make an ACP plan
+	filename = "starlinkPlanMorning.txt"
+	instruments.log("Writing ACP Plan as " + filename)
 
-#Reorganize for ACP plan
-obs = []
-for p in passes:
-	obs.append([p["name"],p["maxTime"],offset,p["maxRA"],p["maxDec"],p["maxAlt"],p["maxAz"]])
+	#Reorganize for ACP plan
+	obs = []
+	for p in passes:
+		obs.append([p["name"],p["targetTime"],offset,p["targetRA"],p["targetDec"],p["targetAlt"],p["targetAz"]])
 
-#Write ACP plan for Pomenis
-writeAcpPlan(obs, exposureTime, exposureRepeat, filterLetter, binning, imagePath, os.path.join(path, filename), True)
-writeAcpPlan(obs, exposureTime, exposureRepeat, filterLetter, binning, imagePath, os.path.join(staticPath, filename), True)
+	#Write ACP plan for Pomenis once and copy it to the static path
+	writeAcpPlan(obs, exposureTime, exposureRepeat, filterLetter, binning, imagePath, os.path.join(path, filename), True, [os.path.join(staticPath, filename)])
+
+
+	#Dense ephemeris of every selected pass from the TLEs the passes were found with
+	if trackingStep != None:
+		instruments.log("Writing tracking ephemerides")
+		tracks = trackPasses(passes, loadFile(os.path.join(path, "starlinkTLE.txt")), loc, context, trackingStep)
+		tracks.save(os.path.join(path, "trackingMorning_" + start.strftime('%Y-%m-%d') + ".npz"))
+		tracks.toTrackingFiles(os.path.join(path, "trackingMorning"))
 
 
 ###########################
 
 
-print("Done!")
+instruments.log("Done!")
+
 
 
+###########################
+
 
+#Save the stage timings and counters of the run
+instruments.toJSON(os.path.join(path, "runReport.json"))
+instruments.toPrometheus(os.path.join(path, "runReport.prom"))
@@ -0,0 +1,107 @@
+# mountModel.py
+#
+# How long the telescope needs to get from one target to the next
+#
+# Harry Krantz
+# Steward Observatory
+# University of Arizona
+# Copyright May 2020
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import numpy as np
+
+
+
+
+# Timing of an alt-az mount and camera observing a list of targets like the ACP plan does
+# For each target the mount slews to the peak position, settles, takes a background frame,
+# waits, and then takes the exposures starting offset() seconds before the peak
+# Each axis speeds up at a constant acceleration to its top rate and slows down the same way,
+# both axes move at once so a slew takes as long as the slower axis
+# Every method takes numbers or numpy arrays of any matching shape
+# Args: azRate = num deg/s, altRate = num deg/s, azAccel = num deg/s^2, altAccel = num deg/s^2, settle = num seconds,
+#       exposure = num seconds, repeat = num of exposures, readout = num seconds per exposure,
+#       background = bool take a background frame first, latency = num seconds from the start time to the shutter opening
+class MountModel:
+
+	def __init__(self, azRate=4.0, altRate=4.0, azAccel=2.0, altAccel=2.0, settle=3.0, exposure=3.0, repeat=1, readout=2.0, background=True, latency=7.5):
+		self.azRate = azRate
+		self.altRate = altRate
+		self.azAccel = azAccel
+		self.altAccel = altAccel
+		self.settle = settle
+		self.exposure = exposure
+		self.repeat = repeat
+		self.readout = readout
+		self.background = background
+		self.latency = latency
+
+
+	# Seconds to move between two pointings, not including the settle time
+	# Args: az0 = deg, alt0 = deg, az1 = deg, alt1 = deg
+	# Returns: num or array
+	def slewTime(self, az0, alt0, az1, alt1):
+		#Azimuth goes the short way around
+		azDistance = np.abs((np.asarray(az1) - az0 + 180) % 360 - 180)
+		altDistance = np.abs(np.asarray(alt1) - alt0)
+
+		return np.maximum(_axisTime(azDistance, self.azRate, self.azAccel), _axisTime(altDistance, self.altRate, self.altAccel))
+
+
+	# Seconds the exposures of one target take
+	# Args: none
+	# Returns: num
+	def observeTime(self):
+		return self.repeat * (self.exposure + self.readout)
+
+
+	# Seconds after arriving at a target before it is ready for the exposures
+	# Args: none
+	# Returns: num
+	def setupTime(self):
+		return self.settle + (self.exposure + self.readout if self.background else 0)
+
+
+	# Seconds before the peak of a pass to start, so the peak is in the middle of the first exposure
+	# Args: none
+	# Returns: num
+	def offset(self):
+		return self.latency + self.exposure / 2
+
+
+	# Least time from the start of the exposures of one target to the start of the next
+	# Args: az0 = deg, alt0 = deg, az1 = deg, alt1 = deg
+	# Returns: num or array
+	def transitionTime(self, az0, alt0, az1, alt1):
+		return self.observeTime() + self.slewTime(az0, alt0, az1, alt1) + self.setupTime()
+
+
+	# Longest any transition can take, half way around in azimuth and horizon to zenith
+	# Args: none
+	# Returns: num
+	def maxTransitionTime(self):
+		return float(self.transitionTime(0, 0, 180, 90))
+
+
+
+
+# Seconds for one axis to move a distance starting and ending at rest
+# Short moves never reach the top rate and spend the whole time speeding up and slowing down
+# Args: distance = deg, rate = deg/s, accel = deg/s^2
+# Returns: num or array
+def _axisTime(distance, rate, accel):
+	ramp = rate**2 / accel
+	return np.where(distance < ramp, 2 * np.sqrt(distance / accel), distance / rate + rate / accel)
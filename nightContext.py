@@ -0,0 +1,196 @@
+# nightContext.py
+#
+# Sun, Moon, and twilight for one night at one site, computed once and interpolated
+#
+# Harry Krantz
+# Steward Observatory
+# University of Arizona
+# Copyright May 2020
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import datetime as dt
+import numpy as np
+
+from skyfield import almanac
+
+from satFunctions import convertTime
+from passTable import timesToDatetime64, datetime64, _aware
+
+
+#Sky states returned by almanac.dark_twilight_day
+DARK = 0
+ASTRONOMICAL = 1
+NAUTICAL = 2
+CIVIL = 3
+DAY = 4
+
+
+
+
+# The twilight transitions and the apparent Sun and Moon from one site over one night
+# Everything is computed once on a grid of times when it is made and later questions are
+# answered by linear interpolation, with the default one minute grid the altitudes are good
+# to about a thousandth of a degree
+# Only plain arrays are kept so it can be sent to worker processes
+# Args: context = EphemerisContext, loc = skyfield Topos, start = datetime, stop = datetime, step = num seconds
+class NightContext:
+
+	def __init__(self, context, loc, start, stop, step=60):
+		ts = context.ts
+		earth = context.earth
+
+		with context.instruments.stage("nightContext"):
+			t0 = convertTime(ts, start)
+			t1 = convertTime(ts, stop)
+
+			#Grid of times covering the whole night
+			n = int(np.ceil((t1.tt - t0.tt) * 86400 / step)) + 1
+			grid = ts.tt_jd(t0.tt + np.arange(n) * step / 86400)
+
+			l = (earth + loc).at(grid)
+			s = l.observe(context.sun).apparent()
+			m = l.observe(context.moon).apparent()
+
+			#Grid times as TT Julian dates for Skyfield times and as UTC seconds for numpy and python datetimes
+			self.tt = grid.tt
+			self.utc = _seconds(timesToDatetime64(grid))
+
+			#Apparent directions from the site, altitudes, and the Sun from the geocenter for the eclipse test
+			self.sun = s.position.au
+			self.moon = m.position.au
+			self.sunAlt = s.altaz()[0].degrees
+			self.moonAlt = m.altaz()[0].degrees
+			self.sunGeocentric = earth.at(grid).observe(context.sun).position.km
+
+			#Twilight transitions, each time the sky changes to a new state
+			t, y = almanac.find_discrete(t0, t1, almanac.dark_twilight_day(context.planets, loc))
+			self.transitionTimes = list(t.utc_datetime()) if len(y) > 0 else []
+			self.transitionStates = [int(state) for state in y]
+
+
+	# Whether some times are all inside the night
+	# Args: times = Skyfield Time, datetime, or datetime64 (single or array)
+	# Returns: bool
+	def covers(self, times):
+		x, grid = self._coordinates(times)
+		x = np.atleast_1d(x)
+		return len(x) == 0 or (x.min() >= grid[0] and x.max() <= grid[-1])
+
+
+	# The Sun and Moon at some times
+	# Args: times = Skyfield Time, datetime, or datetime64 (single or array)
+	# Returns: dict of sun = apparent position au, moon = apparent position au, sunAlt = deg, moonAlt = deg,
+	#          sunGeocentric = position km, positions are (3,) or (3, n)
+	def at(self, times):
+		x, grid = self._coordinates(times)
+		return {
+			"sun" : _interpolate(x, grid, self.sun),
+			"moon" : _interpolate(x, grid, self.moon),
+			"sunAlt" : _interpolate(x, grid, self.sunAlt),
+			"moonAlt" : _interpolate(x, grid, self.moonAlt),
+			"sunGeocentric" : _interpolate(x, grid, self.sunGeocentric)
+		}
+
+
+	# Args: times = Skyfield Time, datetime, or datetime64 (single or array)
+	# Returns: num or array deg
+	def sunAltitude(self, times):
+		x, grid = self._coordinates(times)
+		return _interpolate(x, grid, self.sunAlt)
+
+
+	# Args: times = Skyfield Time, datetime, or datetime64 (single or array)
+	# Returns: num or array deg
+	def moonAltitude(self, times):
+		x, grid = self._coordinates(times)
+		return _interpolate(x, grid, self.moonAlt)
+
+
+	# Times the sky changes to a state, e.g. ASTRONOMICAL is both the end of nautical twilight in
+	# the evening and the end of full darkness in the morning
+	# Args: state = int, start = datetime, stop = datetime, only times between start and stop are given if set
+	# Returns: array of datetime
+	def twilight(self, state=ASTRONOMICAL, start=None, stop=None):
+		output = []
+		for t, y in zip(self.transitionTimes, self.transitionStates):
+			if y != state:
+				continue
+			if start != None and t < _aware(start):
+				continue
+			if stop != None and t > _aware(stop):
+				continue
+			output.append(t)
+		return output
+
+
+	# Time the sky gets dark enough in the evening, None if it never does during the night
+	# Args: state = int
+	# Returns: datetime
+	def eveningTwilight(self, state=ASTRONOMICAL):
+		for i in range(len(self.transitionStates)):
+			if self.transitionStates[i] == state and self._darkening(i):
+				return self.transitionTimes[i]
+		return None
+
+
+	# Time the sky gets too light in the morning, None if it never does during the night
+	# Args: state = int
+	# Returns: datetime
+	def morningTwilight(self, state=ASTRONOMICAL):
+		for i in reversed(range(len(self.transitionStates))):
+			if self.transitionStates[i] == state and not self._darkening(i):
+				return self.transitionTimes[i]
+		return None
+
+
+	# Whether the sky is getting darker at a transition
+	# Args: i = int
+	# Returns: bool
+	def _darkening(self, i):
+		t = self.transitionTimes[i]
+		minute = dt.timedelta(minutes=1)
+		return self.sunAltitude(t + minute) < self.sunAltitude(t - minute)
+
+
+	# Query times on the matching grid
+	# Args: times = Skyfield Time, datetime, or datetime64
+	# Returns: num or array, array
+	def _coordinates(self, times):
+		if isinstance(times, dt.datetime):
+			return _seconds(datetime64(times)), self.utc
+		if isinstance(times, (np.ndarray, np.datetime64)):
+			return _seconds(times), self.utc
+		return times.tt, self.tt
+
+
+
+
+# Linear interpolation along the last axis of values sampled on a grid
+# Args: x = num or array, grid = array, values = array (..., len(grid))
+# Returns: num or array
+def _interpolate(x, grid, values):
+	if values.ndim == 1:
+		return np.interp(x, grid, values)
+	return np.array([np.interp(x, grid, v) for v in values])
+
+
+
+
+# Seconds since 1970 of UTC numpy datetimes
+# Args: times = datetime64 or array
+# Returns: num or array
+def _seconds(times):
+	return np.asarray(times, dtype="datetime64[us]").astype(np.int64) / 1e6
@@ -0,0 +1,266 @@
+# passCache.py
+#
+# Persistent cache of computed passes so unchanged satellites are not recomputed
+#
+# Harry Krantz
+# Steward Observatory
+# University of Arizona
+# Copyright May 2020
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import datetime as dt
+import hashlib
+import os
+import pickle
+
+import numpy as np
+
+from skyfield.api import utc
+
+from passTable import *
+from passTable import _aware
+from instrumentation import nullInstrumentation
+
+
+#Bump whenever a change to the pass finding would change cached results
+CACHE_VERSION = 6
+
+
+
+
+# Passes cached on disk, one file per (site, ephemeris, search parameters) and inside it
+# one entry per TLE element set holding its passes and the time intervals already searched
+# Only the element sets that are new, or the parts of the window not yet searched, are
+# handed to the finder. Searched intervals are padded by more than the longest pass so
+# passes straddling the edge of an earlier search are never missed.
+# Only complete passes are cached, partial passes depend on the window and are dropped
+# The cache is keyed on the ephemeris of the context the finder uses
+# Args: cacheDir = path, context = EphemerisContext, pad = timedelta, maxUnused = timedelta
+class PassCache:
+
+	def __init__(self, cacheDir="passCache", context=None, pad=dt.timedelta(minutes=30), maxUnused=dt.timedelta(days=7)):
+		self.cacheDir = cacheDir
+		self.ephemeris = "de421.bsp" if context == None else context.ephemerisName
+		self.instruments = nullInstrumentation if context == None else context.instruments
+		self.pad = pad
+		self.maxUnused = maxUnused
+
+		if not os.path.isdir(cacheDir):
+			os.makedirs(cacheDir)
+
+
+	# Get the passes of every TLE for a location and window, computing only what is not cached
+	# The finder is called as finder(tleList, start, stop) and returns a PassTable
+	# Args: tleList = array of tle, loc = skyfield Topos, start = datetime, stop = datetime, finder = function, params = tuple
+	# Returns: PassTable
+	def findPasses(self, tleList, loc, start, stop, finder, params=()):
+		start = _aware(start)
+		stop = _aware(stop)
+		now = dt.datetime.now(utc)
+
+		filename = self.bucketFile(loc, params)
+		entries = self.loadBucket(filename)
+
+
+		#Group the element sets by the parts of the window they still need, each element set once
+		todo = {}
+		seen = set()
+		for tle in tleList:
+			key = tleKey(tle)
+			if key in seen:
+				continue
+			seen.add(key)
+			entry = entries.setdefault(key, {"covered" : [], "passes" : emptyPassTable(), "used" : now})
+			entry["used"] = now
+
+			gaps = tuple(_gaps(entry["covered"], start, stop))
+			if gaps:
+				todo.setdefault(gaps, []).append(tle)
+
+
+		#Compute the missing pieces, passes only carry the NORAD ID so two element sets of one
+		#satellite are never searched in the same call
+		recomputed = 0
+		for gaps, group in todo.items():
+			recomputed += len(group)
+			for tles in _distinctIDs(group):
+				for a, b in gaps:
+					a -= self.pad
+					b += self.pad
+					passes = finder(tles, a, b)
+					passes = passes.filter(partial=False).sortBy("id")
+					ids = passes["id"]
+
+					for tle in tles:
+						entry = entries[tleKey(tle)]
+						first = np.searchsorted(ids, tle[1][2:8], side="left")
+						last = np.searchsorted(ids, tle[1][2:8], side="right")
+						entry["passes"] = _addPasses(entry["passes"], passes[first:last])
+						entry["covered"] = _merge(entry["covered"] + [(a, b)], self.pad)
+
+		self.instruments.log("Pass cache: reused " + str(len(tleList) - recomputed) + " satellites, recomputed " + str(recomputed))
+
+
+		#Forget element sets that have not been asked for in a while
+		for key in [k for k, e in entries.items() if now - e["used"] > self.maxUnused]:
+			del entries[key]
+
+		self.saveBucket(filename, entries)
+
+
+		#Collect the passes inside the window
+		output = []
+		for tle in tleList:
+			passes = entries[tleKey(tle)]["passes"]
+			output.append(passes[passes.inWindow(start, stop)])
+
+		return concatenatePasses(output)
+
+
+	# Load the cached entries of a bucket, anything from another version or ephemeris is thrown away
+	# Args: filename = path
+	# Returns: dict
+	def loadBucket(self, filename):
+		if not os.path.isfile(filename):
+			return {}
+
+		with open(filename, "rb") as f:
+			bucket = pickle.load(f)
+
+		if bucket.get("version") != CACHE_VERSION or bucket.get("ephemeris") != self.ephemeris:
+			self.instruments.log("Pass cache is from a different version or ephemeris, starting over")
+			return {}
+
+		return bucket["entries"]
+
+
+	# Args: filename = path, entries = dict
+	# Returns: nothing
+	def saveBucket(self, filename, entries):
+		bucket = {"version" : CACHE_VERSION, "ephemeris" : self.ephemeris, "entries" : entries}
+
+		#Write to a temporary file first so an interrupted run can't corrupt the cache
+		with open(filename + ".tmp", "wb") as f:
+			pickle.dump(bucket, f, protocol=pickle.HIGHEST_PROTOCOL)
+		os.replace(filename + ".tmp", filename)
+
+
+	# Cache file for a site and search parameters
+	# Args: loc = skyfield Topos, params = tuple
+	# Returns: path
+	def bucketFile(self, loc, params):
+		site = "%.6f,%.6f,%.1f" % (loc.latitude.degrees, loc.longitude.degrees, loc.elevation.m)
+		key = repr((site, self.ephemeris, tuple(params), CACHE_VERSION))
+		return os.path.join(self.cacheDir, hashlib.sha1(key.encode()).hexdigest()[:16] + ".pkl")
+
+
+	# Remove every cached pass
+	# Args: none
+	# Returns: nothing
+	def clear(self):
+		for f in os.listdir(self.cacheDir):
+			if f.endswith(".pkl"):
+				os.remove(os.path.join(self.cacheDir, f))
+
+
+
+
+# Hash of the two element lines of a TLE
+# Args: tle = array of string
+# Returns: string
+def tleKey(tle):
+	return hashlib.sha1((tle[1].strip() + tle[2].strip()).encode()).hexdigest()
+
+
+
+
+# Split TLEs into groups with no NORAD ID twice, the first element set of every satellite
+# in the first group, the second in the next, and so on, keeping their order
+# Args: tleList = array of tle
+# Returns: array of array of tle
+def _distinctIDs(tleList):
+	groups = []
+	seen = {}
+	for tle in tleList:
+		noradID = tle[1][2:8]
+		k = seen.get(noradID, 0)
+		seen[noradID] = k + 1
+		if k == len(groups):
+			groups.append([])
+		groups[k].append(tle)
+	return groups
+
+
+
+
+# Parts of [start, stop] not inside any of the searched intervals
+# Intervals are kept merged, so two that still touch overlap by less than the pad and the
+# seam between them is also returned as a gap
+# Args: covered = array of (datetime, datetime), start = datetime, stop = datetime
+# Returns: array of (datetime, datetime)
+def _gaps(covered, start, stop):
+	gaps = []
+	t = start
+	seam = False
+	for a, b in sorted(covered):
+		if b <= t:
+			continue
+		if a >= stop:
+			break
+		if a > t:
+			gaps.append((t, a))
+		elif seam:
+			gaps.append((a, t))
+		t = b
+		seam = True
+	if t < stop:
+		gaps.append((t, stop))
+	return gaps
+
+
+
+
+# Merge searched intervals that overlap by at least pad, less overlap could hide a straddling pass
+# Args: covered = array of (datetime, datetime), pad = timedelta
+# Returns: array of (datetime, datetime)
+def _merge(covered, pad):
+	output = []
+	for a, b in sorted(covered):
+		if output and (output[-1][1] - a >= pad or b <= output[-1][1]):
+			output[-1] = (output[-1][0], max(output[-1][1], b))
+		else:
+			output.append((a, b))
+	return output
+
+
+
+
+# Add newly computed passes that are not already cached, the same pass found in two
+# overlapping searches only differs by a fraction of a second
+# Args: cached = PassTable sorted by maxTime, passes = PassTable
+# Returns: PassTable
+def _addPasses(cached, passes):
+	if len(cached) == 0:
+		return passes.sortBy("maxTime")
+
+	#Distance from each new pass to the nearest cached one
+	cachedTimes = cached["maxTime"]
+	i = np.searchsorted(cachedTimes, passes["maxTime"])
+	before = np.abs(passes["maxTime"] - cachedTimes[np.maximum(i - 1, 0)])
+	after = np.abs(passes["maxTime"] - cachedTimes[np.minimum(i, len(cached) - 1)])
+	new = np.minimum(before, after) > np.timedelta64(60, "s")
+
+	return concatenatePasses([cached, passes[new]]).sortBy("maxTime")
@@ -0,0 +1,202 @@
+# passIndex.py
+#
+# Fast lookups of the passes of a night by time, altitude, and part of the sky
+#
+# Harry Krantz
+# Steward Observatory
+# University of Arizona
+# Copyright May 2020
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import numpy as np
+
+from passTable import datetime64
+
+
+
+
+# An index over a PassTable built once so questions like "what is up in the next ten minutes" or
+# "what peaks above 60 degrees between 03:00 and 03:30" don't have to look at every pass
+# The passes are split into cells by peak altitude band and azimuth sector and each cell keeps
+# its passes sorted by maxTime, a query binary searches only the cells that can match and checks
+# the passes it finds, so it takes O(cells log n + k)
+# A pass is up from its rise to its set and its peak is between them, so the passes up during a
+# window are found among the peaks within the longest pass of the window
+# Args: passes = PassTable, altStep = num deg per altitude band, azStep = num deg per azimuth sector
+class PassIndex:
+
+	def __init__(self, passes, altStep=10, azStep=45):
+		self.passes = passes
+		self.altStep = altStep
+		self.azStep = azStep
+
+		self.riseTime = passes["riseTime"]
+		self.maxTime = passes["maxTime"]
+		self.setTime = passes["setTime"]
+		self.maxAlt = passes["maxAlt"]
+		self.maxAz = passes["maxAz"] % 360
+
+		#Longest any pass is up, the reach of an overlap query past its window
+		duration = self.setTime - self.riseTime
+		self.longest = duration.max() if len(passes) > 0 else np.timedelta64(0, "us")
+
+		#Cell of every pass, altitudes are clipped so 90 falls in the top band
+		self.altBands = int(np.ceil(90 / altStep))
+		self.azSectors = int(np.ceil(360 / azStep))
+		band = np.clip((self.maxAlt // altStep).astype(int), 0, self.altBands - 1)
+		sector = np.clip((self.maxAz // azStep).astype(int), 0, self.azSectors - 1)
+		cell = band * self.azSectors + sector
+
+		#Every cell's passes in one array sorted by cell then maxTime, cellStarts[c] is where cell c begins
+		self.order = np.lexsort((self.maxTime, cell))
+		self.sortedTime = self.maxTime[self.order]
+		self.cellStarts = np.searchsorted(cell[self.order], np.arange(self.altBands * self.azSectors + 1))
+
+
+	def __len__(self):
+		return len(self.passes)
+
+
+	# Passes peaking between start and stop
+	# Args: start = datetime, stop = datetime, minAlt = deg, maxAlt = deg, azimuth = [from, to] deg clockwise from north
+	# Returns: PassTable sorted by maxTime
+	def peaking(self, start, stop, minAlt=None, maxAlt=None, azimuth=None):
+		return self.passes[self.peakingIndices(start, stop, minAlt, maxAlt, azimuth)]
+
+
+	# Passes above the horizon at any time between start and stop, or at start if there is no stop
+	# The altitude and azimuth are those of the peak
+	# Args: start = datetime, stop = datetime, minAlt = deg, maxAlt = deg, azimuth = [from, to] deg clockwise from north
+	# Returns: PassTable sorted by maxTime
+	def up(self, start, stop=None, minAlt=None, maxAlt=None, azimuth=None):
+		start = datetime64(start)
+		stop = start if stop == None else datetime64(stop)
+
+		i = self._search(start - self.longest, stop + self.longest, minAlt, maxAlt, azimuth)
+		i = i[(self.riseTime[i] <= stop) & (self.setTime[i] >= start)]
+		return self.passes[i]
+
+
+	# Passes rising at or after start and setting at or before stop, the same passes as PassTable.inWindow
+	# Args: start = datetime, stop = datetime, minAlt = deg, maxAlt = deg, azimuth = [from, to] deg clockwise from north
+	# Returns: PassTable sorted by maxTime
+	def within(self, start, stop, minAlt=None, maxAlt=None, azimuth=None):
+		start = datetime64(start)
+		stop = datetime64(stop)
+
+		i = self._search(start, stop, minAlt, maxAlt, azimuth)
+		i = i[(self.riseTime[i] >= start) & (self.setTime[i] <= stop)]
+		return self.passes[i]
+
+
+	# The next pass to peak at or after a time, None if there are no more
+	# Args: time = datetime, minAlt = deg, azimuth = [from, to] deg clockwise from north
+	# Returns: dict
+	def nextPass(self, time, minAlt=None, azimuth=None):
+		time = datetime64(time)
+		best = None
+		for c in self._cells(minAlt, None, azimuth):
+			#First pass in the cell peaking at or after the time that really matches
+			j = self.cellStarts[c] + np.searchsorted(self.sortedTime[self.cellStarts[c]:self.cellStarts[c + 1]], time, side="left")
+			while j < self.cellStarts[c + 1]:
+				i = self.order[j]
+				if self._matches(np.array([i]), minAlt, None, azimuth)[0]:
+					if best == None or self.maxTime[i] < self.maxTime[best]:
+						best = i
+					break
+				j += 1
+
+		return None if best == None else self.passes[int(best)]
+
+
+	# Indices of the passes peaking between start and stop
+	# Args: start = datetime, stop = datetime, minAlt = deg, maxAlt = deg, azimuth = [from, to] deg clockwise from north
+	# Returns: array of int sorted by maxTime
+	def peakingIndices(self, start, stop, minAlt=None, maxAlt=None, azimuth=None):
+		return self._search(datetime64(start), datetime64(stop), minAlt, maxAlt, azimuth)
+
+
+	# Passes peaking between two times in the cells that can match, checked exactly
+	# Args: start = datetime64, stop = datetime64, minAlt = deg, maxAlt = deg, azimuth = [from, to] deg
+	# Returns: array of int sorted by maxTime
+	def _search(self, start, stop, minAlt, maxAlt, azimuth):
+		found = []
+		for c in self._cells(minAlt, maxAlt, azimuth):
+			cellStart = self.cellStarts[c]
+			cellTimes = self.sortedTime[cellStart:self.cellStarts[c + 1]]
+			low = np.searchsorted(cellTimes, start, side="left")
+			high = np.searchsorted(cellTimes, stop, side="right")
+			if high > low:
+				found.append(self.order[cellStart + low:cellStart + high])
+
+		if len(found) == 0:
+			return np.zeros(0, dtype=int)
+
+		i = np.concatenate(found)
+		i = i[self._matches(i, minAlt, maxAlt, azimuth)]
+		return i[np.argsort(self.maxTime[i], kind="stable")]
+
+
+	# Cells that hold any passes peaking in an altitude range and azimuth sector
+	# Args: minAlt = deg, maxAlt = deg, azimuth = [from, to] deg clockwise from north
+	# Returns: array of int
+	def _cells(self, minAlt, maxAlt, azimuth):
+		lowBand = 0 if minAlt == None else int(np.clip(minAlt // self.altStep, 0, self.altBands - 1))
+		highBand = self.altBands - 1 if maxAlt == None else int(np.clip(maxAlt // self.altStep, 0, self.altBands - 1))
+		bands = np.arange(lowBand, highBand + 1)
+
+		sectors = np.arange(self.azSectors)
+		if azimuth != None:
+			sectors = sectors[_inSector((sectors + 1) * self.azStep, azimuth) | _inSector(sectors * self.azStep, azimuth) | _sectorInside(sectors, self.azStep, azimuth)]
+
+		return (bands[:, None] * self.azSectors + sectors[None, :]).ravel()
+
+
+	# Which passes really match the altitude and azimuth limits
+	# Args: i = array of int, minAlt = deg, maxAlt = deg, azimuth = [from, to] deg
+	# Returns: array of bool
+	def _matches(self, i, minAlt, maxAlt, azimuth):
+		keep = np.ones(len(i), dtype=bool)
+		if minAlt != None:
+			keep &= self.maxAlt[i] >= minAlt
+		if maxAlt != None:
+			keep &= self.maxAlt[i] <= maxAlt
+		if azimuth != None:
+			keep &= _inSector(self.maxAz[i], azimuth)
+		return keep
+
+
+
+
+# Whether azimuths are in a sector going clockwise from its first azimuth to its second, wrapping through north
+# Args: az = array of deg, azimuth = [from, to] deg
+# Returns: array of bool
+def _inSector(az, azimuth):
+	first = azimuth[0] % 360
+	width = (azimuth[1] - azimuth[0]) % 360
+	if width == 0 and azimuth[1] != azimuth[0]:
+		width = 360
+	return (np.asarray(az) - first) % 360 <= width
+
+
+
+
+# Whether the start of a query sector falls inside each cell sector, for query sectors narrower than a cell
+# Args: sectors = array of int, azStep = deg, azimuth = [from, to] deg
+# Returns: array of bool
+def _sectorInside(sectors, azStep, azimuth):
+	first = azimuth[0] % 360
+	return (first >= sectors * azStep) & (first < (sectors + 1) * azStep)
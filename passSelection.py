@@ -0,0 +1,257 @@
+# passSelection.py
+#
+# Choose which passes to observe when there are more than the telescope can get to
+#
+# Harry Krantz
+# Steward Observatory
+# University of Arizona
+# Copyright May 2020
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import numpy as np
+
+
+#How much each quality of a pass counts towards its weight, every quality is scaled to 0 - 1
+# altitude = altitude at the target / 90, sunlit = fraction of the pass in sunlight,
+# moon = distance from the Moon / 180, new = satellite not in observed, the ids from earlier sessions
+defaultWeights = {
+	"altitude" : 1.0,
+	"sunlit" : 1.0,
+	"moon" : 0.5,
+	"new" : 1.0
+}
+
+
+
+
+# Weight of every pass in a table, higher is better, the altitude is the one at the target
+# Every pass is weighted on its own, the new bonus only looks at the satellites in observed, so the
+# passes of one satellite in the table all get it and the selection can still take it twice
+# Args: passes = PassTable, weights = dict like defaultWeights, observed = iterable of satellite ids already observed
+# Returns: array of float
+def passWeights(passes, weights=None, observed=None):
+	weights = dict(defaultWeights, **(weights or {}))
+
+	new = np.ones(len(passes), dtype=bool)
+	if observed != None:
+		new = ~np.isin(passes["id"], np.array(list(observed), dtype=str))
+
+	return (weights["altitude"] * passes["targetAlt"] / 90
+		+ weights["sunlit"] * np.nan_to_num(passes["sunlitFraction"])
+		+ weights["moon"] * passes["moonElong"] / 180
+		+ weights["new"] * new)
+
+
+
+
+# Which passes of a table sorted by targetTime to observe, each is imaged at its target
+# Args: passes = PassTable, timePer = timedelta, mode = "optimal" or "greedy", weights = dict like defaultWeights,
+#       observed = iterable of satellite ids already observed, mount = MountModel used instead of timePer
+# Returns: array of int
+def choosePasses(passes, timePer, mode="optimal", weights=None, observed=None, mount=None):
+	if mode == "greedy" and mount != None:
+		return selectGreedyMount(passes, mount)
+	if mode == "greedy":
+		return selectGreedy(passes["targetTime"], timePer)
+	if mode == "optimal" and mount != None:
+		return selectOptimalMount(passes, passWeights(passes, weights, observed), mount)
+	if mode == "optimal":
+		return selectOptimal(passes["targetTime"], passWeights(passes, weights, observed), timePer)
+	raise ValueError("Unknown selection mode " + str(mode))
+
+
+
+
+# The baseline selection, start with the first pass and keep every pass far enough after the last one kept
+# Args: maxTime = sorted array of datetime64, timePer = timedelta
+# Returns: array of int
+def selectGreedy(maxTime, timePer):
+	timePer = np.timedelta64(timePer, "us")
+
+	selected = [0] if len(maxTime) > 0 else []
+	for i in range(1, len(maxTime)):
+		#if too soon since last observation skip this one
+		if (maxTime[i] - maxTime[selected[-1]]) < timePer:
+			continue
+		selected.append(i)
+
+	return np.array(selected, dtype=int)
+
+
+
+
+# The set of passes at least timePer apart with the greatest total weight
+# Weighted interval scheduling, each pass is only compatible with passes peaking at least timePer
+# before it, found for every pass at once with a binary search, then one dynamic programming sweep
+# Args: maxTime = sorted array of datetime64, weight = array of float, timePer = timedelta
+# Returns: array of int
+def selectOptimal(maxTime, weight, timePer):
+	n = len(maxTime)
+	timePer = np.timedelta64(timePer, "us")
+
+	#Last pass that can come before each one, -1 if none
+	previous = np.searchsorted(maxTime, maxTime - timePer, side="right") - 1
+	previous = np.minimum(previous, np.arange(n) - 1).tolist()
+	weight = np.asarray(weight, dtype=float).tolist()
+
+	#best[i + 1] is the greatest weight using only the first i + 1 passes
+	best = [0.0] * (n + 1)
+	take = [False] * n
+	for i in range(n):
+		withPass = weight[i] + best[previous[i] + 1]
+		if withPass > best[i]:
+			best[i + 1] = withPass
+			take[i] = True
+		else:
+			best[i + 1] = best[i]
+
+	#Walk back through the choices
+	selected = []
+	i = n - 1
+	while i >= 0:
+		if take[i]:
+			selected.append(i)
+			i = previous[i]
+		else:
+			i -= 1
+
+	return np.array(selected[::-1], dtype=int)
+
+
+
+
+# Every pair of passes close enough in time that the mount might not make it from one to the other
+# Passes further apart than window are always reachable and are left out
+# Args: seconds = sorted array of start times in seconds, window = num seconds
+# Returns: array of first pass, array of second pass, array of where each second pass's pairs start (length n + 1)
+def candidatePairs(seconds, window):
+	n = len(seconds)
+	low = np.searchsorted(seconds, seconds - window, side="left")
+	low = np.minimum(low, np.arange(n))
+	counts = np.arange(n) - low
+
+	offsets = np.zeros(n + 1, dtype=int)
+	np.cumsum(counts, out=offsets[1:])
+
+	second = np.repeat(np.arange(n), counts)
+	first = np.arange(offsets[-1]) - np.repeat(offsets[:-1], counts) + np.repeat(low, counts)
+
+	return first, second, offsets
+
+
+
+
+# Which candidate pairs the mount can make in time, the costs of every pair are worked out at once
+# Args: passes = PassTable, seconds = array of start times in seconds, first = array of int, second = array of int, mount = MountModel
+# Returns: array of bool
+def reachable(passes, seconds, first, second, mount):
+	az = passes["targetAz"]
+	alt = passes["targetAlt"]
+	return seconds[second] - seconds[first] >= mount.transitionTime(az[first], alt[first], az[second], alt[second])
+
+
+
+
+# The set of passes with the greatest total weight that the mount can get to one after another
+# A pass can follow any pass started more than the longest transition before it, so the best of
+# those comes from a running maximum and only the pairs closer than that need their slews worked out
+# Args: passes = PassTable sorted by targetTime, weight = array of float, mount = MountModel
+# Returns: array of int
+def selectOptimalMount(passes, weight, mount):
+	n = len(passes)
+	if n == 0:
+		return np.zeros(0, dtype=int)
+
+	seconds = _startSeconds(passes)
+	first, second, offsets = candidatePairs(seconds, mount.maxTransitionTime())
+	canFollow = reachable(passes, seconds, first, second, mount)
+	#First pass close enough to need checking, everything before it can be followed
+	low = (np.arange(n) - np.diff(offsets)).tolist()
+	offsets = offsets.tolist()
+	weight = np.asarray(weight, dtype=float)
+
+	#best[j] is the greatest weight of a sequence ending with pass j
+	best = np.zeros(n)
+	parent = [-1] * n
+	#Greatest best[] and where it is among the first k passes
+	runningBest = [0.0] * (n + 1)
+	runningArg = [-1] * (n + 1)
+
+	for j in range(n):
+		value = runningBest[low[j]]
+		p = runningArg[low[j]]
+
+		#Passes within reach of the longest slew that the mount can still make it from
+		if offsets[j + 1] > offsets[j]:
+			candidates = np.flatnonzero(canFollow[offsets[j]:offsets[j + 1]])
+			if len(candidates) > 0:
+				candidates += low[j]
+				k = candidates[np.argmax(best[candidates])]
+				if best[k] > value:
+					value = best[k]
+					p = int(k)
+
+		best[j] = weight[j] + value
+		parent[j] = p
+
+		if best[j] > runningBest[j]:
+			runningBest[j + 1] = best[j]
+			runningArg[j + 1] = j
+		else:
+			runningBest[j + 1] = runningBest[j]
+			runningArg[j + 1] = runningArg[j]
+
+	#Walk back from the best last pass
+	selected = []
+	j = runningArg[n]
+	while j >= 0:
+		selected.append(j)
+		j = parent[j]
+
+	return np.array(selected[::-1], dtype=int)
+
+
+
+
+# The baseline selection with the mount model, keep the first pass and every pass the mount can get to from the last one kept
+# Args: passes = PassTable sorted by targetTime, mount = MountModel
+# Returns: array of int
+def selectGreedyMount(passes, mount):
+	seconds = _startSeconds(passes).tolist()
+	az = passes["targetAz"].tolist()
+	alt = passes["targetAlt"].tolist()
+
+	selected = [0] if len(passes) > 0 else []
+	for j in range(1, len(passes)):
+		last = selected[-1]
+		#if the mount can't get there in time skip this one
+		if seconds[j] - seconds[last] < mount.transitionTime(az[last], alt[last], az[j], alt[j]):
+			continue
+		selected.append(j)
+
+	return np.array(selected, dtype=int)
+
+
+
+
+# Seconds from the first target to the target of every pass, the exposures all start the same time before the target
+# Args: passes = PassTable sorted by targetTime
+# Returns: array of float
+def _startSeconds(passes):
+	targetTime = passes["targetTime"]
+	if len(targetTime) == 0:
+		return np.zeros(0)
+	return (targetTime - targetTime[0]) / np.timedelta64(1, "s")
@@ -0,0 +1,184 @@
+# passStream.py
+#
+# Streaming pipeline from TLEs to passes, selections, and plans for long or large runs
+#
+# Harry Krantz
+# Steward Observatory
+# University of Arizona
+# Copyright May 2020
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import datetime as dt
+import itertools
+import numpy as np
+
+from findPass import *
+from passTable import *
+from passTable import _aware
+from passSelection import *
+from tleStore import tlesToStore
+from ephemerisContext import EphemerisContext
+
+
+
+
+# Find passes a time window at a time and yield them in time order as each window is finished
+# The TLEs can be any iterable, they are read lazily in batches during the first window and
+# kept as compact parsed TLEStores for the later windows, so only one batch of satellites and
+# one window of passes is ever being worked on
+# Every pass belongs to the window its peak falls in, the search is padded by more than the
+# longest pass so a pass crossing a window edge is still found complete
+# Args: tles = iterable of tle, loc = skyfield Topos, start = datetime, stop = datetime, params = [sunUp, moonUp, eclipsed, minAlt],
+#       context = EphemerisContext, window = timedelta, batchSize = num, partial = bool, pad = timedelta
+# Returns: generator of PassTable sorted by maxTime
+def streamPasses(tles, loc, start, stop, params=[None, None, None, None], context=None, window=dt.timedelta(hours=1), batchSize=1000, partial=False, pad=dt.timedelta(minutes=30)):
+
+	sunUp, moonUp, eclipsed, minAlt = params
+
+	#Load the ephemeris once and share it with every batch
+	if context == None:
+		context = EphemerisContext()
+
+	start = _aware(start)
+	stop = _aware(stop)
+
+	tles = iter(tles)
+	stores = []
+
+	windowStart = start
+	while windowStart < stop:
+		windowStop = min(windowStart + window, stop)
+
+		#Search a little wider than the window but never outside of the full range
+		searchStart = max(windowStart - pad, start)
+		searchStop = min(windowStop + pad, stop)
+
+		#Batches parsed in earlier windows first, then read more until the TLEs run out
+		batches = itertools.chain(stores, _readBatches(tles, batchSize, stores))
+
+		found = []
+		for store in batches:
+			passes = findPasses(store, loc, searchStart, searchStop, context)
+			passes = filterPasses(passes, sunUp, moonUp, eclipsed, minAlt, partial)
+
+			#Keep the passes peaking in this window, the last window also keeps its end
+			peak = passes["maxTime"]
+			inWindow = peak >= datetime64(windowStart)
+			if windowStop < stop:
+				inWindow &= peak < datetime64(windowStop)
+			else:
+				inWindow &= peak <= datetime64(windowStop)
+			found.append(passes[inWindow])
+
+		yield concatenatePasses(found).sortBy("maxTime")
+
+		windowStart = windowStop
+
+
+
+
+# Read TLEs from an iterator in batches, parse them into TLEStores, and keep them
+# Args: tles = iterator of tle, batchSize = num, stores = array of TLEStore to add to
+# Returns: generator of TLEStore
+def _readBatches(tles, batchSize, stores):
+	while True:
+		batch = list(itertools.islice(tles, batchSize))
+		if len(batch) == 0:
+			return
+
+		store = tlesToStore(batch)
+		stores.append(store)
+		yield store
+
+
+
+
+# Selection of passes with time allowance in between, applied to a stream
+# Works the same as selectStarlinkPasses but the last selected pass carries over between tables,
+# in the optimal mode the best set is found for each table on its own after that pass
+# Args: stream = iterable of PassTable in time order, timePer = timedelta, mode = "optimal" or "greedy",
+#       weights = dict like defaultWeights, observed = iterable of satellite ids already observed, mount = MountModel
+# Returns: generator of PassTable
+def selectPassStream(stream, timePer, mode="optimal", weights=None, observed=None, mount=None):
+	if mount == None:
+		timePer = np.timedelta64(timePer, "us")
+	last = None
+
+	for passes in stream:
+		passes = passes.sortBy("targetTime")
+
+		#Only passes far enough from the last one selected in an earlier table
+		if last != None and mount != None:
+			seconds = (passes["targetTime"] - last["targetTime"]) / np.timedelta64(1, "s")
+			passes = passes[seconds >= mount.transitionTime(last["targetAz"], last["targetAlt"], passes["targetAz"], passes["targetAlt"])]
+		elif last != None:
+			passes = passes[passes["targetTime"] - last["targetTime"] >= timePer]
+
+		selected = choosePasses(passes, timePer, mode, weights, observed, mount)
+
+		passes = passes[selected]
+		if len(passes) > 0:
+			last = {name : passes[name][-1] for name in ["targetTime", "targetAz", "targetAlt"]}
+
+		yield passes
+
+
+
+
+# Append every table of a stream to a csv file as it passes through
+# The header is written with the first table that has passes
+# Args: stream = iterable of PassTable, filename = string
+# Returns: generator of PassTable
+def savePassStream(stream, filename):
+	header = True
+
+	#Start a new file or overwrite an old one
+	open(filename, "w").close()
+
+	for passes in stream:
+		if len(passes) > 0:
+			passes.toDataFrame().to_csv(filename, mode="a", header=header, index=None)
+			header = False
+		yield passes
+
+
+
+
+# Print every table of a stream as it passes through, the header is only printed once
+# Args: stream = iterable of PassTable
+# Returns: generator of PassTable
+def printPassStream(stream):
+	header = True
+
+	for passes in stream:
+		if header:
+			printPassList([])
+			header = False
+		for p in passes:
+			printPass(p)
+		yield passes
+
+
+
+
+# Add every selected pass of a stream to an ACP plan as it arrives
+# Args: stream = iterable of PassTable, plan = AcpPlanWriter, offset = num seconds
+# Returns: generator of PassTable
+def planPassStream(stream, plan, offset):
+	for passes in stream:
+		for p in passes:
+			plan.add([p["name"], p["targetTime"], offset, p["targetRA"], p["targetDec"], p["targetAlt"], p["targetAz"]])
+		yield passes
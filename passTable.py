@@ -0,0 +1,386 @@
+# passTable.py
+#
+# Column oriented table of satellite passes
+#
+# Harry Krantz
+# Steward Observatory
+# University of Arizona
+# Copyright May 2020
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import datetime as dt
+import os
+import numpy as np
+import pandas as pd
+
+from skyfield.api import utc
+
+from constellationPropagator import sgp4Times
+
+
+#Columns of a pass table in order, times are UTC without a timezone
+passColumns = [
+	("name", "U"),
+	("id", "U"),
+	("riseTime", "datetime64[us]"),
+	("riseAz", "f8"),
+	("maxTime", "datetime64[us]"),
+	("maxAlt", "f8"),
+	("maxAz", "f8"),
+	("maxRA", "f8"),
+	("maxDec", "f8"),
+	("maxVel", "f8"),
+	("range", "f8"),
+	("height", "f8"),
+	("sunElong", "f8"),
+	("moonElong", "f8"),
+	("setTime", "datetime64[us]"),
+	("setAz", "f8"),
+	("duration", "timedelta64[us]"),
+	("eclipsed", "?"),
+	("sunlitStart", "datetime64[us]"),
+	("sunlitEnd", "datetime64[us]"),
+	("sunlitFraction", "f8"),
+	("targetTime", "datetime64[us]"),
+	("targetAlt", "f8"),
+	("targetAz", "f8"),
+	("targetRA", "f8"),
+	("targetDec", "f8"),
+	("sunUp", "?"),
+	("moonUp", "?"),
+	("risePartial", "?"),
+	("setPartial", "?"),
+	("site", "U")
+]
+
+#Days from the Julian date epoch to 1970-01-01
+UNIX_EPOCH_JD = 2440587.5
+
+
+
+
+# Passes stored as one numpy array per column instead of one dict per pass
+# Indexing with a column name gives the column, with an int gives the pass as a dict like
+# the ones findPass used to return, and with anything else (slices, masks, index arrays)
+# gives another PassTable
+# Args: columns = dict of name : array
+class PassTable:
+
+	def __init__(self, columns):
+		self.columns = columns
+
+
+	def __len__(self):
+		for column in self.columns.values():
+			return len(column)
+		return 0
+
+
+	def __getitem__(self, key):
+		if isinstance(key, str):
+			return self.columns[key]
+		if isinstance(key, (int, np.integer)):
+			return self.row(key)
+		return PassTable({name : column[key] for name, column in self.columns.items()})
+
+
+	def __iter__(self):
+		for i in range(len(self)):
+			yield self.row(i)
+
+
+	# Args: none
+	# Returns: array of string
+	def keys(self):
+		return list(self.columns.keys())
+
+
+	# A single pass as a dict, times are converted to utc datetimes
+	# Args: i = int
+	# Returns: dict
+	def row(self, i):
+		return {name : _pythonValue(column[i]) for name, column in self.columns.items()}
+
+
+	# Keep the passes that meet certain conditions, None is a wildcard
+	# With instruments given, the passes dropped by each condition (in this order) are counted
+	# The altitude and the Sun's altitude are checked at the target, the time the pass would be imaged
+	# maxSunAlt needs the NightContext of the site to look up the Sun's altitude at each target
+	# Args: sun = bool, moon = bool, eclipsed = bool, alt = num, partial = bool, instruments = Instrumentation,
+	#       maxSunAlt = num deg, night = NightContext
+	# Returns: PassTable
+	def filter(self, sun=None, moon=None, eclipsed=None, alt=None, partial=None, instruments=None, maxSunAlt=None, night=None):
+		keep = np.ones(len(self), dtype=bool)
+
+		conditions = []
+		if sun != None:
+			conditions.append(("Sun", self.columns["sunUp"] == sun))
+		if moon != None:
+			conditions.append(("Moon", self.columns["moonUp"] == moon))
+		if eclipsed != None:
+			conditions.append(("Eclipsed", self.columns["eclipsed"] == eclipsed))
+		if alt != None:
+			conditions.append(("Altitude", self.columns["targetAlt"] >= alt))
+		if partial != None:
+			conditions.append(("Partial", (self.columns["risePartial"] | self.columns["setPartial"]) == partial))
+		if maxSunAlt != None:
+			if night == None:
+				raise ValueError("Filtering by the Sun's altitude needs a NightContext")
+			conditions.append(("Twilight", night.sunAltitude(self.columns["targetTime"]) <= maxSunAlt))
+
+		for name, condition in conditions:
+			if instruments != None:
+				instruments.count("passesFiltered" + name, np.count_nonzero(keep & ~condition))
+			keep &= condition
+
+		return self[keep]
+
+
+	# Passes sorted by a column, passes with equal values keep their order
+	# Args: column = string
+	# Returns: PassTable
+	def sortBy(self, column="maxTime"):
+		return self[np.argsort(self.columns[column], kind="stable")]
+
+
+	# Passes rising at or after start and setting at or before stop
+	# Args: start = datetime, stop = datetime
+	# Returns: array of bool
+	def inWindow(self, start, stop):
+		return (self.columns["riseTime"] >= datetime64(start)) & (self.columns["setTime"] <= datetime64(stop))
+
+
+	# Pandas DataFrame sharing the column arrays, times are marked as utc
+	# Args: none
+	# Returns: DataFrame
+	def toDataFrame(self):
+		data = {}
+		for name, column in self.columns.items():
+			if column.dtype.kind == "M":
+				data[name] = pd.DatetimeIndex(column).tz_localize("UTC")
+			else:
+				data[name] = column
+		return pd.DataFrame(data, copy=False)
+
+
+	# Save the passes to a csv file with headers, or add them to the end of one
+	# Args: filename = string, append = bool
+	# Returns: nothing
+	def toCSV(self, filename, append=False):
+		if append and os.path.isfile(filename) and os.path.getsize(filename) > 0:
+			self.toDataFrame().to_csv(filename, mode="a", header=False, index=None)
+		else:
+			self.toDataFrame().to_csv(filename, index=None)
+
+
+	# Arrow table of the columns, times are utc timestamps and durations stay durations
+	# Needs pyarrow
+	# Args: none
+	# Returns: pyarrow Table
+	def toArrow(self):
+		pa, pq = _pyarrow()
+		arrays = {}
+		for name, column in self.columns.items():
+			if column.dtype.kind == "M":
+				arrays[name] = pa.array(column, from_pandas=True).cast(pa.timestamp("us", tz="UTC"))
+			else:
+				arrays[name] = pa.array(column, from_pandas=True)
+		return pa.table(arrays)
+
+
+	# Save the passes to a Parquet file, or with append add them as a new part file of a
+	# directory so an archive of many nights is never rewritten, loadParquet reads either back
+	# Needs pyarrow
+	# Args: filename = path of the file, or of the directory with append
+	# Returns: path written
+	def toParquet(self, filename, append=False):
+		pa, pq = _pyarrow()
+		if append:
+			if not os.path.isdir(filename):
+				os.makedirs(filename)
+			parts = [f for f in os.listdir(filename) if f.startswith("part") and f.endswith(".parquet")]
+			filename = os.path.join(filename, "part%05d.parquet" % len(parts))
+
+		pq.write_table(self.toArrow(), filename)
+		return filename
+
+
+	# Save the columns to a .npz file that loadPassTable reads back exactly
+	# Args: filename = string ending in .npz or a file opened for binary writing
+	# Returns: nothing
+	def save(self, filename):
+		np.savez(filename, **self.columns)
+
+
+
+
+# A pass table with no passes
+# Args: site = bool
+# Returns: PassTable
+def emptyPassTable(site=False):
+	return PassTable({name : np.zeros(0, dtype=dtype) for name, dtype in passColumns if site or name != "site"})
+
+
+
+
+# Load a pass table saved with PassTable.save
+# Args: filename = string
+# Returns: PassTable
+def loadPassTable(filename):
+	with np.load(filename, allow_pickle=False) as data:
+		return PassTable({name : data[name] for name in data.files})
+
+
+
+
+# Save passes as a csv or Parquet file, the extension is added to the filename
+# Args: passes = PassTable, filename = string without extension, outputFormat = "csv" or "parquet"
+# Returns: path written
+def savePasses(passes, filename, outputFormat="csv"):
+	if outputFormat == "csv":
+		passes.toCSV(filename + ".csv")
+		return filename + ".csv"
+	if outputFormat == "parquet":
+		return passes.toParquet(filename + ".parquet")
+	raise ValueError("Unknown output format " + str(outputFormat))
+
+
+
+
+# Load passes saved with PassTable.toParquet, a directory of part files is loaded as one table in order
+# Needs pyarrow
+# Args: filename = path of a file or directory
+# Returns: PassTable
+def loadParquet(filename):
+	pa, pq = _pyarrow()
+	if os.path.isdir(filename):
+		parts = sorted(f for f in os.listdir(filename) if f.startswith("part") and f.endswith(".parquet"))
+		return concatenatePasses([loadParquet(os.path.join(filename, f)) for f in parts])
+
+	table = pq.read_table(filename)
+	dtypes = dict(passColumns)
+	columns = {}
+	for name in table.column_names:
+		column = table.column(name)
+		if pa.types.is_timestamp(column.type):
+			column = column.cast(pa.timestamp("us"))
+		values = column.to_numpy(zero_copy_only=False)
+		if name in dtypes and dtypes[name] == "U":
+			values = values.astype(str)
+		columns[name] = values
+	return PassTable(columns)
+
+
+
+
+# Join pass tables end to end, they all need the same columns
+# Args: tables = array of PassTable
+# Returns: PassTable
+def concatenatePasses(tables):
+	tables = [t for t in tables if len(t) > 0]
+
+	if len(tables) == 0:
+		return emptyPassTable()
+	if len(tables) == 1:
+		return tables[0]
+
+	return PassTable({name : np.concatenate([t.columns[name] for t in tables]) for name in tables[0].keys()})
+
+
+
+
+# Convert a list of pass dicts to a PassTable, a PassTable is returned as is
+# Args: passes = PassTable or array of dict
+# Returns: PassTable
+def toPassTable(passes):
+	if isinstance(passes, PassTable):
+		return passes
+	if len(passes) == 0:
+		return emptyPassTable()
+
+	dtypes = dict(passColumns)
+	columns = {}
+	for name in passes[0].keys():
+		values = [p[name] for p in passes]
+		dtype = dtypes.get(name)
+		if dtype == "datetime64[us]":
+			columns[name] = np.array([datetime64(v) for v in values], dtype=dtype)
+		else:
+			columns[name] = np.array(values, dtype=dtype)
+	return PassTable(columns)
+
+
+
+
+# Convert Skyfield times to numpy datetimes in UTC, leap seconds are not representable
+# Args: times = Skyfield Time
+# Returns: array of datetime64[us]
+def timesToDatetime64(times):
+	jd, fr = sgp4Times(times)
+	microseconds = np.round((jd - UNIX_EPOCH_JD) * 86400e6 + fr * 86400e6)
+	return microseconds.astype(np.int64).astype("datetime64[us]")
+
+
+
+
+# Convert a datetime to a numpy datetime in UTC, dates without a timezone are assumed to be utc
+# Args: date = datetime or None
+# Returns: datetime64[us]
+def datetime64(date):
+	if date == None:
+		return np.datetime64("NaT", "us")
+	if isinstance(date, dt.datetime) and date.tzinfo != None:
+		date = date.astimezone(utc).replace(tzinfo=None)
+	return np.datetime64(date, "us")
+
+
+
+
+# Datetimes without a timezone are assumed to be utc, others are converted to utc
+# Args: date = datetime
+# Returns: datetime
+def _aware(date):
+	if date.tzinfo == None:
+		return date.replace(tzinfo=utc)
+	return date.astimezone(utc)
+
+
+
+
+# Convert a numpy value from a column to the matching python value
+# Args: value = numpy scalar
+# Returns: python value
+def _pythonValue(value):
+	if isinstance(value, np.datetime64):
+		value = value.item()
+		return None if value == None else value.replace(tzinfo=utc)
+	if isinstance(value, np.generic):
+		return value.item()
+	return value
+
+
+
+
+# pyarrow is only needed for the Parquet and Arrow output
+# Args: none
+# Returns: pyarrow module, pyarrow.parquet module
+def _pyarrow():
+	try:
+		import pyarrow
+		import pyarrow.parquet
+	except ImportError:
+		raise ImportError("Parquet and Arrow output need pyarrow, install it with pip install pyarrow")
+	return pyarrow, pyarrow.parquet
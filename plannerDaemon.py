@@ -0,0 +1,563 @@
+# plannerDaemon.py
+#
+# Resident planner that keeps everything loaded and answers requests over a local HTTP API
+#
+# Harry Krantz
+# Steward Observatory
+# University of Arizona
+# Copyright May 2020
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import argparse
+import datetime as dt
+import hashlib
+import json
+import os
+import socketserver
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from skyfield.api import utc
+
+from starlinkPassPredictor import *
+from constellationPropagator import ConstellationPropagator
+from nightContext import NightContext, CIVIL, DAY
+from passSelection import choosePasses
+from passIndex import PassIndex
+from mountModel import MountModel
+from writeAcpPlan import writeAcpPlan
+from tleCache import TLECache
+from instrumentation import Instrumentation
+from locations import locations
+from passTable import _aware
+
+
+
+
+# Everything the planner keeps warm between requests: the ephemeris and compiled satellites,
+# the TLEs and a propagator built from them, the NightContext of each site and night, and the
+# pass tables already computed with a PassIndex over each. Each night of a site is searched once
+# from sunset to sunrise and requests inside it are answered from that index, a new plan only
+# redoes the selection and the writing.
+# The TLEs are reloaded through the TLECache every refresh interval and the pass tables are
+# dropped only if the element sets changed. All of the state is behind one lock that is only held
+# to look things up and store them, a table is searched outside of it so other requests carry on.
+# Args: context = EphemerisContext, cache = TLECache, sites = dict of name : skyfield Topos, refresh = timedelta,
+#       mount = MountModel, planDir = path, plan = dict of writeAcpPlan options, maxTables = num, tleList = array of tle,
+#       maxNights = num
+class PlannerService:
+
+	def __init__(self, context=None, cache=None, sites=None, refresh=dt.timedelta(hours=2), mount=None, planDir="plans", plan=None, maxTables=32, tleList=None, maxNights=16):
+		self.context = EphemerisContext(instruments=Instrumentation()) if context == None else context
+		self.cache = TLECache("tleCache", instruments=self.context.instruments) if cache == None else cache
+		self.sites = locations if sites == None else sites
+		self.refresh = refresh
+		self.mount = MountModel() if mount == None else mount
+		self.planDir = planDir
+		self.plan = dict({"Exposure" : self.mount.exposure, "Repeat" : self.mount.repeat, "Filters" : "v", "Binning" : 1, "imagePath" : "Starlink"}, **(plan or {}))
+		self.maxTables = maxTables
+		self.maxNights = maxNights
+
+		self.lock = threading.RLock()
+		self.started = dt.datetime.now(utc)
+		self.tleList = None
+		self.tleHash = None
+		self.tleLoaded = None
+		self.propagator = None
+		self.generation = 0
+		self.nights = OrderedDict()
+		self.tables = OrderedDict()
+		self.pending = {}
+		self._stop = threading.Event()
+
+		if planDir != None and not os.path.isdir(planDir):
+			os.makedirs(planDir)
+
+		#Given TLEs are kept for good, otherwise they come from the cache
+		self.fixedTLEs = tleList != None
+		self.setTLEs(tleList if tleList != None else loadStarlinkTLEs(self.cache, self.context.instruments))
+
+
+	# Use a new list of TLEs, the propagator and pass tables are only rebuilt if they changed
+	# Args: tleList = array of tle
+	# Returns: bool whether they changed
+	def setTLEs(self, tleList):
+		tleHash = hashlib.sha1()
+		for tle in tleList:
+			tleHash.update((tle[1] + tle[2]).encode())
+		tleHash = tleHash.hexdigest()
+
+		with self.lock:
+			self.tleLoaded = dt.datetime.now(utc)
+			if tleHash == self.tleHash:
+				return False
+
+		with self.context.instruments.stage("buildPropagator"):
+			propagator = ConstellationPropagator(tleList, self.context)
+
+		#A new generation so tables still being searched with the old TLEs are not kept
+		with self.lock:
+			self.tleList = tleList
+			self.tleHash = tleHash
+			self.propagator = propagator
+			self.generation += 1
+			self.tables.clear()
+			self.context.instruments.count("tleRefreshes")
+			return True
+
+
+	# Reload the TLEs through the cache, only downloading if the cached copy is too old
+	# Args: none
+	# Returns: bool whether they changed
+	def refreshTLEs(self):
+		if self.fixedTLEs:
+			return False
+		return self.setTLEs(loadStarlinkTLEs(self.cache, self.context.instruments))
+
+
+	# Refresh the TLEs every refresh interval in a background thread until stop() is called
+	# Args: none
+	# Returns: thread
+	def startRefreshing(self):
+		def loop():
+			while not self._stop.wait(self.refresh.total_seconds()):
+				try:
+					self.refreshTLEs()
+				except Exception as e:
+					self.context.instruments.count("tleRefreshFailures")
+					self.context.instruments.log("TLE refresh failed: " + str(e))
+
+		thread = threading.Thread(target=loop, daemon=True)
+		thread.start()
+		return thread
+
+
+	# Args: none
+	# Returns: nothing
+	def stop(self):
+		self._stop.set()
+
+
+	# The NightContext of a site for the night starting on a date, local noon to local noon
+	# Args: site = string, date = date
+	# Returns: NightContext
+	def night(self, site, date):
+		key = (site, date)
+		with self.lock:
+			if key in self.nights:
+				self.nights.move_to_end(key)
+				return self.nights[key]
+
+		noon = self.noon(site, date)
+		night = NightContext(self.context, self.site(site), noon, noon + dt.timedelta(days=1))
+
+		with self.lock:
+			night = self.nights.setdefault(key, night)
+			self.nights.move_to_end(key)
+			while len(self.nights) > self.maxNights:
+				self.nights.popitem(last=False)
+			return night
+
+
+	# Local mean noon at a site on a date, where its nights start
+	# Args: site = string, date = date
+	# Returns: datetime
+	def noon(self, site, date):
+		return dt.datetime(date.year, date.month, date.day, 12, tzinfo=utc) - dt.timedelta(hours=self.site(site).longitude.degrees / 15)
+
+
+	# The date of the night a time falls in at a site
+	# Args: site = string, time = datetime
+	# Returns: date
+	def nightOf(self, site, time):
+		return (_aware(time) + dt.timedelta(hours=self.site(site).longitude.degrees / 15 - 12)).date()
+
+
+	# Sunset to sunrise of a night, the whole night if the Sun doesn't set or rise
+	# Args: site = string, date = date the night starts on
+	# Returns: datetime, datetime
+	def darkness(self, site, date):
+		night = self.night(site, date)
+		start = night.eveningTwilight(CIVIL)
+		stop = night.morningTwilight(DAY)
+		if start == None or stop == None:
+			start = self.noon(site, date)
+			stop = start + dt.timedelta(days=1)
+		return start, stop
+
+
+	# The index over every pass of a night from sunset to sunrise
+	# Args: site = string, date = date the night starts on
+	# Returns: PassIndex
+	def nightIndex(self, site, date):
+		start, stop = self.darkness(site, date)
+		return self.index(site, start, stop, self.night(site, date))
+
+
+	# Every complete pass of a site in a window, from the night's index if the window is inside it
+	# Args: site = string, start = datetime, stop = datetime
+	# Returns: PassTable sorted by maxTime
+	def passes(self, site, start, stop):
+		start = _aware(start)
+		stop = _aware(stop)
+		date = self.nightOf(site, start)
+		darkStart, darkStop = self.darkness(site, date)
+		if darkStart <= start and stop <= darkStop:
+			return self.nightIndex(site, date).within(start, stop)
+
+		night = self.night(site, date)
+		if not night.covers(start) or not night.covers(stop):
+			night = None
+		return self.index(site, start, stop, night).within(start, stop)
+
+
+	# Passes of a site above the horizon at a time or during a window, from the night's index
+	# Args: site = string, start = datetime, stop = datetime, minAlt = deg, azimuth = [from, to] deg
+	# Returns: PassTable sorted by maxTime
+	def up(self, site, start, stop=None, minAlt=None, azimuth=None):
+		start = _aware(start)
+		stop = start if stop == None else _aware(stop)
+		date = self.nightOf(site, start)
+		darkStart, darkStop = self.darkness(site, date)
+		if start < darkStart or stop > darkStop:
+			raise ValueError("Only times between sunset at %s and sunrise at %s can be asked about" % (darkStart.isoformat(), darkStop.isoformat()))
+		return self.nightIndex(site, date).up(start, stop, minAlt, None, azimuth)
+
+
+	# The index over the passes of a site for a window, one already computed is used if it covers the window
+	# The search runs outside of the lock, a request for a window already being searched waits for that
+	# search instead of starting another, and the table is only kept if the TLEs didn't change meanwhile
+	# Args: site = string, start = datetime, stop = datetime, night = NightContext
+	# Returns: PassIndex
+	def index(self, site, start, stop, night=None):
+		start = _aware(start)
+		stop = _aware(stop)
+		loc = self.site(site)
+
+		with self.lock:
+			for key in list(self.tables.keys()):
+				if key[0] == site and key[1] <= start and key[2] >= stop:
+					self.tables.move_to_end(key)
+					self.context.instruments.count("tableHits")
+					return self.tables[key]
+
+			generation = self.generation
+			key = (site, start, stop, generation)
+			future = self.pending.get(key)
+			searching = future == None
+			if searching:
+				self.context.instruments.count("tableMisses")
+				future = Future()
+				self.pending[key] = future
+				tleList = self.tleList
+				propagator = self.propagator
+			else:
+				self.context.instruments.count("tableWaits")
+
+		if not searching:
+			return future.result()
+
+		try:
+			with self.context.instruments.stage("findPasses"):
+				table = findPasses(tleList, loc, start, stop, self.context, propagator, night=night)
+			index = PassIndex(table.sortBy("maxTime"))
+		except Exception as e:
+			with self.lock:
+				self.pending.pop(key, None)
+			future.set_exception(e)
+			raise
+
+		with self.lock:
+			self.pending.pop(key, None)
+			if generation == self.generation:
+				self.tables[(site, start, stop)] = index
+				while len(self.tables) > self.maxTables:
+					self.tables.popitem(last=False)
+
+		future.set_result(index)
+		return index
+
+
+	# The evening or morning observing window of a site, from astronomical twilight for a length of time
+	# Args: site = string, date = date the night starts on, session = "evening" or "morning", length = timedelta
+	# Returns: datetime, datetime
+	def session(self, site, date, session="evening", length=dt.timedelta(hours=2)):
+		night = self.night(site, date)
+		if session == "evening":
+			twilight = night.eveningTwilight()
+			if twilight == None:
+				raise ValueError("No astronomical twilight in the evening at " + site)
+			return twilight, twilight + length
+		if session == "morning":
+			twilight = night.morningTwilight()
+			if twilight == None:
+				raise ValueError("No astronomical twilight in the morning at " + site)
+			return twilight - length, twilight
+		raise ValueError("Unknown session " + str(session))
+
+
+	# Select passes of a session and write them as an ACP plan
+	# Args: site = string, date = date, session = "evening" or "morning", params = [sunUp, moonUp, eclipsed, minAlt],
+	#       mode = "optimal" or "greedy", length = timedelta
+	# Returns: string plan, PassTable selected passes
+	def makePlan(self, site, date, session="evening", params=[False, None, False, 20], mode="optimal", length=dt.timedelta(hours=2)):
+		with self.context.instruments.stage("makePlan"):
+			start, stop = self.session(site, date, session, length)
+			passes = self.passes(site, start, stop)
+			passes = filterPasses(passes, *params, partial=False).sortBy("targetTime")
+			passes = passes[choosePasses(passes, None, mode, mount=self.mount)]
+
+			filename = os.path.join(self.planDir, "%s_%s_%s.txt" % (site, session, date.isoformat()))
+			if len(passes) == 0:
+				return "", passes
+
+			offset = self.mount.offset()
+			obs = [[p["name"], p["targetTime"], offset, p["targetRA"], p["targetDec"], p["targetAlt"], p["targetAz"]] for p in passes]
+			return writeAcpPlan(obs, filename=filename, shutdown=(session == "morning"), **self.plan), passes
+
+
+	# What the planner has loaded
+	# Args: none
+	# Returns: dict
+	def status(self):
+		with self.lock:
+			return {
+				"started" : self.started.isoformat(),
+				"uptime" : (dt.datetime.now(utc) - self.started).total_seconds(),
+				"tles" : len(self.tleList),
+				"tlesLoaded" : self.tleLoaded.isoformat(),
+				"tleHash" : self.tleHash,
+				"sites" : list(self.sites.keys()),
+				"nights" : ["%s %s" % key for key in self.nights.keys()],
+				"tables" : [{"site" : k[0], "start" : k[1].isoformat(), "stop" : k[2].isoformat(), "passes" : len(t)} for k, t in self.tables.items()],
+				"instruments" : self.context.instruments.report()
+			}
+
+
+	# Args: name = string
+	# Returns: skyfield Topos
+	def site(self, name):
+		if name not in self.sites:
+			raise KeyError("Unknown site " + str(name))
+		return self.sites[name]
+
+
+
+
+# Answers the planner's API, the same handler works over TCP and a Unix socket
+#   GET  /status                                                   what is loaded, json
+#   GET  /metrics                                                  stage timings and counters, Prometheus text
+#   GET  /passes?site=&start=&stop=[&sunUp=&moonUp=&eclipsed=&minAlt=&format=csv]   passes, json or csv
+#   GET  /up?site=[&start=&minutes=&minAlt=&azimuth=from,to&format=csv]          passes up now or in the next minutes
+#   GET  /plan?site=[&date=&session=evening|morning&mode=&minAlt=&hours=]           ACP plan text
+#   POST /refresh                                                  reload the TLEs now
+# Times are ISO 8601 in UTC, booleans are true, false, or any
+class PlannerHandler(BaseHTTPRequestHandler):
+
+	service = None
+
+	def do_GET(self):
+		url = urlparse(self.path)
+		query = {k : v[-1] for k, v in parse_qs(url.query).items()}
+
+		try:
+			if url.path == "/status":
+				self.reply(200, json.dumps(self.service.status(), indent=1), "application/json")
+
+			elif url.path == "/metrics":
+				self.reply(200, self.service.context.instruments.toPrometheus(), "text/plain; version=0.0.4")
+
+			elif url.path == "/passes":
+				site = query["site"]
+				start = _parseTime(query["start"])
+				stop = _parseTime(query["stop"])
+				passes = self.service.passes(site, start, stop)
+				passes = filterPasses(passes, *_params(query, [None, None, None, None])).sortBy("maxTime")
+
+				self.replyPasses(passes, query.get("format"))
+
+			elif url.path == "/up":
+				site = query["site"]
+				start = _parseTime(query["start"]) if "start" in query else dt.datetime.now(utc)
+				stop = start + dt.timedelta(minutes=float(query.get("minutes", 0)))
+				minAlt = float(query["minAlt"]) if "minAlt" in query else None
+				azimuth = [float(az) for az in query["azimuth"].split(",")] if "azimuth" in query else None
+
+				passes = self.service.up(site, start, stop, minAlt, azimuth)
+				self.replyPasses(passes, query.get("format"))
+
+			elif url.path == "/plan":
+				site = query["site"]
+				date = dt.date.fromisoformat(query["date"]) if "date" in query else dt.datetime.now(utc).date()
+				length = dt.timedelta(hours=float(query.get("hours", 2)))
+				text, passes = self.service.makePlan(site, date, query.get("session", "evening"), _params(query, [False, None, False, 20]), query.get("mode", "optimal"), length)
+				self.reply(200, text, "text/plain")
+
+			else:
+				self.reply(404, "Not found\n", "text/plain")
+
+		except KeyError as e:
+			#Unknown sites come from the service, anything else is a missing parameter
+			message = str(e.args[0])
+			if message.startswith("Unknown site"):
+				self.reply(404, message + "\n", "text/plain")
+			else:
+				self.reply(400, "Missing parameter " + message + "\n", "text/plain")
+		except ValueError as e:
+			self.reply(400, str(e) + "\n", "text/plain")
+		except Exception as e:
+			self.reply(500, "Internal error: " + str(e) + "\n", "text/plain")
+
+
+	def do_POST(self):
+		if urlparse(self.path).path != "/refresh":
+			self.reply(404, "Not found\n", "text/plain")
+			return
+
+		try:
+			changed = self.service.refreshTLEs()
+			self.reply(200, json.dumps({"changed" : changed, "tles" : len(self.service.tleList)}), "application/json")
+		except Exception as e:
+			#Usually the TLE download failing, the TLEs already loaded are kept
+			self.reply(502, "TLE refresh failed: " + str(e) + "\n", "text/plain")
+
+
+	# Args: passes = PassTable, format = "csv" or "json"
+	# Returns: nothing
+	def replyPasses(self, passes, format="json"):
+		if format == "csv":
+			self.reply(200, passes.toDataFrame().to_csv(index=None), "text/csv")
+		else:
+			self.reply(200, passes.toDataFrame().to_json(orient="records", date_format="iso"), "application/json")
+
+
+	# Args: code = int, text = string, contentType = string
+	# Returns: nothing
+	def reply(self, code, text, contentType):
+		body = text.encode()
+		self.send_response(code)
+		self.send_header("Content-Type", contentType)
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+
+	#Unix socket clients have no address
+	def address_string(self):
+		return self.client_address[0] if isinstance(self.client_address, tuple) and len(self.client_address) > 0 else "unix"
+
+
+
+
+# HTTP over a Unix socket, one thread per request
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+	daemon_threads = True
+
+
+
+
+# Start the HTTP server and optionally a Unix socket server for a planner, each in its own thread
+# Args: service = PlannerService, host = string, port = num, socketPath = path or None
+# Returns: array of servers
+def serve(service, host="127.0.0.1", port=8765, socketPath=None):
+	handler = type("Handler", (PlannerHandler,), {"service" : service})
+	servers = [ThreadingHTTPServer((host, port), handler)]
+
+	if socketPath != None:
+		if os.path.exists(socketPath):
+			os.remove(socketPath)
+		servers.append(UnixHTTPServer(socketPath, handler))
+
+	for server in servers:
+		threading.Thread(target=server.serve_forever, daemon=True).start()
+
+	return servers
+
+
+
+
+# Parse the filter options of a request, missing ones keep their defaults
+# Args: query = dict, defaults = [sunUp, moonUp, eclipsed, minAlt]
+# Returns: [sunUp, moonUp, eclipsed, minAlt]
+def _params(query, defaults):
+	params = list(defaults)
+	for i, name in enumerate(["sunUp", "moonUp", "eclipsed"]):
+		if name in query:
+			params[i] = _parseBool(query[name])
+	if "minAlt" in query:
+		params[3] = float(query["minAlt"])
+	return params
+
+
+
+
+# Args: text = string true, false, or any
+# Returns: bool or None
+def _parseBool(text):
+	text = text.lower()
+	if text in ["true", "1", "yes"]:
+		return True
+	if text in ["false", "0", "no"]:
+		return False
+	if text in ["any", "none", ""]:
+		return None
+	raise ValueError("Not a boolean: " + text)
+
+
+
+
+# Args: text = ISO 8601 string, UTC if no timezone is given
+# Returns: datetime
+def _parseTime(text):
+	return _aware(dt.datetime.fromisoformat(text))
+
+
+
+
+if __name__ == "__main__":
+
+	parser = argparse.ArgumentParser(description="Resident Starlink pass planner with a local HTTP API")
+	parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+	parser.add_argument("--port", type=int, default=8765, help="port to listen on")
+	parser.add_argument("--socket", default=None, help="also listen on this Unix socket")
+	parser.add_argument("--ephemeris", default="de421.bsp", help="planetary ephemeris file")
+	parser.add_argument("--refresh", type=float, default=2, help="hours between TLE refreshes")
+	parser.add_argument("--plans", default="plans", help="directory for the ACP plans")
+	parser.add_argument("--tles", default=None, help="use this TLE file instead of downloading")
+	parser.add_argument("--quiet", action="store_true", help="don't print the TLE downloads and refresh failures")
+	args = parser.parse_args()
+
+	instruments = Instrumentation(verbose=not args.quiet)
+	context = EphemerisContext(args.ephemeris, instruments=instruments)
+	refresh = dt.timedelta(hours=args.refresh)
+
+	service = PlannerService(context, TLECache("tleCache", maxAge=refresh, instruments=instruments), refresh=refresh, planDir=args.plans,
+		tleList=loadFile(args.tles) if args.tles != None else None)
+	service.startRefreshing()
+	servers = serve(service, args.host, args.port, args.socket)
+
+	print("Planner listening on http://%s:%d" % (args.host, args.port) + ("" if args.socket == None else " and " + args.socket))
+	try:
+		while True:
+			time.sleep(3600)
+	except KeyboardInterrupt:
+		service.stop()
+		for server in servers:
+			server.shutdown()
@@ -25,74 +25,95 @@ import datetime as dt
 import numpy as np
 
 import skyfield.api
+import skyfield.functions
+
+from skyfield.framelib import itrs
+
+from ephemerisContext import EphemerisContext
+from earthShadow import sunLimbAngle
+from constellationPropagator import Observer, raDecRates
 
 
 # Compute the ephemeris and other parameters for a given TLE, location, and singular time
-# Args: tle = string, loc = skyfield topos, time = Skyfield Time or datetime
+# With a NightContext of the location covering the time the Sun and Moon come from its tables
+# Args: tle = string, loc = skyfield topos, time = Skyfield Time or datetime, context = EphemerisContext, night = NightContext
 # Returns: dict
-def computeEphemeris(tle, loc, time):
+def computeEphemeris(tle, loc, time, context=None, night=None):
 
 	#Split the tle
 	name, line1, line2 = tle
 	noradID = parseTLEID(tle)
 
 
-	#Initialization of things
-	sat = skyfield.sgp4lib.EarthSatellite(line1, line2, name)
-	ts = skyfield.api.load.timescale()
-	
-	planets = skyfield.api.load('de421.bsp')
-	earth = planets['earth']
-	moon = planets['moon']
-	sun = planets['sun']
+	#Initialization of things, reusing the shared context if given
+	if context == None:
+		context = EphemerisContext()
 
+	sat = context.getSatellite(tle)
+	ts = context.ts
 
-	#Convert time if needed
-	if type(time) == dt.datetime:
-		time = ts.utc(time)
+	earth = context.earth
+	moon = context.moon
+	sun = context.sun
 
 
-	#Compute satellite position
-	geocentric = sat.at(time)
-	subpoint = geocentric.subpoint()
-	lat = subpoint.latitude
-	lon = subpoint.longitude
-	ele = subpoint.elevation
+	context.instruments.count("ephemerisCalls")
 
-	difference = sat - loc
-	topocentric = difference.at(time)
-	alt, az, distance = topocentric.altaz()
-	ra, dec, temp = topocentric.radec()
+	with context.instruments.stage("computeEphemeris"):
 
+		#Convert time if needed
+		if type(time) == dt.datetime:
+			time = ts.utc(time)
 
-	#Angular velocity per second
-	#Step time forward one second and get the difference in pointing	
-	velocity = topocentric.separation_from( difference.at(ts.tt_jd(time.tt + 1/86400)) )
+
+		#Compute satellite position
+		geocentric = sat.at(time)
+		subpoint = geocentric.subpoint()
+		lat = subpoint.latitude
+		lon = subpoint.longitude
+		ele = subpoint.elevation
+
+		difference = sat - loc
+		topocentric = difference.at(time)
+		alt, az, distance = topocentric.altaz()
+		ra, dec, temp = topocentric.radec()
+
+
+		#Angular velocity per second from the velocity SGP4 already gave
+		rates = angularRates(topocentric, loc)
 
 	
-	#Skyfield does not have a built-in eclipsed function like PyEphem does :(
-	#This is a crude way of doing it but should be fine for this purpose
-	geocentricElong = geocentric.separation_from( earth.at(time).observe(sun) )
-	geocentricDist = geocentric.distance()
-	sunVectorSep = np.cos(geocentricElong.radians - np.pi/2) * geocentricDist.km
-	earthRadius = 6378 #km
-	umbraWidth = earthRadius - max(0, np.tan(np.radians(0.25)) * (np.sin(geocentricElong.radians - np.pi/2) * geocentricDist.km))
-	eclipsed = sunVectorSep < umbraWidth
-	
+		if night != None and night.covers(time):
+			#Sun and Moon from the tables of the night
+			sunMoon = night.at(time)
 
-	#Determine if sun or moon is up and corresponging elongations
-	l = (earth + loc).at(time)
-	m = l.observe(moon).apparent()
-	s = l.observe(sun).apparent()
+			eclipsed = bool(sunLimbAngle(geocentric.position.km.T, sunMoon["sunGeocentric"]) < 0)
 
-	mAlt = m.altaz()[0]
-	sAlt = s.altaz()[0]
+			sunUp = sunMoon["sunAlt"] > 0
+			sunElong = skyfield.api.Angle(radians=skyfield.functions.angle_between(topocentric.position.au, sunMoon["sun"]))
 
-	sunUp = sAlt.degrees > 0
-	sunElong = topocentric.separation_from(s)
+			moonUp = sunMoon["moonAlt"] > 0
+			moonElong = skyfield.api.Angle(radians=skyfield.functions.angle_between(topocentric.position.au, sunMoon["moon"]))
 
-	moonUp = mAlt.degrees > 0
-	moonElong = topocentric.separation_from(s)
+		else:
+			#Eclipsed when the center of the Sun is behind the Earth as seen from the satellite
+			sunGeocentric = earth.at(time).observe(sun)
+			eclipsed = bool(sunLimbAngle(geocentric.position.km.T, sunGeocentric.position.km.T) < 0)
+
+
+			#Determine if sun or moon is up and corresponging elongations
+			l = (earth + loc).at(time)
+			m = l.observe(moon).apparent()
+			s = l.observe(sun).apparent()
+
+			mAlt = m.altaz()[0]
+			sAlt = s.altaz()[0]
+
+			sunUp = sAlt.degrees > 0
+			sunElong = topocentric.separation_from(s)
+
+			moonUp = mAlt.degrees > 0
+			moonElong = topocentric.separation_from(m)
 
 
 	#Format output into dictionary
@@ -108,7 +129,11 @@ def computeEphemeris(tle, loc, time):
 				"dec" : dec.degrees,
 				"lat" : lat.degrees,
 				"lon" : lon.degrees,
-				"velocity" : velocity.degrees,
+				"velocity" : rates["velocity"],
+				"raRate" : rates["raRate"],
+				"decRate" : rates["decRate"],
+				"altRate" : rates["altRate"],
+				"azRate" : rates["azRate"],
 				"sunElong" : sunElong.degrees,
 				"moonElong" : moonElong.degrees,
 				"eclipsed" : eclipsed,
@@ -121,6 +146,194 @@ def computeEphemeris(tle, loc, time):
 
 
 
+# Compute the ephemeris for one TLE at an array of times
+# Same as computeEphemeris but every value in the returned dict is a numpy array
+# Args: tle = array of string, loc = skyfield topos, times = Skyfield Time array, context = EphemerisContext
+# Returns: dict of arrays
+def computeEphemerisArray(tle, loc, times, context=None):
+	return computeEphemerisBatch([tle], loc, times, np.zeros(len(times.tt), dtype=int), context)
+
+
+
+
+# Compute the ephemeris for many TLEs at once, satIndex[i] gives which TLE goes with times[i]
+# The Sun and Moon are only observed once for all times and each satellite is propagated once
+# For several locations pass a list of topos as loc and siteIndex[i] gives the location of times[i],
+# the satellite positions are then shared between all of the locations
+# The Sun and Moon come from the tables of a NightContext of the location when one covers the times,
+# for several locations night is a list with one NightContext or None per location
+# Args: tleList = array of tle, loc = skyfield topos or array of topos, times = Skyfield Time array, satIndex = array of int,
+#       context = EphemerisContext, siteIndex = array of int, night = NightContext or array of NightContext
+# Returns: dict of arrays
+def computeEphemerisBatch(tleList, loc, times, satIndex, context=None, siteIndex=None, night=None):
+
+	#Initialization of things, reusing the shared context if given
+	if context == None:
+		context = EphemerisContext()
+
+	earth = context.earth
+	moon = context.moon
+	sun = context.sun
+
+	satIndex = np.asarray(satIndex, dtype=int)
+	n = len(satIndex)
+	context.instruments.count("ephemerisPoints", n)
+
+	if siteIndex is None:
+		locs = [loc]
+		nights = [night]
+		siteIndex = np.zeros(n, dtype=int)
+	else:
+		locs = loc
+		nights = [None] * len(locs) if night == None else night
+		siteIndex = np.asarray(siteIndex, dtype=int)
+
+
+	#Preallocate the columns
+	output = {
+				"name" : np.empty(n, dtype=object),
+				"id" : np.empty(n, dtype=object),
+				"time" : np.array(times.utc_datetime(), dtype=object).reshape(n),
+				"range" : np.zeros(n),
+				"height" : np.zeros(n),
+				"altitude" : np.zeros(n),
+				"azimuth" : np.zeros(n),
+				"ra" : np.zeros(n),
+				"dec" : np.zeros(n),
+				"lat" : np.zeros(n),
+				"lon" : np.zeros(n),
+				"velocity" : np.zeros(n),
+				"raRate" : np.zeros(n),
+				"decRate" : np.zeros(n),
+				"altRate" : np.zeros(n),
+				"azRate" : np.zeros(n),
+				"sunElong" : np.zeros(n),
+				"moonElong" : np.zeros(n),
+				"eclipsed" : np.zeros(n, dtype=bool),
+				"sunUp" : np.zeros(n, dtype=bool),
+				"moonUp" : np.zeros(n, dtype=bool)
+			}
+
+
+	#Sun and moon from each observer, all of its times in one go
+	sunPos = np.zeros((3, n))
+	moonPos = np.zeros((3, n))
+	sunGeocentric = np.zeros((3, n))
+	missing = np.zeros(n, dtype=bool)
+	for k in np.unique(siteIndex):
+		idx = np.nonzero(siteIndex == k)[0]
+
+		#From the tables of the night if it covers these times
+		if nights[k] != None and nights[k].covers(times[idx]):
+			sunMoon = nights[k].at(times[idx])
+			output["sunUp"][idx] = sunMoon["sunAlt"] > 0
+			output["moonUp"][idx] = sunMoon["moonAlt"] > 0
+			sunPos[:, idx] = sunMoon["sun"]
+			moonPos[:, idx] = sunMoon["moon"]
+			sunGeocentric[:, idx] = sunMoon["sunGeocentric"]
+			continue
+
+		l = (earth + locs[k]).at(times[idx])
+		m = l.observe(moon).apparent()
+		s = l.observe(sun).apparent()
+		output["sunUp"][idx] = s.altaz()[0].degrees > 0
+		output["moonUp"][idx] = m.altaz()[0].degrees > 0
+		sunPos[:, idx] = s.position.au
+		moonPos[:, idx] = m.position.au
+		missing[idx] = True
+
+	#Sun from the geocenter for the eclipse test
+	if missing.any():
+		sunGeocentric[:, missing] = earth.at(times[missing]).observe(sun).position.km
+
+
+	#Group the times by satellite so each one is propagated with a single call
+	order = np.argsort(satIndex, kind="stable")
+	groups, firsts = np.unique(satIndex[order], return_index=True)
+	bounds = list(firsts[1:]) + [n]
+
+	for k, first, last in zip(groups, firsts, bounds):
+		idx = order[first:last]
+		tle = tleList[k]
+		t = times[idx]
+
+		sat = context.getSatellite(tle)
+
+		#Compute satellite position, its velocity gives the angular velocity
+		geocentric = sat.at(t)
+		subpoint = geocentric.subpoint()
+
+		#Same shadow test as computeEphemeris
+		limbAngle = sunLimbAngle(geocentric.position.km.T, sunGeocentric[:, idx].T)
+
+		output["name"][idx] = tle[0].strip()
+		output["id"][idx] = parseTLEID(tle)
+		output["height"][idx] = subpoint.elevation.km
+		output["lat"][idx] = subpoint.latitude.degrees
+		output["lon"][idx] = subpoint.longitude.degrees
+		output["eclipsed"][idx] = limbAngle < 0
+
+		#Topocentric values for each observer from the shared satellite positions
+		for j in np.unique(siteIndex[idx]):
+			sub = np.nonzero(siteIndex[idx] == j)[0]
+			i = idx[sub]
+
+			#Slicing positions makes new Time objects which lose Skyfield's cached rotations,
+			#so work on all of the group's times and only keep this observer's values
+			topocentric = geocentric - locs[j].at(t)
+			alt, az, distance = topocentric.altaz()
+			ra, dec, temp = topocentric.radec()
+
+			#Angular velocity per second
+			rates = angularRates(topocentric, locs[j])
+
+			output["range"][i] = distance.km[sub]
+			output["altitude"][i] = alt.degrees[sub]
+			output["azimuth"][i] = az.degrees[sub]
+			output["ra"][i] = ra.hours[sub]
+			output["dec"][i] = dec.degrees[sub]
+			for name in ["velocity", "raRate", "decRate", "altRate", "azRate"]:
+				output[name][i] = rates[name][sub]
+			output["sunElong"][i] = np.degrees(skyfield.functions.angle_between(topocentric.position.au[:, sub], sunPos[:, i]))
+			output["moonElong"][i] = np.degrees(skyfield.functions.angle_between(topocentric.position.au[:, sub], moonPos[:, i]))
+
+	return output
+
+
+
+
+# Angular rates of a satellite seen from a location, worked out from the velocity that comes with
+# its position instead of propagating again a moment later
+# The RA rate is of the coordinate itself, multiply by cos(dec) for the rate on the sky
+# Args: topocentric = Skyfield position of the satellite from loc, loc = skyfield topos
+# Returns: dict of velocity = total deg/s, raRate = deg/s, decRate = deg/s, altRate = deg/s, azRate = deg/s
+def angularRates(topocentric, loc):
+	ra, dec, raRate, decRate, velocity = raDecRates(topocentric.position.km.T, topocentric.velocity.km_per_s.T)
+
+	#Alt and az rates in the Earth fixed frame the observer stays still in
+	observer = Observer(loc)
+	position, rate = topocentric.frame_xyz_and_velocity(itrs)
+	altRate, azRate = observer.altAzRates(position.km.T + observer.position, rate.km_per_s.T)
+
+	return {"velocity" : velocity, "raRate" : raRate, "decRate" : decRate, "altRate" : altRate, "azRate" : azRate}
+
+
+
+
+# Convert a datetime to a Skyfield time, dates without a timezone are assumed to be utc
+# Args: ts = Skyfield timescale, date = datetime or Skyfield Time
+# Returns: Skyfield Time
+def convertTime(ts, date):
+	if type(date) != dt.datetime:
+		return date
+	try:
+		return ts.utc(date)
+	except: #date lacks valid timezone, assuming utc
+		return ts.utc(date.replace(tzinfo=skyfield.api.utc))
+
+
+
+
 # Extract the epoch date from a TLE
 # Args: tle = array of string
 # Return: datetime 
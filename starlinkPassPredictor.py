@@ -21,65 +21,104 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 
+import datetime as dt
 import os
+from concurrent.futures import ProcessPoolExecutor
 
 from findPass import *
 from satFunctions import *
 from loadFile import *
+from passStream import *
+from passSelection import *
+from instrumentation import nullInstrumentation
 
 
+#Celestrak supplemental Starlink TLEs
+starlinkURL = "https://celestrak.com/NORAD/elements/supplemental/starlink.txt"
+
+#Context of a worker process, loaded once when the worker starts
+_workerContext = None
+
 
 
 # Find all starlink passes for a given date range and location
-# Args: start = datetime, stop = datetime, loc = skyfield Topos, path = string
-# Returns: array of dict
-def starlinkPassPredictor(start, stop, loc, params = [False, None, False, 0], path=None, filename="observablePasses"):
+# Partial passes cut off by the date range are dropped unless partial is None
+# An empty PassTable is returned when no observable passes are found
+# With workers > 1 the TLEs are split across a pool of processes
+# The TLEs are downloaded from Celestrak unless a tleList is given, a TLECache avoids repeat downloads
+# A PassCache reuses passes of unchanged TLEs from earlier runs, it only holds complete passes
+# Stage timings, counters, and progress go to the Instrumentation of the context, worker processes keep their own
+# A NightContext of loc covering the date range supplies the Sun and Moon instead of computing them for every pass
+# The passes are saved to path as csv, or as Parquet with outputFormat="parquet" (needs pyarrow)
+# Args: start = datetime, stop = datetime, loc = skyfield Topos, path = string, context = EphemerisContext, partial = bool, workers = num,
+#       cache = TLECache, tleList = array of tle, passCache = PassCache, night = NightContext, outputFormat = "csv" or "parquet"
+# Returns: PassTable
+def starlinkPassPredictor(start, stop, loc, params = [False, None, False, 0], path=None, filename="observablePasses", context=None, partial=False, workers=1, cache=None, tleList=None, passCache=None, night=None, outputFormat="csv"):
 
 	sunUp, moonUp, eclipsed, minAlt = params
 
-	#Load the list of TLEs from a file
-	print("Downloading TLE data from Celestrak...")
-	url = "https://celestrak.com/NORAD/elements/supplemental/starlink.txt"
-	tleList = loadFileURL(url)
-	saveFile(tleList, os.path.join(path, "starlinkTLE.txt"))
-	print("Downloaded " + str(len(tleList)) + " valid TLEs")
+	#Load the ephemeris once and share it with every satellite
+	if context == None:
+		context = EphemerisContext()
+	instruments = context.instruments
+
+	#Load the list of TLEs, from the cache if one is given so repeated runs share a download
+	if tleList == None:
+		with instruments.stage("downloadTLEs"):
+			tleList = loadStarlinkTLEs(cache, instruments)
+	instruments.count("tlesLoaded", len(tleList))
+
+	if path != None:
+		with instruments.stage("saveTLEs"):
+			saveFile(tleList, os.path.join(path, "starlinkTLE.txt"))
 
-	print("Date Range: " + start.strftime('%Y-%m-%d %H:%M:%S') + " to " + stop.strftime('%Y-%m-%d %H:%M:%S'))
+	instruments.log("Date Range: " + start.strftime('%Y-%m-%d %H:%M:%S') + " to " + stop.strftime('%Y-%m-%d %H:%M:%S'))
 
-	print("Looking for observable satellites...\n")
+	instruments.log("Looking for observable satellites...\n")
 
-	#Find all passes and filter them per paramters
-	allPasses = []
+	#Find all passes of every satellite at once and filter them per paramters
+	#With a pass cache only new element sets and unsearched parts of the window are computed
+	with instruments.stage("findPasses"):
+		if passCache != None:
+			finder = lambda tles, a, b: findPassesParallel(tles, loc, a, b, workers, context, night)
+			allPasses = passCache.findPasses(tleList, loc, start, stop, finder)
+		elif workers > 1:
+			allPasses = findPassesParallel(tleList, loc, start, stop, workers, context, night)
+		else:
+			allPasses = findPasses(tleList, loc, start, stop, context, night=night)
+	instruments.count("passesFound", len(allPasses))
 
-	for tle in tleList:
-		#Compute passes
-		passes = findPass(tle, loc, start, stop)
+	partialPasses = filterPasses(allPasses, partial=True)
+	instruments.count("partialPasses", len(partialPasses))
+	instruments.log("Found " + str(len(partialPasses)) + " partial passes cut off by the date range")
 
-		#Filter them for observable passes
-		passes = filterPasses(passes, sunUp, moonUp, eclipsed, minAlt)
-		
-		allPasses += passes
+	with instruments.stage("filterPasses"):
+		allPasses = filterPasses(allPasses, sunUp, moonUp, eclipsed, minAlt, partial, instruments)
+	instruments.count("passesObservable", len(allPasses))
 
 
-	#Check that valid passes were found before continuing
+	#Check that valid passes were found before continuing, the caller decides what to do without any
 	if len(allPasses) <= 0:
-		print("Found " + str(len(allPasses)) + " observable passes" )
-		exit()
+		instruments.log("Found " + str(len(allPasses)) + " observable passes")
+		return allPasses
 
 
 	#Sort by time
-	allPasses.sort(key=lambda p: p["maxTime"])
+	with instruments.stage("sortPasses"):
+		allPasses = allPasses.sortBy("maxTime")
 
 
-	print("\nFound " + str(len(allPasses)) + " observable passes" )
-	print()
-	printPassList(allPasses)
-	print()
+	if instruments.verbose:
+		with instruments.stage("printPasses"):
+			instruments.log("\nFound " + str(len(allPasses)) + " observable passes\n")
+			printPassList(allPasses)
+			instruments.log()
 
 
 	if path != None:
 		#Save list of observable passes to csv file
-		saveCSV( os.path.join(path, filename + ".csv"), makePassArray(allPasses), allPasses[0].keys())
+		with instruments.stage("saveCSV"):
+			savePasses(allPasses, os.path.join(path, filename), outputFormat)
 
 
 	return allPasses
@@ -87,34 +126,136 @@ def starlinkPassPredictor(start, stop, loc, params = [False, None, False, 0], pa
 
 
 
-# select Starlink passes with time allowance inbetween
-# Args: passes = array of dict, timePer = num, path = string
-# Returns: array of dict
-def selectStarlinkPasses(passes, timePer, path=None, filename="selectedPasses"):
+# Find all starlink passes for a given date range at several locations at once
+# Each satellite is propagated once and shared by all locations, the options are the same as starlinkPassPredictor
+# Passes are saved to one csv (or Parquet file) per location named filename_location.csv
+# Args: start = datetime, stop = datetime, locs = dict of name : skyfield Topos, path = string, context = EphemerisContext,
+#       partial = bool, cache = TLECache, tleList = array of tle, nights = dict of name : NightContext, outputFormat = "csv" or "parquet"
+# Returns: dict of name : PassTable
+def starlinkPassPredictorMulti(start, stop, locs, params = [False, None, False, 0], path=None, filename="observablePasses", context=None, partial=False, cache=None, tleList=None, nights=None, outputFormat="csv"):
 
-	#Sort by time
-	passes.sort(key=lambda p: p["maxTime"])
+	sunUp, moonUp, eclipsed, minAlt = params
+
+	#Load the ephemeris once and share it with every satellite
+	if context == None:
+		context = EphemerisContext()
+	instruments = context.instruments
+
+	#Load the list of TLEs, from the cache if one is given so repeated runs share a download
+	if tleList == None:
+		tleList = loadStarlinkTLEs(cache, instruments)
+
+	if path != None:
+		saveFile(tleList, os.path.join(path, "starlinkTLE.txt"))
+
+	instruments.log("Date Range: " + start.strftime('%Y-%m-%d %H:%M:%S') + " to " + stop.strftime('%Y-%m-%d %H:%M:%S'))
+
+	instruments.log("Looking for observable satellites from " + ", ".join(locs.keys()) + "...\n")
+
+	#Find all passes of every satellite for every location at once
+	sitePasses = findPassesMulti(tleList, locs, start, stop, context, nights=nights)
+
+	output = {}
+	for site, allPasses in sitePasses.items():
+		allPasses = filterPasses(allPasses, sunUp, moonUp, eclipsed, minAlt, partial)
+
+		#Sort by time
+		allPasses = allPasses.sortBy("maxTime")
+
+		if instruments.verbose:
+			instruments.log("\n" + site + ": found " + str(len(allPasses)) + " observable passes\n")
+			printPassList(allPasses)
+			instruments.log()
+
+		if path != None and len(allPasses) > 0:
+			#Save list of observable passes to csv file
+			savePasses(allPasses, os.path.join(path, filename + "_" + site), outputFormat)
+
+		output[site] = allPasses
+
+
+	return output
+
+
+
+
+# Stream the starlink passes for a given date range and location a time window at a time
+# The TLEs are parsed as they download, the passes of each window are printed, and saved to
+# the csv file as they are found, nothing is computed until the returned generator is used
+# Args: start = datetime, stop = datetime, loc = skyfield Topos, path = string, context = EphemerisContext, partial = bool,
+#       tleList = iterable of tle, window = timedelta, batchSize = num
+# Returns: generator of PassTable sorted by maxTime
+def starlinkPassStream(start, stop, loc, params = [False, None, False, 0], path=None, filename="observablePasses", context=None, partial=False, tleList=None, window=dt.timedelta(hours=1), batchSize=1000):
+
+	instruments = nullInstrumentation if context == None else context.instruments
+
+	#Download and parse the TLEs lazily unless a list is given
+	if tleList == None:
+		instruments.log("Streaming TLE data from Celestrak...")
+		tleList = streamFileURL(starlinkURL)
+
+	instruments.log("Date Range: " + start.strftime('%Y-%m-%d %H:%M:%S') + " to " + stop.strftime('%Y-%m-%d %H:%M:%S'))
+
+	instruments.log("Looking for observable satellites...\n")
+
+	stream = streamPasses(tleList, loc, start, stop, params, context, window, batchSize, partial)
+	if instruments.verbose:
+		stream = printPassStream(stream)
+
+	if path != None:
+		#Save observable passes to csv file as they are found
+		stream = savePassStream(stream, os.path.join(path, filename + ".csv"))
+
+	return stream
+
+
+
+
+# Download the latest Starlink TLEs from Celestrak
+# Args: cache = TLECache, instruments = Instrumentation for the progress messages
+# Returns: array of tle
+def loadStarlinkTLEs(cache=None, instruments=nullInstrumentation):
+	instruments.log("Downloading TLE data from Celestrak...")
+	if cache != None:
+		tleList = cache.load(starlinkURL)
+	else:
+		tleList = loadFileURL(starlinkURL)
+	instruments.log("Downloaded " + str(len(tleList)) + " valid TLEs")
+
+	return tleList
+
+
+
+
+# select Starlink passes with time allowance inbetween
+# The optimal mode picks the passes with the greatest total weight (see passSelection.py), the greedy
+# mode keeps the first pass and every pass after it that is far enough from the last one kept
+# With a mount model the time needed between two passes comes from the slew between them instead of timePer
+# Args: passes = PassTable, timePer = timedelta, path = string, filename = string, mode = "optimal" or "greedy",
+#       weights = dict like defaultWeights, observed = iterable of satellite ids already observed, mount = MountModel,
+#       outputFormat = "csv" or "parquet", instruments = Instrumentation for the progress messages
+# Returns: PassTable
+def selectStarlinkPasses(passes, timePer, path=None, filename="selectedPasses", mode="optimal", weights=None, observed=None, mount=None, outputFormat="csv", instruments=nullInstrumentation):
+
+	#Sort by the time each pass is imaged
+	passes = toPassTable(passes).sortBy("targetTime")
 
 	#Select passes for observation
-	print("Selecting passes for observation...")
-	selectPasses = [passes[0]]
-	for p in passes:
-		#if too soon since last observation skip this one
-		if (p["maxTime"] - selectPasses[-1]["maxTime"]) < timePer:
-			continue
-		else:
-			selectPasses.append(p)
+	instruments.log("Selecting passes for observation...")
+	selected = choosePasses(passes, timePer, mode, weights, observed, mount)
+
+	selectPasses = passes[selected]
 
 
-	print("Selected " + str(len(selectPasses)) + " for observation")
-	print()
-	printPassList(selectPasses)
-	print()
+	instruments.log("Selected " + str(len(selectPasses)) + " for observation\n")
+	if instruments.verbose:
+		printPassList(selectPasses)
+		instruments.log()
 
 
 	if path != None:
 		#Save list of selected passes to csv file
-		saveCSV( os.path.join(path, filename + ".csv"), makePassArray(selectPasses), selectPasses[0].keys())
+		savePasses(selectPasses, os.path.join(path, filename), outputFormat)
 
 
 	return selectPasses
@@ -122,4 +263,45 @@ def selectStarlinkPasses(passes, timePer, path=None, filename="selectedPasses"):
 
 
 
+# Find passes for a list of TLEs split across a pool of worker processes
+# Each worker loads the ephemeris once when it starts, the TLEs are only sent to it
+# The passes come back in the same order as a single findPasses call over the whole list
+# Args: tleList = array of tle, loc = skyfield Topos, start = datetime, stop = datetime, workers = num, context = EphemerisContext,
+#       night = NightContext
+# Returns: PassTable
+def findPassesParallel(tleList, loc, start, stop, workers, context=None, night=None):
+	workers = max(min(workers, len(tleList)), 1)
+
+	if workers == 1:
+		return findPasses(tleList, loc, start, stop, context, night=night)
+
+	ephemeris = "de421.bsp" if context == None else context.ephemerisName
+	maxSatellites = 10000 if context == None else context.maxSatellites
+
+	#Contiguous blocks keep the satellites in their original order
+	size = -(-len(tleList) // workers)
+	blocks = [tleList[i:i+size] for i in range(0, len(tleList), size)]
+
+	with ProcessPoolExecutor(workers, initializer=_initWorker, initargs=(ephemeris, maxSatellites)) as pool:
+		output = list(pool.map(_findPassesWorker, blocks, [loc]*len(blocks), [start]*len(blocks), [stop]*len(blocks), [night]*len(blocks)))
+
+	return concatenatePasses(output)
+
+
+
+
+# Load the ephemeris for a worker process
+# Args: ephemeris = string, maxSatellites = num
+# Returns: nothing
+def _initWorker(ephemeris, maxSatellites):
+	global _workerContext
+	_workerContext = EphemerisContext(ephemeris, maxSatellites)
+
+
+
 
+# Find passes for one block of TLEs inside a worker process
+# Args: tleList = array of tle, loc = skyfield Topos, start = datetime, stop = datetime, night = NightContext
+# Returns: PassTable
+def _findPassesWorker(tleList, loc, start, stop, night=None):
+	return findPasses(tleList, loc, start, stop, _workerContext, night=night)
@@ -0,0 +1,43 @@
+# conftest.py
+#
+# Shared setup for the tests, the modules are imported from the repository root
+#
+# Harry Krantz
+# Steward Observatory
+# University of Arizona
+# Copyright May 2020
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ephemerisContext import EphemerisContext
+
+
+
+
+# One EphemerisContext for every test, de421.bsp is loaded from the working directory like main.py does
+# The tests are skipped if it isn't there and can't be downloaded
+@pytest.fixture(scope="session")
+def context():
+	try:
+		return EphemerisContext("de421.bsp")
+	except Exception as e:
+		pytest.skip("No planetary ephemeris: " + str(e))
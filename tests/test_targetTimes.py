@@ -0,0 +1,59 @@
+# test_targetTimes.py
+#
+# The passes are planned at a time they are sunlit
+#
+# Harry Krantz
+# Steward Observatory
+# University of Arizona
+# Copyright May 2020
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import datetime as dt
+
+import numpy as np
+from skyfield.api import utc
+
+from starlinkPassPredictor import *
+from benchmark import syntheticShell
+from mountModel import MountModel
+from locations import locations
+
+
+
+
+#Evening twilight at Lemmon, satellites go into the Earth's shadow during most passes
+start = dt.datetime(2015, 3, 2, 2, tzinfo=utc)
+stop = dt.datetime(2015, 3, 2, 5, tzinfo=utc)
+
+
+
+
+# Every selected pass that is sunlit at all is planned inside its sunlit interval
+def testPlannedTimesAreSunlit(context):
+	tleList = syntheticShell(300, start)
+	passes = starlinkPassPredictor(start, stop, locations["Lemmon"], [False, None, False, 20], None, context=context, tleList=tleList)
+	selected = selectStarlinkPasses(passes, None, mount=MountModel())
+
+	assert len(selected) > 0
+	assert not selected["eclipsed"].any()
+	assert np.all(selected["targetTime"] >= selected["sunlitStart"])
+	assert np.all(selected["targetTime"] <= selected["sunlitEnd"])
+
+	#Passes in shadow at the peak were moved and the rest are planned at the peak
+	shadowed = (passes["maxTime"] < passes["sunlitStart"]) | (passes["maxTime"] > passes["sunlitEnd"])
+	assert shadowed.any()
+	assert np.all(passes["targetTime"][~shadowed] == passes["maxTime"][~shadowed])
+	assert np.all(passes["targetAlt"] >= 20)
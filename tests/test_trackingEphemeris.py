@@ -0,0 +1,59 @@
+# test_targetTimes.py
+#
+# The passes are planned at a time they are sunlit
+#
+# Harry Krantz
+# Steward Observatory
+# University of Arizona
+# Copyright May 2020
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import datetime as dt
+
+import numpy as np
+from skyfield.api import utc
+
+from starlinkPassPredictor import *
+from benchmark import syntheticShell
+from locations import locations
+from trackingEphemeris import trackPasses, trackColumns
+
+
+
+
+start = dt.datetime(2015, 3, 2, 2, tzinfo=utc)
+stop = dt.datetime(2015, 3, 2, 4, tzinfo=utc)
+
+
+
+
+# A satellite with two element sets is tracked with the newer one whichever comes first
+def testNewestEpochIsTracked(context):
+	newer = syntheticShell(40, start)
+	older = syntheticShell(40, start - dt.timedelta(days=2))
+	loc = locations["Lemmon"]
+	passes = starlinkPassPredictor(start, stop, loc, [False, None, False, 10], None, context=context, tleList=newer)
+	assert len(passes) > 0
+
+	expected = trackPasses(passes, newer, loc, context, step=10)
+	for tleList in [older + newer, newer + older]:
+		track = trackPasses(passes, tleList, loc, context, step=10)
+		for column in trackColumns:
+			assert np.array_equal(track.columns[column], expected.columns[column])
+
+	#The older element sets put the satellites somewhere else
+	track = trackPasses(passes, older, loc, context, step=10)
+	assert not np.array_equal(track.columns["alt"], expected.columns["alt"])
@@ -0,0 +1,176 @@
+# tleCache.py
+#
+# Keep local copies of downloaded TLE catalogs and only refresh them when needed
+#
+# Harry Krantz
+# Steward Observatory
+# University of Arizona
+# Copyright May 2020
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import datetime as dt
+import hashlib
+import json
+import os
+
+import requests
+
+from instrumentation import nullInstrumentation
+from loadFile import parseTLEFile
+from satFunctions import parseTLEdate
+
+
+
+
+# A directory of downloaded TLE catalogs, one text file and one json file of
+# metadata (url, fetch time, ETag, Last-Modified, epoch range) per url
+# Copies younger than maxAge are used without touching the network, older ones
+# are refreshed with a conditional request, and if the download fails the
+# cached copy is used instead
+# Args: cacheDir = path, maxAge = timedelta, offline = bool, timeout = num seconds,
+#       instruments = Instrumentation for the messages and the failed download count
+class TLECache:
+
+	def __init__(self, cacheDir="tleCache", maxAge=dt.timedelta(hours=2), offline=False, timeout=30, instruments=nullInstrumentation):
+		self.cacheDir = cacheDir
+		self.maxAge = maxAge
+		self.offline = offline
+		self.timeout = timeout
+		self.instruments = instruments
+
+		if not os.path.isdir(cacheDir):
+			os.makedirs(cacheDir)
+
+
+	# Load the TLEs for a url, downloading them only if the cached copy is too old
+	# Args: url = string, satName = string
+	# Returns: array
+	def load(self, url, satName="SATNAME"):
+		meta = self.getMeta(url)
+
+		if meta != None and (self.offline or self.age(meta) < self.maxAge):
+			return self.loadCached(url, satName)
+
+		if self.offline:
+			raise OSError("Offline and no cached TLEs for " + url)
+
+		#Ask the server for the catalog only if it changed since the cached copy
+		headers = {}
+		if meta != None and meta.get("etag"):
+			headers["If-None-Match"] = meta["etag"]
+		if meta != None and meta.get("lastModified"):
+			headers["If-Modified-Since"] = meta["lastModified"]
+
+		try:
+			f = requests.get(url, headers=headers, timeout=self.timeout)
+		except requests.RequestException as e:
+			self.instruments.count("tleDownloadFailures")
+			if meta == None:
+				raise
+			self.instruments.log("Could not download " + url + ", using cached TLEs from " + meta["fetched"])
+			return self.loadCached(url, satName)
+
+		if f.status_code == 304 and meta != None:
+			#Not modified, the cached copy is fresh again
+			meta["fetched"] = dt.datetime.utcnow().isoformat()
+			self.saveMeta(url, meta)
+			return self.loadCached(url, satName)
+
+		if f.status_code != 200:
+			self.instruments.count("tleDownloadFailures")
+			if meta == None:
+				f.raise_for_status()
+				raise OSError("Unexpected response %d for %s" % (f.status_code, url))
+			self.instruments.log("Download of " + url + " returned " + str(f.status_code) + ", using cached TLEs from " + meta["fetched"])
+			return self.loadCached(url, satName)
+
+		return self.store(url, f.text, f.headers.get("ETag"), f.headers.get("Last-Modified"), satName)
+
+
+	# Save a downloaded catalog and its metadata
+	# Args: url = string, text = string, etag = string, lastModified = string, satName = string
+	# Returns: array
+	def store(self, url, text, etag=None, lastModified=None, satName="SATNAME"):
+		tleList = parseTLEFile(text.splitlines(), satName)
+
+		with open(self.textFile(url), "w") as f:
+			f.write(text)
+
+		epochs = [parseTLEdate(tle) for tle in tleList]
+		meta = {
+			"url" : url,
+			"fetched" : dt.datetime.utcnow().isoformat(),
+			"etag" : etag,
+			"lastModified" : lastModified,
+			"count" : len(tleList),
+			"epochMin" : min(epochs).isoformat() if epochs else None,
+			"epochMax" : max(epochs).isoformat() if epochs else None
+		}
+		self.saveMeta(url, meta)
+
+		return tleList
+
+
+	# Load the cached copy of a catalog
+	# Args: url = string, satName = string
+	# Returns: array
+	def loadCached(self, url, satName="SATNAME"):
+		with open(self.textFile(url)) as f:
+			content = f.read().splitlines()
+		return parseTLEFile(content, satName)
+
+
+	# Metadata of the cached copy of a url or None if it has never been fetched
+	# Args: url = string
+	# Returns: dict
+	def getMeta(self, url):
+		if not (os.path.isfile(self.metaFile(url)) and os.path.isfile(self.textFile(url))):
+			return None
+		with open(self.metaFile(url)) as f:
+			return json.load(f)
+
+
+	# Args: url = string, meta = dict
+	# Returns: nothing
+	def saveMeta(self, url, meta):
+		with open(self.metaFile(url), "w") as f:
+			json.dump(meta, f, indent=1)
+
+
+	# How long ago a cached copy was fetched
+	# Args: meta = dict
+	# Returns: timedelta
+	def age(self, meta):
+		return dt.datetime.utcnow() - dt.datetime.fromisoformat(meta["fetched"])
+
+
+	# Args: url = string
+	# Returns: path
+	def textFile(self, url):
+		return os.path.join(self.cacheDir, self.key(url) + ".txt")
+
+
+	# Args: url = string
+	# Returns: path
+	def metaFile(self, url):
+		return os.path.join(self.cacheDir, self.key(url) + ".json")
+
+
+	# File name safe key for a url
+	# Args: url = string
+	# Returns: string
+	def key(self, url):
+		return hashlib.sha1(url.encode()).hexdigest()[:16]
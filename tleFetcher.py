@@ -0,0 +1,162 @@
+# tleFetcher.py
+#
+# Download several TLE catalogs at once and merge them
+#
+# Harry Krantz
+# Steward Observatory
+# University of Arizona
+# Copyright May 2020
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import asyncio
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from instrumentation import nullInstrumentation
+from loadFile import parseTLEFile
+from satFunctions import parseTLEdate, parseTLEID
+
+
+#Catalogs fetched when no sources are given
+defaultSources = {
+	"starlinkSupplemental" : "https://celestrak.com/NORAD/elements/supplemental/starlink.txt",
+	"starlink" : "https://celestrak.com/NORAD/elements/gp.php?GROUP=starlink&FORMAT=tle",
+	"oneweb" : "https://celestrak.com/NORAD/elements/gp.php?GROUP=oneweb&FORMAT=tle"
+}
+
+#Responses worth trying again
+retryStatus = [429, 500, 502, 503, 504]
+
+
+
+
+# Fetches a set of TLE catalogs concurrently over one pooled HTTP session
+# Every source is requested in its own thread so the total wait is about the slowest source
+# Failed requests are retried with exponentially growing waits in between, a source that still
+# fails is reported and left out of the merged result
+# Args: sources = dict of name : url, timeout = num seconds or dict of name : num seconds, retries = num,
+#       backoff = num seconds, maxConnections = num, instruments = Instrumentation for the messages and the
+#       retry and failure counts
+class TLEFetcher:
+
+	def __init__(self, sources=None, timeout=30, retries=3, backoff=1.0, maxConnections=10, instruments=nullInstrumentation):
+		self.sources = dict(defaultSources if sources == None else sources)
+		self.timeout = timeout
+		self.retries = retries
+		self.backoff = backoff
+		self.instruments = instruments
+
+		#One session shares its connections between every source on the same host
+		self.session = requests.Session()
+		adapter = HTTPAdapter(pool_connections=maxConnections, pool_maxsize=maxConnections)
+		self.session.mount("http://", adapter)
+		self.session.mount("https://", adapter)
+
+
+	# Fetch every source and merge them, keeping the newest element set of each satellite
+	# Args: none
+	# Returns: array of tle
+	def fetch(self):
+		return mergeTLEs(self.fetchAll().values())
+
+
+	# Fetch every source, blocking until all are done
+	# Args: none
+	# Returns: dict of name : array of tle
+	def fetchAll(self):
+		return asyncio.run(self.fetchAllAsync())
+
+
+	# Fetch every source concurrently
+	# Args: none
+	# Returns: dict of name : array of tle
+	async def fetchAllAsync(self):
+		names = list(self.sources.keys())
+		results = await asyncio.gather(*[self.fetchSource(name) for name in names], return_exceptions=True)
+
+		output = {}
+		for name, result in zip(names, results):
+			if isinstance(result, Exception):
+				self.instruments.count("tleFailures")
+				self.instruments.log("Could not download " + name + " from " + self.sources[name] + ": " + str(result))
+				continue
+			self.instruments.log("Downloaded " + str(len(result)) + " TLEs from " + name)
+			output[name] = result
+
+		if len(output) == 0 and len(names) > 0:
+			raise OSError("Could not download any of the TLE sources")
+
+		return output
+
+
+	# Fetch one source, retrying failures with backoff
+	# Args: name = string
+	# Returns: array of tle
+	async def fetchSource(self, name):
+		url = self.sources[name]
+		timeout = self.timeout.get(name, 30) if isinstance(self.timeout, dict) else self.timeout
+
+		for attempt in range(self.retries + 1):
+			try:
+				text = await asyncio.to_thread(self.download, url, timeout)
+				return parseTLEFile(text.splitlines())
+			except requests.HTTPError:
+				#The server understood and refused, asking again won't help
+				raise
+			except (requests.RequestException, OSError) as e:
+				if attempt == self.retries:
+					raise
+				wait = self.backoff * 2**attempt
+				self.instruments.count("tleRetries")
+				self.instruments.log("Download of " + name + " failed (" + str(e) + "), retrying in " + str(wait) + " s")
+				await asyncio.sleep(wait)
+
+
+	# Blocking download of one url through the shared session
+	# Args: url = string, timeout = num seconds
+	# Returns: string
+	def download(self, url, timeout):
+		f = self.session.get(url, timeout=timeout)
+		if f.status_code in retryStatus:
+			raise OSError("Server returned " + str(f.status_code))
+		f.raise_for_status()
+		return f.text
+
+
+	# Close the pooled connections
+	# Args: none
+	# Returns: nothing
+	def close(self):
+		self.session.close()
+
+
+
+
+# Merge lists of TLEs keeping only the newest epoch of each NORAD ID
+# Satellites come out in the order they were first seen
+# Args: tleLists = iterable of array of tle
+# Returns: array of tle
+def mergeTLEs(tleLists):
+	newest = {}
+	for tleList in tleLists:
+		for tle in tleList:
+			noradID = parseTLEID(tle)[:5]
+			epoch = parseTLEdate(tle)
+			if noradID not in newest or epoch > newest[noradID][0]:
+				newest[noradID] = (epoch, tle)
+
+	return [tle for epoch, tle in newest.values()]
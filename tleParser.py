@@ -0,0 +1,255 @@
+# tleParser.py
+#
+# Fast validating parser for whole TLE catalog files
+#
+# Harry Krantz
+# Steward Observatory
+# University of Arizona
+# Copyright May 2020
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import numpy as np
+
+from tleStore import TLEStore, tleDtype
+
+
+#Width of a TLE line
+TLE_WIDTH = 69
+
+#Layout of the two element lines, one character per column
+# 1 or 2 = that character, s = space, d = digit, b = digit or space, . = decimal point,
+# + = sign or space, - = sign, n = digit, letter or space, x = anything
+line1Layout = "1s" + "nbbbb" + "x" + "s" + "xxxxxxxx" + "s" + "dd" + "bbd.dddddddd" + "s" + "+.dddddddd" + "s" + "+bbbbb-d" + "s" + "+bbbbb-d" + "s" + "b" + "s" + "bbbb" + "d"
+line2Layout = "2s" + "nbbbb" + "s" + "bbb.dddd" + "s" + "bbb.dddd" + "s" + "bbbbbbb" + "s" + "bbb.dddd" + "s" + "bbb.dddd" + "s" + "bb.dddddddd" + "bbbbb" + "d"
+
+#Radians per degree and revolutions per day to radians per minute, as used by sgp4
+_deg2rad = np.pi / 180.0
+_xpdotp = 1440.0 / (2.0 * np.pi)
+
+#Value of each character in a checksum
+_checksumValue = np.zeros(256, dtype=np.uint8)
+_checksumValue[ord("0"):ord("9") + 1] = np.arange(10)
+_checksumValue[ord("-")] = 1
+
+#Value of each character in an alpha-5 catalog number, I and O are never used
+_alpha5 = np.full(256, -1, dtype=np.int64)
+_alpha5[ord("0"):ord("9") + 1] = np.arange(10)
+_alpha5[ord(" ")] = 0
+for _i, _c in enumerate("ABCDEFGHJKLMNPQRSTUVWXYZ"):
+	_alpha5[ord(_c)] = 10 + _i
+
+
+
+
+# Parse a whole TLE catalog file
+# Args: filename = path, satName = string
+# Returns: TLEStore, array of [line number, reason]
+def loadTLECatalog(filename, satName="SATNAME"):
+	with open(filename, "rb") as f:
+		data = f.read()
+	return parseTLEBytes(data, satName)
+
+
+
+
+# Parse the raw bytes of a TLE catalog in one pass
+# The lines are packed into a fixed width byte matrix and every check and field is
+# done on whole columns of it at once, there is no per line string handling
+# Both two line and three line (optionally "0 " prefixed) formats are read, CRLF line
+# endings and blank lines are fine, and any record that fails a check is skipped and
+# reported with its line number and the reason
+# Args: data = bytes, satName = string used when a TLE has no name line
+# Returns: TLEStore, array of [line number, reason]
+def parseTLEBytes(data, satName="SATNAME"):
+	rejected = []
+
+	lines = data.replace(b"\r\n", b"\n").replace(b"\r", b"\n").split(b"\n")
+	width = max(max(map(len, lines)), TLE_WIDTH)
+	text = np.array(lines, dtype="S%d" % width).view(np.uint8).reshape(len(lines), width)
+
+	#Length of each line without trailing whitespace
+	printable = text > 32
+	length = np.where(printable.any(axis=1), width - np.argmax(printable[:, ::-1], axis=1), 0)
+
+	#Blank lines are dropped, line numbers are kept for the report
+	lineNumber = np.flatnonzero(length > 0) + 1
+	text = text[lineNumber - 1]
+	length = length[lineNumber - 1]
+
+	isLine1 = (text[:, 0] == ord("1")) & (text[:, 1] == ord(" "))
+	isLine2 = (text[:, 0] == ord("2")) & (text[:, 1] == ord(" "))
+	isName = ~isLine1 & ~isLine2
+
+	#A record is a line 1 followed by a line 2, with the line before it as the name if it is one
+	first = np.flatnonzero(isLine1[:-1] & isLine2[1:])
+	second = first + 1
+	named = np.zeros(len(first), dtype=bool)
+	named[first > 0] = isName[first[first > 0] - 1]
+
+	used = np.zeros(len(text), dtype=bool)
+	used[first] = True
+	used[second] = True
+	used[first[named] - 1] = True
+	for i in np.flatnonzero(~used):
+		if isLine1[i]:
+			reason = "line 1 not followed by a line 2"
+		elif isLine2[i]:
+			reason = "line 2 without a line 1"
+		else:
+			reason = "name without element lines"
+		rejected.append([int(lineNumber[i]), reason])
+
+	#Every check on every record at once
+	line1 = text[first, :TLE_WIDTH]
+	line2 = text[second, :TLE_WIDTH]
+	checks = [
+		("line 1 is not 69 characters", length[first] != TLE_WIDTH),
+		("line 2 is not 69 characters", length[second] != TLE_WIDTH),
+		("line 1 layout", ~_matchesLayout(line1, line1Layout)),
+		("line 2 layout", ~_matchesLayout(line2, line2Layout)),
+		("line 1 checksum", _checksum(line1) != line1[:, 68] - ord("0")),
+		("line 2 checksum", _checksum(line2) != line2[:, 68] - ord("0")),
+		("catalog numbers differ", np.any(line1[:, 2:7] != line2[:, 2:7], axis=1))
+	]
+
+	good = np.ones(len(first), dtype=bool)
+	for reason, failed in checks:
+		for i in np.flatnonzero(good & failed):
+			rejected.append([int(lineNumber[first[i]]), reason])
+		good &= ~failed
+
+	rejected.sort()
+
+	first = first[good]
+	named = named[good]
+	line1 = line1[good]
+	line2 = line2[good]
+
+	records = np.zeros(len(first), dtype=tleDtype)
+
+	#Names, the "0 " of the three line format is dropped
+	records["name"] = satName.encode()
+	nameLines = text[first[named] - 1]
+	zeroPrefix = (nameLines[:, 0] == ord("0")) & (nameLines[:, 1] == ord(" "))
+	names = np.where(zeroPrefix, _strings(nameLines, 2, width), _strings(nameLines, 0, width))
+	records["name"][named] = np.char.strip(names)
+
+	records["line1"] = _strings(line1, 0, TLE_WIDTH)
+	records["line2"] = _strings(line2, 0, TLE_WIDTH)
+
+	#Catalog number, alpha-5 numbers have a letter for the ten thousands
+	records["noradID"] = _alpha5[line1[:, 2]] * 10000 + _digits(line1, 3, 7)
+	records["classification"] = _strings(line1, 7, 8)
+	records["intldesg"] = np.char.strip(_strings(line1, 9, 17))
+
+	#Epoch as a two digit year and day of year, split into whole and fractional Julian days like sgp4
+	year = _digits(line1, 18, 20)
+	year = np.where(year < 57, year + 2000, year + 1900)
+	epochDays = _strings(line1, 20, 32).astype(float)
+	wholeDays = np.floor(epochDays)
+	records["jdsatepoch"] = 367.0 * year - np.floor(7 * year * 0.25) + 30 + 1721013.5 + wholeDays
+	records["jdsatepochF"] = epochDays - wholeDays
+
+	#Drag terms, the second derivative and bstar have an assumed decimal point and an exponent
+	records["ndot"] = _strings(line1, 33, 43).astype(float) / (_xpdotp * 1440.0)
+	records["nddot"] = _exponential(line1, 44) / (_xpdotp * 1440.0 * 1440.0)
+	records["bstar"] = _exponential(line1, 53)
+	records["ephtype"] = _digits(line1, 62, 63)
+	records["elnum"] = _digits(line1, 64, 68)
+
+	records["inclo"] = _strings(line2, 8, 16).astype(float) * _deg2rad
+	records["nodeo"] = _strings(line2, 17, 25).astype(float) * _deg2rad
+	records["ecco"] = _digits(line2, 26, 33) * 1e-7
+	records["argpo"] = _strings(line2, 34, 42).astype(float) * _deg2rad
+	records["mo"] = _strings(line2, 43, 51).astype(float) * _deg2rad
+	records["no_kozai"] = _strings(line2, 52, 63).astype(float) / _xpdotp
+	records["revnum"] = _digits(line2, 63, 68)
+
+	return TLEStore(records), rejected
+
+
+
+
+# Which rows of a byte matrix match a layout string
+# Args: lines = array of uint8 (n, 69), layout = string
+# Returns: array of bool
+def _matchesLayout(lines, layout):
+	digit = (lines >= ord("0")) & (lines <= ord("9"))
+	space = lines == ord(" ")
+	sign = (lines == ord("+")) | (lines == ord("-"))
+	letter = (lines >= ord("A")) & (lines <= ord("Z"))
+
+	allowed = {
+		"s" : space,
+		"d" : digit,
+		"b" : digit | space,
+		"." : lines == ord("."),
+		"+" : sign | space,
+		"-" : sign,
+		"n" : digit | letter | space
+	}
+
+	ok = np.ones(len(lines), dtype=bool)
+	for column, kind in enumerate(layout):
+		if kind in allowed:
+			ok &= allowed[kind][:, column]
+		elif kind != "x":
+			ok &= lines[:, column] == ord(kind)
+
+	return ok
+
+
+
+
+# TLE checksums of a byte matrix, digits count their value and minus signs count one
+# Args: lines = array of uint8 (n, 69)
+# Returns: array of int
+def _checksum(lines):
+	return _checksumValue[lines[:, :68]].sum(axis=1, dtype=np.int64) % 10
+
+
+
+
+# Fixed width columns of a byte matrix as an array of byte strings
+# Args: lines = array of uint8, start = int, stop = int
+# Returns: array of bytes
+def _strings(lines, start, stop):
+	return np.ascontiguousarray(lines[:, start:stop]).view("S%d" % (stop - start)).ravel()
+
+
+
+
+# Integer value of fixed width columns holding only digits or spaces
+# Args: lines = array of uint8, start = int, stop = int
+# Returns: array of int
+def _digits(lines, start, stop):
+	value = np.zeros(len(lines), dtype=np.int64)
+	for column in range(start, stop):
+		digit = lines[:, column].astype(np.int64) - ord("0")
+		value = value * 10 + np.where((digit >= 0) & (digit <= 9), digit, 0)
+	return value
+
+
+
+
+# Value of an assumed decimal point field like " 12345-3", meaning 0.12345e-3
+# Args: lines = array of uint8, start = column of the sign
+# Returns: array of float
+def _exponential(lines, start):
+	sign = np.where(lines[:, start] == ord("-"), -1.0, 1.0)
+	mantissa = _digits(lines, start + 1, start + 6) * 1e-5
+	exponent = _digits(lines, start + 7, start + 8) * np.where(lines[:, start + 6] == ord("-"), -1, 1)
+	return sign * mantissa * 10.0 ** exponent
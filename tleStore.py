@@ -0,0 +1,174 @@
+# tleStore.py
+#
+# Compact binary storage of parsed TLEs that can be memory-mapped
+#
+# Harry Krantz
+# Steward Observatory
+# University of Arizona
+# Copyright May 2020
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import numpy as np
+
+from sgp4.api import Satrec, WGS72
+
+
+#Days from the Julian date epoch to the SGP4 epoch of 1949 December 31 00:00 UT
+SGP4_EPOCH_JD = 2433281.5
+
+#One record per element set, the original text is kept so conversion back is exact
+tleDtype = np.dtype([
+	("noradID", "i4"),
+	("name", "S64"),
+	("line1", "S69"),
+	("line2", "S69"),
+	("jdsatepoch", "f8"),
+	("jdsatepochF", "f8"),
+	("ndot", "f8"),
+	("nddot", "f8"),
+	("bstar", "f8"),
+	("inclo", "f8"),
+	("nodeo", "f8"),
+	("ecco", "f8"),
+	("argpo", "f8"),
+	("mo", "f8"),
+	("no_kozai", "f8"),
+	("elnum", "i4"),
+	("revnum", "i4"),
+	("classification", "S1"),
+	("intldesg", "S8"),
+	("ephtype", "i1")
+])
+
+
+
+
+# A structured array of element sets that behaves like a list of TLEs
+# Indexing with an int gives back the usual [name, line1, line2], anything else
+# (slices, masks, index arrays) gives another TLEStore
+# Args: records = structured array of tleDtype
+class TLEStore:
+
+	def __init__(self, records):
+		self.records = records
+		self._order = None
+
+
+	def __len__(self):
+		return len(self.records)
+
+
+	def __getitem__(self, i):
+		if isinstance(i, (int, np.integer)):
+			r = self.records[i]
+			return [r["name"].decode(), r["line1"].decode(), r["line2"].decode()]
+		return TLEStore(self.records[i])
+
+
+	def __iter__(self):
+		for i in range(len(self.records)):
+			yield self[i]
+
+
+	# Convert back to the three line list format
+	# Args: none
+	# Returns: array of tle
+	def toTLEs(self):
+		return list(self)
+
+
+	# Every element set of one satellite, oldest epoch first
+	# Args: noradID = int or string
+	# Returns: TLEStore
+	def byID(self, noradID):
+		noradID = int(str(noradID).strip().rstrip("UCS"))
+
+		#Index sorted by NORAD ID then epoch, built on first use
+		if self._order is None:
+			epoch = self.records["jdsatepoch"] + self.records["jdsatepochF"]
+			self._order = np.lexsort((epoch, self.records["noradID"]))
+			self._sortedIDs = self.records["noradID"][self._order]
+
+		first = np.searchsorted(self._sortedIDs, noradID, side="left")
+		last = np.searchsorted(self._sortedIDs, noradID, side="right")
+
+		return TLEStore(self.records[self._order[first:last]])
+
+
+	# Newest element set of each satellite
+	# Args: none
+	# Returns: TLEStore
+	def latest(self):
+		epoch = self.records["jdsatepoch"] + self.records["jdsatepochF"]
+		order = np.lexsort((-epoch, self.records["noradID"]))
+		ids = self.records["noradID"][order]
+		first = np.ones(len(order), dtype=bool)
+		first[1:] = ids[1:] != ids[:-1]
+		return TLEStore(self.records[np.sort(order[first])])
+
+
+	# Build SGP4 satellites straight from the stored elements without parsing any text
+	# Args: none
+	# Returns: array of Satrec
+	def satrecs(self):
+		output = []
+		for r in self.records:
+			sat = Satrec()
+			sat.sgp4init(WGS72, "i", int(r["noradID"]), (r["jdsatepoch"] - SGP4_EPOCH_JD) + r["jdsatepochF"],
+				r["bstar"], r["ndot"], r["nddot"], r["ecco"], r["argpo"], r["inclo"], r["mo"], r["no_kozai"], r["nodeo"])
+			output.append(sat)
+		return output
+
+
+	# Save the store to a .npy file
+	# Args: filename = string
+	# Returns: nothing
+	def save(self, filename):
+		np.save(filename, self.records, allow_pickle=False)
+
+
+
+
+# Parse a list of TLEs into a TLEStore
+# Args: tleList = array of tle
+# Returns: TLEStore
+def tlesToStore(tleList):
+	records = np.zeros(len(tleList), dtype=tleDtype)
+
+	for i, tle in enumerate(tleList):
+		name, line1, line2 = tle
+
+		if len(line1) > 69 or len(line2) > 69 or len(name.encode()) > 64:
+			raise ValueError("TLE lines too long to store: " + line1)
+
+		sat = Satrec.twoline2rv(line1, line2)
+
+		records[i] = (sat.satnum, name.encode(), line1.encode(), line2.encode(),
+			sat.jdsatepoch, sat.jdsatepochF, sat.ndot, sat.nddot, sat.bstar,
+			sat.inclo, sat.nodeo, sat.ecco, sat.argpo, sat.mo, sat.no_kozai,
+			sat.elnum, sat.revnum, sat.classification.encode(), sat.intldesg.encode(), sat.ephtype)
+
+	return TLEStore(records)
+
+
+
+
+# Load a TLEStore saved with TLEStore.save, memory-mapped by default so only the records used are read
+# Args: filename = string, mmap = bool
+# Returns: TLEStore
+def loadTLEStore(filename, mmap=True):
+	records = np.load(filename, mmap_mode="r" if mmap else None, allow_pickle=False)
+	return TLEStore(records)
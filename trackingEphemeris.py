@@ -0,0 +1,218 @@
+# trackingEphemeris.py
+#
+# Dense ephemerides of selected passes for non-sidereal tracking and streak prediction
+#
+# Harry Krantz
+# Steward Observatory
+# University of Arizona
+# Copyright May 2020
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import os
+import numpy as np
+
+from constellationPropagator import ConstellationPropagator, Observer, itrfToGCRS, raDecRates
+from ephemerisContext import EphemerisContext
+from satFunctions import parseTLEdate, parseTLEID
+
+
+#Values kept for every sample, all float32
+trackColumns = ["ra", "dec", "alt", "az", "raRate", "decRate", "altRate", "azRate", "rate", "range"]
+
+#Units of the columns for the tracking files
+trackUnits = {
+	"ra" : "hours",
+	"dec" : "deg",
+	"alt" : "deg",
+	"az" : "deg",
+	"raRate" : "deg/s",
+	"decRate" : "deg/s",
+	"altRate" : "deg/s",
+	"azRate" : "deg/s",
+	"rate" : "deg/s",
+	"range" : "km"
+}
+
+
+
+
+# Samples of many passes packed end to end, the samples of pass i are offsets[i] to offsets[i + 1]
+# Every pass is sampled every step seconds from its own start time, so the times are not stored
+# RA and Dec are astrometric like the ephemeris of a pass, the rates are worked out from the
+# SGP4 velocities so there is no second propagation, see raDecRates()
+# Args: name = array of string, id = array of string, start = array of datetime64, step = num seconds,
+#       offsets = array of int, columns = dict of name : float32 array
+class TrackingEphemeris:
+
+	def __init__(self, name, id, start, step, offsets, columns):
+		self.name = np.asarray(name, dtype=str)
+		self.id = np.asarray(id, dtype=str)
+		self.start = np.asarray(start, dtype="datetime64[us]")
+		self.step = float(step)
+		self.offsets = np.asarray(offsets, dtype=np.int64)
+		self.columns = columns
+
+
+	def __len__(self):
+		return len(self.start)
+
+
+	# Number of samples of every pass together
+	# Args: none
+	# Returns: int
+	def samples(self):
+		return int(self.offsets[-1])
+
+
+	# Times of the samples of one pass
+	# Args: i = int
+	# Returns: array of datetime64[us]
+	def times(self, i):
+		n = self.offsets[i + 1] - self.offsets[i]
+		return self.start[i] + np.round(np.arange(n) * self.step * 1e6).astype("timedelta64[us]")
+
+
+	# Every sample of one pass, the arrays share memory with the ephemeris
+	# Args: i = int
+	# Returns: dict of name : array, with the times as time
+	def track(self, i):
+		samples = slice(self.offsets[i], self.offsets[i + 1])
+		output = {"name" : self.name[i], "id" : self.id[i], "time" : self.times(i)}
+		for column in trackColumns:
+			output[column] = self.columns[column][samples]
+		return output
+
+
+	# Save to a .npz file that loadTrackingEphemeris reads back
+	# Args: filename = string ending in .npz
+	# Returns: nothing
+	def save(self, filename):
+		np.savez(filename, name=self.name, id=self.id, start=self.start, step=self.step, offsets=self.offsets, **self.columns)
+
+
+	# Write one text file per pass for the mount, a line per sample with the UTC time and every column
+	# Args: directory = path
+	# Returns: array of filenames
+	def toTrackingFiles(self, directory):
+		if not os.path.isdir(directory):
+			os.makedirs(directory)
+
+		header = "utc " + " ".join("%s[%s]" % (column, trackUnits[column]) for column in trackColumns)
+		filenames = []
+		for i in range(len(self)):
+			track = self.track(i)
+			filename = os.path.join(directory, "%s_%s.txt" % (track["id"], track["time"][0].item().strftime("%Y%m%dT%H%M%S")))
+
+			times = np.datetime_as_string(track["time"], unit="ms")
+			values = np.column_stack([track[column] for column in trackColumns]).astype(float)
+			rows = [t + " " + " ".join("%.7f" % v for v in row) for t, row in zip(times, values)]
+
+			with open(filename, "w") as f:
+				f.write("# " + track["name"] + " " + track["id"] + "\n# " + header + "\n" + "\n".join(rows) + "\n")
+			filenames.append(filename)
+
+		return filenames
+
+
+
+
+# Load a tracking ephemeris saved with TrackingEphemeris.save
+# Args: filename = string
+# Returns: TrackingEphemeris
+def loadTrackingEphemeris(filename):
+	with np.load(filename, allow_pickle=False) as data:
+		return TrackingEphemeris(data["name"], data["id"], data["start"], data["step"], data["offsets"], {column : data[column] for column in trackColumns})
+
+
+
+
+# Dense ephemeris of every pass of a table, sampled every step seconds from rise to set or over a
+# window around the peak, e.g. before=offset and after=exposure time for just the first exposure
+# All of the samples are propagated together, each satellite in one SGP4 call per chunk of passes
+# A satellite with more than one element set is tracked with the newest, like mergeTLEs keeps
+# Args: passes = PassTable, tleList = array of tle, loc = skyfield Topos, context = EphemerisContext,
+#       step = num seconds, before = timedelta before the peak, after = timedelta after the peak,
+#       propagator = ConstellationPropagator of tleList, chunkSize = num of samples per batch
+# Returns: TrackingEphemeris
+def trackPasses(passes, tleList, loc, context=None, step=1.0, before=None, after=None, propagator=None, chunkSize=200000):
+	if context == None:
+		context = EphemerisContext()
+	ts = context.ts
+
+	with context.instruments.stage("trackPasses"):
+		if propagator == None:
+			propagator = ConstellationPropagator(tleList, context)
+
+		#Which TLE every pass is of, the newest epoch if a satellite has several
+		satellites = {}
+		for k, tle in enumerate(tleList):
+			noradID = parseTLEID(tle)
+			if noradID not in satellites or parseTLEdate(tle) > parseTLEdate(tleList[satellites[noradID]]):
+				satellites[noradID] = k
+		missing = [i for i in passes["id"] if i not in satellites]
+		if len(missing) > 0:
+			raise ValueError("No TLE for satellites " + ", ".join(sorted(set(missing))))
+		satIndex = np.array([satellites[i] for i in passes["id"]], dtype=int)
+
+		#Start and stop of every track, clipped to the pass
+		start = passes["riseTime"]
+		stop = passes["setTime"]
+		if before != None:
+			start = np.maximum(start, passes["maxTime"] - np.timedelta64(before, "us"))
+		if after != None:
+			stop = np.minimum(stop, passes["maxTime"] + np.timedelta64(after, "us"))
+
+		counts = np.floor((stop - start) / np.timedelta64(1, "us") / (step * 1e6)).astype(np.int64) + 1
+		counts = np.maximum(counts, 1)
+		offsets = np.zeros(len(passes) + 1, dtype=np.int64)
+		np.cumsum(counts, out=offsets[1:])
+
+		columns = {column : np.empty(offsets[-1], dtype=np.float32) for column in trackColumns}
+		observer = Observer(loc)
+
+		#Chunks of whole passes so memory stays bounded however long the night is
+		first = 0
+		while first < len(passes):
+			last = max(int(np.searchsorted(offsets, offsets[first] + chunkSize, side="right")) - 1, first + 1)
+			samples = slice(offsets[first], offsets[last])
+
+			#Seconds of every sample after the earliest start of the chunk
+			reference = start[first:last].min()
+			passStart = (start[first:last] - reference) / np.timedelta64(1, "s")
+			chunkCounts = counts[first:last]
+			k = np.arange(offsets[last] - offsets[first]) - np.repeat(offsets[first:last] - offsets[first], chunkCounts)
+			seconds = np.repeat(passStart, chunkCounts) + k * step
+
+			ref = reference.item()
+			t = ts.utc(ref.year, ref.month, ref.day, ref.hour, ref.minute, ref.second + ref.microsecond / 1e6 + seconds)
+
+			r, v, error = propagator.propagatePairs(np.repeat(satIndex[first:last], chunkCounts), t)
+			context.instruments.count("trackSamples", len(seconds))
+
+			alt, az, distance = observer.altAz(r)
+			altRate, azRate = observer.altAzRates(r, v)
+			ra, dec, raRate, decRate, rate = raDecRates(*itrfToGCRS(t, r - observer.position, v))
+
+			values = {"ra" : ra, "dec" : dec, "alt" : alt, "az" : az, "raRate" : raRate, "decRate" : decRate, "altRate" : altRate, "azRate" : azRate, "rate" : rate, "range" : distance}
+			for column in trackColumns:
+				value = values[column]
+				#Samples that failed to propagate
+				value[error != 0] = np.nan
+				columns[column][samples] = value
+
+			first = last
+
+	return TrackingEphemeris(passes["name"], passes["id"], start, step, offsets, columns)
@@ -22,47 +22,126 @@
 
 
 import datetime as dt
+import io
+import os
+import shutil
 
 
 
 # Writes an ACP observing script for the given events and imaging parameters
 # observations array should be list of format [[name, date, RA, Dec]]
-# Args: observations = array, exposure = num, repeat = num, filters = char, binning = num, imagepath = string, filename = string
-# Returns: nothing
-def writeAcpPlan(observations, Exposure=10, Repeat=1, Filters="v", Binning=1, imagePath = "E:\\data" , filename="plan.txt", shutdown=False):
-	
-	#Make a new file or overwrite an old one
-	f = open(filename, "w")
+# The plan is put together in memory, written to filename in one go, and then copied to each of copies
+# Args: observations = array, exposure = num, repeat = num, filters = char, binning = num, imagepath = string, filename = string,
+#       shutdown = bool, copies = array of more filenames
+# Returns: string plan
+def writeAcpPlan(observations, Exposure=10, Repeat=1, Filters="v", Binning=1, imagePath = "E:\\data" , filename="plan.txt", shutdown=False, copies=None):
 
-	#Header to state when plan starts and ends
-	f.write("; Start at %s\n" % (observations[0][1] - dt.timedelta(seconds = 300+480)).strftime('%Y/%m/%d %H:%M:%S'))
-	f.write("; End at %s\n\n\n" % observations[-1][1].strftime('%Y/%m/%d %H:%M:%S'))
+	text = renderAcpPlan(observations, Exposure, Repeat, Filters, Binning, imagePath, shutdown)
 
+	with open(filename, "w") as f:
+		f.write(text)
 
-	#Default save path format
-	f.write("#DIR " + imagePath + "\n\n\n")
+	#The same plan anywhere else it is needed, skipping the file just written
+	for copy in copies or []:
+		if os.path.abspath(copy) != os.path.abspath(filename):
+			shutil.copyfile(filename, copy)
 
-	#Disable dithering
-	f.write("#dither 0\n\n\n")
+	return text
 
 
-	#Autofocus
-	#Wait until 5min before first sat to autofocus
-	f.write("#WaitUntil 1, %s\n" % (observations[0][1] - dt.timedelta(seconds = 300)).strftime('%Y/%m/%d %H:%M:%S'))
-	f.write("#autofocus\n")
-	f.write("#nopreview\n")
-	f.write("#count 1\n")
-	f.write("#filter %s\n" % (Filters))
-	f.write("#interval %s\n" % (Exposure))
-	f.write("#binning %s\n" % (Binning))
-	#Point the telescope somewhere reasonable
-	f.write("#tag AltAz=%.5f,%.5f\n" % (90,75)) #az,alt
-	#Target name, 0, 0 
-	f.write("%s_\t0\t0\n\n\n" % ("autofocus"))
 
 
+# An ACP observing script as a string, see writeAcpPlan
+# Args: observations = array, exposure = num, repeat = num, filters = char, binning = num, imagepath = string, shutdown = bool
+# Returns: string plan
+def renderAcpPlan(observations, Exposure=10, Repeat=1, Filters="v", Binning=1, imagePath = "E:\\data", shutdown=False):
+
+	buffer = io.StringIO()
+	plan = AcpPlanWriter(buffer, Exposure, Repeat, Filters, Binning, imagePath, shutdown)
+
 	#Add the instructions for each observation
 	for obs in observations:
+		plan.add(obs)
+
+	#Fill in the end time
+	plan.close()
+
+	return buffer.getvalue()
+
+
+
+
+# Writes an ACP observing script one observation at a time as they become available
+# The end time in the header is left blank and filled in when the plan is closed
+# A file object given instead of a filename is written to but left open, e.g. an io.StringIO
+# Args: filename = string or file, exposure = num, repeat = num, filters = char, binning = num, imagepath = string, shutdown = bool
+class AcpPlanWriter:
+
+	def __init__(self, filename="plan.txt", Exposure=10, Repeat=1, Filters="v", Binning=1, imagePath = "E:\\data", shutdown=False):
+		self.Exposure = Exposure
+		self.Repeat = Repeat
+		self.Filters = Filters
+		self.Binning = Binning
+		self.imagePath = imagePath
+		self.shutdown = shutdown
+
+		#Make a new file or overwrite an old one
+		self.ownsFile = isinstance(filename, (str, os.PathLike))
+		self.f = open(filename, "w") if self.ownsFile else filename
+		self.endPosition = None
+		self.last = None
+		self.count = 0
+		self.closed = False
+
+
+	def __enter__(self):
+		return self
+
+
+	def __exit__(self, *args):
+		self.close()
+
+
+	# Write the header, it needs the time of the first observation
+	# Args: date = datetime
+	# Returns: nothing
+	def writeHeader(self, date):
+		f = self.f
+
+		#Header to state when plan starts and ends
+		f.write("; Start at %s\n" % (date - dt.timedelta(seconds = 300+480)).strftime('%Y/%m/%d %H:%M:%S'))
+		f.write("; End at ")
+		self.endPosition = f.tell()
+		f.write("%s\n\n\n" % date.strftime('%Y/%m/%d %H:%M:%S'))
+
+
+		#Default save path format
+		f.write("#DIR " + self.imagePath + "\n\n\n")
+
+		#Disable dithering
+		f.write("#dither 0\n\n\n")
+
+
+		#Autofocus
+		#Wait until 5min before first sat to autofocus
+		f.write("#WaitUntil 1, %s\n" % (date - dt.timedelta(seconds = 300)).strftime('%Y/%m/%d %H:%M:%S'))
+		f.write("#autofocus\n")
+		f.write("#nopreview\n")
+		f.write("#count 1\n")
+		f.write("#filter %s\n" % (self.Filters))
+		f.write("#interval %s\n" % (self.Exposure))
+		f.write("#binning %s\n" % (self.Binning))
+		#Point the telescope somewhere reasonable
+		f.write("#tag AltAz=%.5f,%.5f\n" % (90,75)) #az,alt
+		#Target name, 0, 0 
+		f.write("%s_\t0\t0\n\n\n" % ("autofocus"))
+
+
+	# Add the instructions for one observation
+	# Args: obs = [name, date, offset, RA, Dec]
+	# Returns: nothing
+	def add(self, obs):
+		f = self.f
 
 		name = obs[0]
 		date = obs[1]
@@ -70,6 +149,9 @@ def writeAcpPlan(observations, Exposure=10, Repeat=1, Filters="v", Binning=1, im
 		RA = obs[3]
 		Dec = obs[4]
 
+		if self.count == 0:
+			self.writeHeader(date)
+
 		#Some comments for denoting the target
 		f.write(";Sat %s at %s UT\n" % (name,date.strftime('%Y-%m-%d %H:%M:%S')))
 		f.write(";----------------------------------------------------------------------------\n")
@@ -82,11 +164,11 @@ def writeAcpPlan(observations, Exposure=10, Repeat=1, Filters="v", Binning=1, im
 		#Take image because we have to
 		f.write("#count 1\n")
 		#Which filters to use, eg "r,i,z"
-		f.write("#filter %s\n" % (Filters))
+		f.write("#filter %s\n" % (self.Filters))
 		#How long to expose for, eg "10,10,10"
-		f.write("#interval %s\n" % (Exposure))
+		f.write("#interval %s\n" % (self.Exposure))
 		#How many pixels to bin in a square pattern, eg "1,1,1"
-		f.write("#binning %s\n" % (Binning))
+		f.write("#binning %s\n" % (self.Binning))
 
 		#Target name, RA, Dec 
 		f.write("%s_Bkgd_\t%s\t%s\n\n" % (name, RA, Dec))
@@ -94,13 +176,13 @@ def writeAcpPlan(observations, Exposure=10, Repeat=1, Filters="v", Binning=1, im
 
 		f.write("#nopreview\n")
 		#How many exposures to make of this target eg "1,1,1"
-		f.write("#count %s\n" % (Repeat))
+		f.write("#count %s\n" % (self.Repeat))
 		#Which filters to use, eg "r,i,z"
-		f.write("#filter %s\n" % (Filters))
+		f.write("#filter %s\n" % (self.Filters))
 		#How long to expose for, eg "10,10,10"
-		f.write("#interval %s\n" % (Exposure))
+		f.write("#interval %s\n" % (self.Exposure))
 		#How many pixels to bin in a square pattern, eg "1,1,1"
-		f.write("#binning %s\n" % (Binning))
+		f.write("#binning %s\n" % (self.Binning))
 
 		#Wait until UTC time - offset to start
 		f.write("#WaitUntil 1, %s\n" % (date - dt.timedelta(seconds = offset)).strftime('%Y/%m/%d %H:%M:%S'))
@@ -108,12 +190,32 @@ def writeAcpPlan(observations, Exposure=10, Repeat=1, Filters="v", Binning=1, im
 		#Target name, RA, Dec 
 		f.write("%s_\t%s\t%s\n\n\n" % (name, RA, Dec))
 
+		#Flush so the plan can be read while more observations are still coming
+		f.flush()
+
+		self.last = date
+		self.count += 1
+
+
+	# Fill in the end time, add the shutdown, and close the file
+	# Args: none
+	# Returns: nothing
+	def close(self):
+		if self.closed:
+			return
+
+		if self.shutdown:
+			self.f.write("#shutdown\n")
 
-	if shutdown:
-		f.write("#shutdown\n")
+		#The end time has the same length as the placeholder so it can be written over it
+		if self.endPosition != None:
+			self.f.seek(self.endPosition)
+			self.f.write(self.last.strftime('%Y/%m/%d %H:%M:%S'))
+			self.f.seek(0, io.SEEK_END)
 
-	#Close the file for prosperity 
-	f.close()
+		self.closed = True
+		if self.ownsFile:
+			self.f.close()
 
 
 